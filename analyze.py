@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Batch analysis of positions from EPD/FEN or PGN files. Each position gets a
+bounded search in a pool of worker processes, and the results are written
+as one JSON object per line, in input order. Input is streamed, so files of
+any size work, and --resume skips the positions already in the output.
+
+    python analyze.py puzzles.epd --depth 3 --jobs 4 --output puzzles.jsonl
+    python analyze.py games.pgn --output games.jsonl --resume
+    python analyze.py puzzles.epd --multipv 3
+    python analyze.py mates.epd --mate 4
+    python analyze.py puzzles.epd --nodes 2000 --depth 20
+"""
+
+# Imports
+import argparse
+import json
+import os
+import sys
+from itertools import islice
+from multiprocessing import Pool
+from time import perf_counter
+from classes import Chessboard, move_to_text
+from pgn import read_games, replay
+from search import Searcher
+from mate import MateSearch
+
+# Constants
+batch_size = 16 # Positions handed to the pool at a time, per worker
+
+
+# Functions
+def read_epd(lines, name='input'):
+    """Generator over the positions of an EPD or FEN file. Yields tasks of
+    (position id, FEN, extra fields). EPD positions use their id opcode when
+    they have one, and keep their bm (best move) opcode and their c9 opcode
+    as the game result."""
+    for line_num, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 4)
+        position_id = "{}:{}".format(name, line_num)
+        extra = {}
+        # FEN has move counters after the four position fields, EPD opcodes
+        counters = fields[4].split()[:2] if len(fields) > 4 else []
+        if len(counters) == 2 and all(i.isdigit() for i in counters):
+            fen = " ".join(fields[:4] + counters)
+        else:
+            fen = " ".join(fields[:4])
+            for op in (fields[4] if len(fields) > 4 else '').split(';'):
+                op = op.strip().split(None, 1)
+                if len(op) == 2 and op[0] == 'id':
+                    position_id = op[1].strip('"')
+                elif len(op) == 2 and op[0] == 'bm':
+                    extra['bm'] = op[1]
+                elif len(op) == 2 and op[0] == 'c9':
+                    extra['result'] = op[1].strip('"')
+        yield position_id, fen, extra
+
+
+def read_pgn(lines, name='input'):
+    """Generator over the positions before every move of every game in a
+    PGN file. The move played and the game's result are kept as extra
+    fields. A game with an unreadable move is cut off there."""
+    for game_num, (headers, sans) in enumerate(read_games(lines), 1):
+        try:
+            result = headers.get('Result', '*')
+            for board, san, move in replay(headers, sans):
+                position_id = "{}:{}:{}".format(name, game_num,
+                                                board.turn_num)
+                yield position_id, board.get_fen(), {'played': san,
+                                                     'result': result}
+        except ValueError as error:
+            print("Game {}: {}".format(game_num, error), file=sys.stderr)
+
+
+def read_positions(path):
+    """Streams the tasks of a file, picking the reader by extension."""
+    name = os.path.basename(path)
+    with open(path) as f:
+        reader = read_pgn if path.lower().endswith('.pgn') else read_epd
+        yield from reader(f, name)
+
+
+def analyze_position(task, depth, multipv=1, mate=0, nodes=None):
+    """Searches one (position id, FEN, extra fields) task to depth, or as
+    deep as a node budget allows. Returns a dict ready to be written as
+    JSON. With multipv above 1 it also holds the best multipv moves with
+    their scores and lines, and with mate above 0 the shortest mate in at
+    most mate moves the mate search proves."""
+    position_id, fen, extra = task
+    result = {'id': position_id, 'fen': fen}
+    result.update(extra)
+    try:
+        board = Chessboard()
+        board.full_set_up('fen', fen=fen)
+    except (ValueError, KeyError, IndexError):
+        result['error'] = "Invalid FEN"
+        return result
+    searcher = Searcher()
+    start = perf_counter()
+    if multipv > 1:
+        lines = searcher.search_multipv(board, depth, multipv, nodes=nodes)
+        move, score = lines[0][:2] if lines else (None, -float('inf'))
+        result['lines'] = [{'move': move_to_text(m), 'score': s,
+                            'pv': [move_to_text(i) for i in pv]}
+                           for m, s, pv in lines]
+    else:
+        move, score = searcher.search(board, depth, nodes=nodes)
+    result['best'] = move_to_text(move) if move is not None else None
+    result['score'] = score if abs(score) != float('inf') else None
+    result['depth'] = searcher.depth_done
+    result['nodes'] = searcher.stats.nodes
+    if mate:
+        solver = MateSearch()
+        found = solver.solve(board, mate)
+        result['mate'] = found[1] if found else None
+        result['mate_line'] = [move_to_text(m) for m in found[2]] \
+            if found else None
+        result['mate_outcome'] = solver.outcome
+        result['mate_nodes'] = solver.nodes
+    result['seconds'] = round(perf_counter() - start, 3)
+    return result
+
+
+def analyze_task(args):
+    """analyze_position for Pool.imap, which passes a single argument."""
+    return analyze_position(*args)
+
+
+def count_done(path):
+    """Number of complete lines in an earlier output file. A line cut off
+    by an interrupted run is removed so it can be written again."""
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    return data[:end].count(b'\n')
+
+
+def analyze(tasks, out, depth, jobs=None, multipv=1, mate=0, nodes=None):
+    """Runs analyze_position over tasks in a process pool and writes each
+    result to out as soon as it and the ones before it are done. Only a few
+    batches of tasks are read ahead, since Pool.imap would otherwise read
+    all of them. Returns the number of positions written."""
+    written = 0
+    jobs = jobs or os.cpu_count() or 1
+    with Pool(jobs) as pool:
+        chunk = batch_size * jobs
+        while True:
+            batch = [(task, depth, multipv, mate, nodes)
+                     for task in islice(tasks, chunk)]
+            if not batch:
+                break
+            for result in pool.imap(analyze_task, batch):
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+                written += 1
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('input', help="An .epd, .fen or .pgn file.")
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--multipv', type=int, default=1,
+                        help="Number of best moves to report per position.")
+    parser.add_argument('--nodes', type=int, help="Node budget per "
+                        "position. --depth is then only a maximum.")
+    parser.add_argument('--mate', type=int, default=0,
+                        help="Also look for mates in up to this many moves "
+                             "with the mate search.")
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Worker processes. Defaults to the CPU count.")
+    parser.add_argument('--output', help="JSON-lines file. Defaults to "
+                        "standard output.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Skip as many positions as --output holds and "
+                             "append to it.")
+    args = parser.parse_args()
+
+    tasks = read_positions(args.input)
+    if args.output:
+        done = count_done(args.output) if args.resume else 0
+        tasks = islice(tasks, done, None)
+        out = open(args.output, 'a' if args.resume else 'w')
+    else:
+        done, out = 0, sys.stdout
+    start = perf_counter()
+    written = analyze(tasks, out, args.depth, args.jobs, args.multipv,
+                      args.mate, args.nodes)
+    if out is not sys.stdout:
+        out.close()
+    print("Analyzed {} positions in {:.1f}s ({} skipped as done).".format(
+        written, perf_counter() - start, done), file=sys.stderr)
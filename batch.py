@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Move generation for many boards at once, for self-play and data generation
+where thousands of independent games would each pay the Chessboard's per
+piece Python overhead. A BoardBatch holds B positions as NumPy arrays: a
+B x 2 x 6 stack of 64-bit bitboards, one per color and piece type, with one
+bit per square (y * 8 + x). Attacks, pseudo-legal moves and the boards after
+one move each are worked out for the whole batch with array operations.
+
+The moves are the packed moves of classes.py, the same as each board's
+v_moves for the side to move, and the attack maps the same as its attacks.
+Running the module checks that on random playouts against Chessboard, and
+times the two.
+
+    python batch.py --games 32 --plies 60
+"""
+
+# Imports
+import argparse
+from time import perf_counter
+import numpy as np
+from classes import (color_list, piece_types, quiet_move,
+                     double_push, king_castle, queen_castle, capture_move,
+                     en_passant, promotion_move, promotion_capture,
+                     encode_move, fen_letters, square_names)
+
+# Constants
+pawn, knight, bishop, rook, queen, king = range(len(piece_types))
+all_bits = np.uint64((1 << 64) - 1)
+not_a = np.uint64(sum(1 << (y * 8) for y in range(8)) ^ ((1 << 64) - 1))
+not_h = np.uint64(sum(1 << (y * 8 + 7) for y in range(8)) ^
+                  ((1 << 64) - 1))
+# (shift, mask of squares a step can land on without wrapping a file)
+orthogonal = [(8, all_bits), (-8, all_bits), (1, not_a), (-1, not_h)]
+diagonal = [(9, not_a), (7, not_h), (-7, not_a), (-9, not_h)]
+queen_promotion = promotion_move + 3
+queen_capture = promotion_capture + 3
+last_ranks = np.uint64(0xff | 0xff << 56)
+# Castles: flag, files of the king's destination, of the squares that must
+# be empty and of those the opponent mustn't attack, and of the rook's origin
+# and destination
+castles = [(king_castle, 6, [5, 6], [6, 5, 4], 7, 5),
+           (queen_castle, 2, [1, 2, 3], [2, 3, 4], 0, 3)]
+
+
+# Functions
+def step_table(steps):
+    """Bitboards of the squares one of steps (x, y) away from each square."""
+    table = []
+    for sq in range(64):
+        x, y = sq & 7, sq >> 3
+        table += [sum(1 << ((y + dy) * 8 + x + dx) for dx, dy in steps
+                      if 0 <= x + dx < 8 and 0 <= y + dy < 8)]
+    return np.array(table, dtype=np.uint64)
+
+
+knight_table = step_table([(1, 2), (2, 1), (2, -1), (1, -2), (-1, -2),
+                           (-2, -1), (-2, 1), (-1, 2)])
+king_table = step_table([(1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0),
+                         (-1, -1), (0, -1), (1, -1)])
+pawn_tables = np.array([step_table([(1, 1), (-1, 1)]),
+                        step_table([(1, -1), (-1, -1)])])
+square_bits = np.array([1 << sq for sq in range(64)], dtype=np.uint64)
+
+
+def shift(bits, n):
+    """Bitboards moved n squares up the board (down if n is negative)."""
+    return bits << np.uint64(n) if n > 0 else bits >> np.uint64(-n)
+
+
+def slide(bits, empty, n, mask):
+    """Squares attacked by sliders on bits stepping n at a time over the
+    empty squares, up to and including the first piece in the way. A
+    Kogge-Stone fill, three shifts instead of seven steps."""
+    empty = empty & mask
+    bits = bits | empty & shift(bits, n)
+    empty = empty & shift(empty, n)
+    bits = bits | empty & shift(bits, 2 * n)
+    empty = empty & shift(empty, 2 * n)
+    bits = bits | empty & shift(bits, 4 * n)
+    return shift(bits, n) & mask
+
+
+def unpack(bits):
+    """A 64-column array of booleans for an array of bitboards."""
+    bytes_ = np.ascontiguousarray(bits, dtype='<u8').view(np.uint8)
+    return np.unpackbits(bytes_.reshape(-1, 8), axis=1,
+                         bitorder='little').astype(bool)
+
+
+def group_starts(keys):
+    """For sorted keys, the keys present and where each one's run starts,
+    for the reduceat ufunc methods."""
+    return np.unique(keys, return_index=True)
+
+
+# Classes
+class BoardBatch:
+    """B positions as arrays. pieces[i, color code, type code] is a
+    bitboard, unmoved has a bit for each piece with nothing in its hist
+    (which decides double pushes and castling, as on a Chessboard), ep is
+    the square of a pawn that just made a double push or -1, and turn is
+    the color code of the side to move."""
+    def __init__(self, pieces, unmoved, ep, turn, halfmove, fullmove):
+        self.pieces = pieces
+        self.unmoved = unmoved
+        self.ep = ep
+        self.turn = turn
+        self.halfmove = halfmove
+        self.fullmove = fullmove
+
+    def __len__(self):
+        return len(self.turn)
+
+    def __repr__(self):
+        return "BoardBatch({} boards)".format(len(self))
+
+    def __getitem__(self, index):
+        """The boards at an index array or mask, as a new batch. An index
+        can repeat a board, to make copies of it."""
+        return BoardBatch(self.pieces[index], self.unmoved[index],
+                          self.ep[index], self.turn[index],
+                          self.halfmove[index], self.fullmove[index])
+
+    @classmethod
+    def from_boards(cls, boards):
+        pieces = np.zeros((len(boards), len(color_list), len(piece_types)),
+                          dtype=np.uint64)
+        unmoved = np.zeros(len(boards), dtype=np.uint64)
+        ep = np.full(len(boards), -1, dtype=np.int8)
+        for i, board in enumerate(boards):
+            for piece in board.alive:
+                bit = np.uint64(1 << piece.sq)
+                pieces[i, piece.color_id, piece.type_id] |= bit
+                if piece.hist.len == 0:
+                    unmoved[i] |= bit
+            last = board.last_move
+            if last is not None and last >> 12 == double_push:
+                ep[i] = last >> 6 & 63
+        turn = np.array([color_list.index(board.turn) for board in boards],
+                        dtype=np.int8)
+        halfmove = np.array([board.halfmove_clock for board in boards],
+                            dtype=np.int16)
+        fullmove = np.array([(board.turn_num - 1) // 2 + 1
+                             for board in boards], dtype=np.int32)
+        return cls(pieces, unmoved, ep, turn, halfmove, fullmove)
+
+    def occupancy(self):
+        """Bitboards of each color's pieces, B x 2."""
+        return np.bitwise_or.reduce(self.pieces, axis=2)
+
+    def piece_list(self):
+        """Board, color code, type code and square of every piece, as four
+        arrays sorted by board, then color, then type."""
+        bits = unpack(self.pieces.reshape(-1)).reshape(len(self), 2, 6, 64)
+        return np.nonzero(bits)
+
+    def piece_attacks(self, boards, colors, types, squares):
+        """Bitboard of the squares each piece in a piece_list attacks."""
+        attacks = np.zeros(len(boards), dtype=np.uint64)
+        for ptype, table in [(knight, knight_table), (king, king_table)]:
+            mine = types == ptype
+            attacks[mine] = table[squares[mine]]
+        mine = types == pawn
+        attacks[mine] = pawn_tables[colors[mine], squares[mine]]
+        empty = ~np.bitwise_or.reduce(self.occupancy(), axis=1)
+        for directions, sliders in [(orthogonal, [rook, queen]),
+                                    (diagonal, [bishop, queen])]:
+            mine = np.isin(types, sliders)
+            bits, free = square_bits[squares[mine]], empty[boards[mine]]
+            found = np.zeros(len(bits), dtype=np.uint64)
+            for n, mask in directions:
+                found |= slide(bits, free, n, mask)
+            attacks[mine] |= found
+        return attacks
+
+    def attacked(self, pieces=None):
+        """Bitboards of the squares each color attacks, B x 2."""
+        boards, colors, types, squares = pieces or self.piece_list()
+        attacks = self.piece_attacks(boards, colors, types, squares)
+        result = np.zeros(len(self) * 2, dtype=np.uint64)
+        present, starts = group_starts(boards * 2 + colors)
+        if len(present):
+            result[present] = np.bitwise_or.reduceat(attacks, starts)
+        return result.reshape(len(self), 2)
+
+    def attack_maps(self):
+        """How many pieces of each color attack each square, B x 2 x 64,
+        like Chessboard.attacks."""
+        boards, colors, types, squares = self.piece_list()
+        attacks = unpack(self.piece_attacks(boards, colors, types, squares))
+        result = np.zeros((len(self) * 2, 64), dtype=np.int16)
+        present, starts = group_starts(boards * 2 + colors)
+        if len(present):
+            result[present] = np.add.reduceat(attacks, starts, axis=0)
+        return result.reshape(len(self), 2, 64)
+
+    def generate(self):
+        """The pseudo-legal moves of the side to move on every board, like
+        get_all_moves. Returns two arrays: the board each move is on, in
+        order, and the packed moves."""
+        pieces = self.piece_list()
+        boards, colors, types, squares = pieces
+        occupied = self.occupancy()
+        everything = occupied[:, 0] | occupied[:, 1]
+        turn = self.turn.astype(np.intp)
+        arange = np.arange(len(self))
+        enemy = occupied[arange, 1 - turn]
+
+        # Per piece of the side to move, bitboards of moves by flag
+        mine = colors == turn[boards]
+        boards, colors, types, squares = [i[mine] for i in pieces]
+        attacks = self.piece_attacks(boards, colors, types, squares)
+        found = [] # (piece, destinations, flag)
+        pawns = types == pawn
+        others = ~pawns
+        found += [(others, attacks & ~everything[boards], quiet_move),
+                  (others, attacks & enemy[boards], capture_move)]
+        bits = square_bits[squares]
+        up = np.where(colors == 0, 8, -8)
+        single = np.where(colors == 0, bits << np.uint64(8),
+                          bits >> np.uint64(8)) & ~everything[boards]
+        double = np.where(colors == 0, single << np.uint64(8),
+                          single >> np.uint64(8)) & ~everything[boards]
+        double &= np.where(self.unmoved[boards] & bits, all_bits,
+                           np.uint64(0))
+        captures = attacks & enemy[boards]
+        found += [(pawns, single & ~last_ranks, quiet_move),
+                  (pawns, single & last_ranks, queen_promotion),
+                  (pawns, double, double_push),
+                  (pawns, captures & ~last_ranks, capture_move),
+                  (pawns, captures & last_ranks, queen_capture)]
+        # En passant onto the square behind a pawn that just double pushed
+        ep = self.ep[boards].astype(np.intp)
+        behind = np.where(ep >= 0, ep + up, 0)
+        ep_bits = np.where(ep >= 0, square_bits[behind], np.uint64(0))
+        found += [(pawns, attacks & ep_bits & ~everything[boards],
+                   en_passant)]
+
+        board_ids, moves = [], []
+        for which, targets, flag in found:
+            rows, dests = np.nonzero(unpack(np.where(which, targets,
+                                                     np.uint64(0))))
+            board_ids += [boards[rows]]
+            moves += [squares[rows] | dests << 6 | flag << 12]
+        castle_boards, castle_moves = self.castles(pieces, everything)
+        board_ids += [castle_boards]
+        moves += [castle_moves]
+        board_ids, moves = np.concatenate(board_ids), np.concatenate(moves)
+        order = np.argsort(board_ids, kind='stable')
+        return board_ids[order], moves[order].astype(np.int32)
+
+    def castles(self, pieces, everything):
+        """Castling moves of the side to move, as generate returns moves.
+        Kings on e1 or e8 that haven't moved can castle with an unmoved
+        rook of theirs in a corner of the same rank, over empty squares
+        that the opponent doesn't attack, as in get_valid_castles."""
+        attacked = self.attacked(pieces)
+        turn = self.turn.astype(np.intp)
+        arange = np.arange(len(self))
+        kings = self.pieces[arange, turn, king] & self.unmoved
+        rooks = self.pieces[arange, turn, rook] & self.unmoved
+        danger = attacked[arange, 1 - turn]
+        board_ids, moves = [], []
+        for y in [0, 7]:
+            for flag, dest, empty, safe, rook_orig, rook_dest in castles:
+                empty_bits = np.uint64(sum(1 << (y * 8 + x) for x in empty))
+                safe_bits = np.uint64(sum(1 << (y * 8 + x) for x in safe))
+                ok = ((kings & square_bits[y * 8 + 4]) != 0) & \
+                    ((rooks & square_bits[y * 8 + rook_orig]) != 0) & \
+                    (everything & empty_bits == 0) & \
+                    (danger & safe_bits == 0)
+                found = np.nonzero(ok)[0]
+                board_ids += [found]
+                moves += [np.full(len(found),
+                                  encode_move((4, y), (dest, y), flag))]
+        return np.concatenate(board_ids), np.concatenate(moves)
+
+    def play(self, moves):
+        """A new batch with moves[i], one of generate's, made on board i.
+        Promotions become the piece their flag names."""
+        moves = np.asarray(moves, dtype=np.int64)
+        after = self[np.arange(len(self))]
+        arange = np.arange(len(self))
+        orig, dest, flag = moves & 63, moves >> 6 & 63, moves >> 12
+        orig_bits, dest_bits = square_bits[orig], square_bits[dest]
+        turn = self.turn.astype(np.intp)
+        mover = np.argmax(self.pieces[arange, turn] & orig_bits[:, None] != 0,
+                          axis=1)
+        captured = (self.pieces[arange, 1 - turn] & dest_bits[:, None]).any(
+            axis=1)
+        # Captures, including the pawn taken en passant
+        after.pieces[arange, 1 - turn] &= ~dest_bits[:, None]
+        passing = flag == en_passant
+        taken = np.where(passing, dest - np.where(turn == 0, 8, -8), 0)
+        after.pieces[arange[passing], 1 - turn[passing], pawn] &= \
+            ~square_bits[taken[passing]]
+        # The piece, or what it promotes to
+        promoted = flag & promotion_move != 0
+        lands = np.where(promoted, knight + (flag & 3), mover)
+        after.pieces[arange, turn, mover] &= ~orig_bits
+        after.pieces[arange, turn, lands] |= dest_bits
+        after.unmoved &= ~(orig_bits | dest_bits)
+        after.unmoved[promoted] |= dest_bits[promoted]
+        # The rook of a castle
+        for castle_flag, dest_x, empty, safe, rook_from, rook_to in castles:
+            castling = np.nonzero(flag == castle_flag)[0]
+            rank = dest[castling] & ~7
+            rook_bits = square_bits[rank + rook_from] | \
+                square_bits[rank + rook_to]
+            after.pieces[castling, turn[castling], rook] ^= rook_bits
+            after.unmoved[castling] &= ~rook_bits
+        after.ep = np.where(flag == double_push, dest, -1).astype(np.int8)
+        after.halfmove = np.where(captured | passing | (mover == pawn), 0,
+                                  self.halfmove + 1).astype(np.int16)
+        after.fullmove = self.fullmove + (turn == 1)
+        after.turn = (1 - turn).astype(np.int8)
+        return after
+
+    def king_attacked(self, colors):
+        """Mask of the boards where the king of color code colors[i] is
+        attacked, or missing. Looks out from the king square for each kind
+        of attacker, rather than working out every piece's attacks."""
+        arange = np.arange(len(self))
+        colors = np.asarray(colors, dtype=np.intp)
+        kings = self.pieces[arange, colors, king]
+        has_king = kings != 0
+        # Kings are single bits, which floats hold exactly
+        squares = np.log2(np.where(has_king, kings, np.uint64(1)).astype(
+            np.float64)).astype(np.intp)
+        enemy = self.pieces[arange, 1 - colors]
+        hit = (knight_table[squares] & enemy[:, knight]) | \
+            (king_table[squares] & enemy[:, king]) | \
+            (pawn_tables[colors, squares] & enemy[:, pawn])
+        empty = ~np.bitwise_or.reduce(self.occupancy(), axis=1)
+        for directions, slider in [(orthogonal, rook), (diagonal, bishop)]:
+            found = np.zeros(len(self), dtype=np.uint64)
+            for n, mask in directions:
+                found |= slide(kings, empty, n, mask)
+            hit |= found & (enemy[:, slider] | enemy[:, queen])
+        return ~has_king | (hit != 0)
+
+    def in_check(self):
+        """Mask of the boards where the side to move is in check."""
+        return self.king_attacked(self.turn) & \
+            (self.pieces[np.arange(len(self)), self.turn.astype(np.intp),
+                         king] != 0)
+
+    def legal(self, board_ids, moves):
+        """Mask of the moves from generate that don't leave the mover's
+        king attacked, or without a king, found by making them all on one
+        big batch of copies."""
+        after = self[board_ids].play(moves)
+        return ~after.king_attacked(1 - after.turn.astype(np.intp))
+
+    def legal_moves(self):
+        """generate, keeping only the legal moves."""
+        board_ids, moves = self.generate()
+        keep = self.legal(board_ids, moves)
+        return board_ids[keep], moves[keep]
+
+    def random_moves(self, rng):
+        """A random legal move on each board that has one, for playouts.
+        Returns the boards' indexes and their moves, ready for
+        self[boards].play(moves)."""
+        board_ids, moves = self.legal_moves()
+        boards, starts, counts = np.unique(board_ids, return_index=True,
+                                           return_counts=True)
+        return boards, moves[starts + rng.integers(0, counts)]
+
+    def fens(self):
+        """FEN strings of the boards. Castling rights are read from the
+        unmoved kings and rooks, as Chessboard.get_fen does."""
+        result = []
+        grid = unpack(self.pieces.reshape(-1)).reshape(len(self), 12, 64)
+        unmoved = unpack(self.unmoved)
+        for i in range(len(self)):
+            letters = ['.'] * 64
+            for plane, sq in zip(*np.nonzero(grid[i])):
+                letter = fen_letters[plane % 6]
+                letters[sq] = letter.upper() if plane < 6 else letter
+            rows = []
+            for y in range(7, -1, -1):
+                row = "".join(letters[y * 8:y * 8 + 8])
+                for n in range(8, 0, -1):
+                    row = row.replace('.' * n, str(n))
+                rows += [row]
+            rights = ''
+            for y, king_letter in [(0, 'K'), (7, 'k')]:
+                if letters[y * 8 + 4] != king_letter or \
+                        not unmoved[i, y * 8 + 4]:
+                    continue
+                for x, side in [(7, 'k'), (0, 'q')]:
+                    rook_letter = 'R' if y == 0 else 'r'
+                    if letters[y * 8 + x] == rook_letter and \
+                            unmoved[i, y * 8 + x]:
+                        rights += side.upper() if y == 0 else side
+            ep = '-'
+            if self.ep[i] >= 0:
+                ep = square_names[self.ep[i] + (-8 if self.turn[i] else 8)]
+            result += [" ".join(["/".join(rows), 'wb'[self.turn[i]],
+                                 rights or '-', ep, str(self.halfmove[i]),
+                                 str(self.fullmove[i])])]
+        return result
+
+
+if __name__ == "__main__":
+    from classes import Chessboard
+    from search import make_move
+    from simulate import get_all_moves
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--games', type=int, default=32)
+    parser.add_argument('--plies', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    boards = []
+    for i in range(args.games):
+        board = Chessboard()
+        board.full_set_up()
+        boards += [board]
+    mismatches, positions = 0, 0
+    scalar_time = batch_time = 0.0
+    for ply in range(args.plies):
+        if not boards:
+            break
+        start = perf_counter()
+        batch = BoardBatch.from_boards(boards)
+        board_ids, moves = batch.generate()
+        legal = batch.legal(board_ids, moves)
+        maps = batch.attack_maps()
+        checks = batch.in_check()
+        batch_time += perf_counter() - start
+        chosen, survivors = [], []
+        for i, board in enumerate(boards):
+            positions += 1
+            start = perf_counter()
+            board.reset_info()
+            board.get_unobstructed_moves()
+            board.get_valid_moves()
+            board.get_valid_castles()
+            pseudo = get_all_moves(board)
+            scalar_time += perf_counter() - start
+            found = moves[board_ids == i]
+            legal_found = set(found[legal[board_ids == i]].tolist())
+            scalar_legal = {move for move in pseudo
+                            if make_move(board, move) is not None}
+            if (sorted(found.tolist()) != sorted(pseudo) or
+                    legal_found != scalar_legal or
+                    checks[i] != board.is_in_check(board.turn) or
+                    not np.array_equal(maps[i], board.attacks)):
+                mismatches += 1
+                print("Mismatch:", board.get_fen())
+            if scalar_legal and not board.draw_check():
+                chosen += [sorted(scalar_legal)[rng.integers(
+                    len(scalar_legal))]]
+                survivors += [i]
+        if not survivors:
+            break
+        played = batch[np.array(survivors)].play(np.array(chosen))
+        boards = [boards[i] for i in survivors]
+        for board, move in zip(boards, chosen):
+            board.play_move(move)
+        expected = BoardBatch.from_boards(boards)
+        for name in ['pieces', 'unmoved', 'ep', 'turn', 'halfmove',
+                     'fullmove']:
+            if not np.array_equal(getattr(played, name),
+                                  getattr(expected, name)):
+                mismatches += 1
+                print("Mismatch in {} after ply {}".format(name, ply + 1))
+    print("{} positions, {} mismatches".format(positions, mismatches))
+    print("Move generation: scalar {:,.0f} positions/s, batch {:,.0f} "
+          "positions/s (with legality and attack maps)".format(
+              positions / scalar_time, positions / batch_time))
@@ -7,9 +7,10 @@ Some classes for setting up a simple chess-bot.
 
 # Package import statements
 import numpy as np
-from random import sample
-from pretty_board import pretty_board
+from random import sample, Random
 from flavor import flavor_spitter
+from evaluation import (pvals, pawn_units, phase_weights, square_values,
+                        weights)
 
 
 # Define Constants
@@ -24,6 +25,51 @@ for x in range(8):
         lookup_dict[(x,y)] = x_index[x] + '_' + str(y_index[y])
         rev_lookup['_'.join([x_index[x], str(y_index[y])])] = (x,y)
 
+# Zobrist keys used to hash positions for the search's transposition table
+piece_types = ['pawn', 'knight', 'bishop', 'rook', 'queen', 'king']
+zobrist_rng = Random(1234)
+zobrist_pieces = {(color, ptype, x, y): zobrist_rng.getrandbits(64)
+                  for color in color_list for ptype in piece_types
+                  for x in range(8) for y in range(8)}
+zobrist_castle = {(x, y): zobrist_rng.getrandbits(64)
+                  for x in [0, 7] for y in [0, 7]}
+zobrist_ep = [zobrist_rng.getrandbits(64) for x in range(8)]
+zobrist_black = zobrist_rng.getrandbits(64)
+
+# Moves are packed into 16 bits: origin square (y * 8 + x) in bits 0-5, the
+# destination in bits 6-11 and one of these flags in bits 12-15. Promotion
+# flags add the index of the new piece in promotion_types.
+quiet_move, double_push, king_castle, queen_castle = 0, 1, 2, 3
+capture_move, en_passant, promotion_move, promotion_capture = 4, 5, 8, 12
+promotion_types = ['knight', 'bishop', 'rook', 'queen']
+
+# Pieces keep their records in int arrays: packed moves for the move arrays,
+# and the piece type packed with the square (type << 6 | y * 8 + x) for the
+# rest
+square_pos = [(sq & 7, sq >> 3) for sq in range(64)]
+square_names = [x_index[x] + str(y_index[y]) for x, y in square_pos]
+symbols = [[color[0].upper() + "_" + ptype.title() for ptype in piece_types]
+           for color in color_list]
+type_codes = {ptype: code for code, ptype in enumerate(piece_types)}
+color_codes = {color: code for code, color in enumerate(color_list)}
+opponent = dict(zip(color_list, reversed(color_list)))
+array_types = ['ib_moves', 'uo_moves', 'v_moves', 'hist', 'backups',
+               'backing_up', 'targets', 'threats']
+move_arrays = 4 # The first four array types hold moves
+fen_letters = 'pnbrqk' # In the order of piece_types
+start_fen = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+record_fields = ['field', 'x', 'y']
+
+# Running evaluation totals, by color code then type code: material in
+# score_position units, and piece-square (middlegame, endgame) centipawns
+# by square. The king's value isn't a weight, since it only counts once a
+# king is captured in a simulation.
+material_values = [weights.get(ptype, pvals[ptype] * pawn_units)
+                   for ptype in piece_types]
+phase_values = [phase_weights[ptype] for ptype in piece_types]
+psqt = [[square_values(color, ptype) for ptype in piece_types]
+        for color in color_list]
+
 
 # Define Functions
 def get_btwn(pos, new_pos):
@@ -41,101 +87,247 @@ def get_btwn(pos, new_pos):
     return [(x, y) for x, y in zip(x_btwn, y_btwn)]
 
 
+def encode_move(orig, dest, flag=quiet_move):
+    """Packs origin and destination tuples and a flag into a move."""
+    return orig[1] * 8 + orig[0] | (dest[1] * 8 + dest[0]) << 6 | flag << 12
+
+
+def move_orig(move):
+    """Origin (x, y) of a packed move."""
+    return square_pos[move & 63]
+
+
+def move_dest(move):
+    """Destination (x, y) of a packed move."""
+    return square_pos[move >> 6 & 63]
+
+
+def move_flag(move):
+    """Flag of a packed move, like double_push or capture_move."""
+    return move >> 12
+
+
+def set_promotion(move, piece_type):
+    """Returns a promotion move changed to promote to piece_type."""
+    return move & ~(3 << 12) | promotion_types.index(piece_type) << 12
+
+
+def move_to_text(move):
+    """Long algebraic notation for a packed move, like 'e2e4' or 'e7e8q'."""
+    text = square_names[move & 63] + square_names[move >> 6 & 63]
+    if move >> 12 & promotion_move:
+        text += 'nbrq'[move >> 12 & 3]
+    return text
+
+
+def text_to_move(board, text):
+    """Returns the valid move of the side to move written like 'e2e4' or
+    'e7e8n', or None if there isn't one."""
+    text = text.strip().lower()
+    if len(text) not in [4, 5] or text[:2] not in square_names or \
+            text[2:4] not in square_names:
+        return None
+    orig = square_pos[square_names.index(text[:2])]
+    dest = square_pos[square_names.index(text[2:4])]
+    piece = board[orig].occ
+    if not piece or piece.color != board.turn:
+        return None
+    for move, x, y in piece.v_moves:
+        if (x, y) != dest:
+            continue
+        if move >> 12 & promotion_move:
+            if len(text) == 5:
+                if text[4] not in 'nbrq':
+                    return None
+                move = set_promotion(move, promotion_types['nbrq'.index(
+                    text[4])])
+        elif len(text) == 5:
+            return None
+        return move
+    return None
+
+
 # Define Classes
+class RecordStore:
+    """Preallocated int arrays holding the records of every piece on a board.
+    Each piece owns a slot (row) and each of its CustArrays a fixed range of
+    that row, so copying a board's records means copying two arrays."""
+    __slots__ = ('records', 'lens')
+    slots = 48 # 32 pieces plus up to 16 promotions
+
+    def __init__(self, slots=slots):
+        self.records = np.zeros((slots, record_width), dtype=np.uint16)
+        self.lens = np.zeros((slots, len(array_types)), dtype=np.int16)
+
+    def copy(self):
+        new = RecordStore.__new__(RecordStore)
+        new.records = self.records.copy()
+        new.lens = self.lens.copy()
+        return new
+
+
 class CustArray:
     """A custom array to hold Piece and Square data. Size varies based on the
     information it needs to hold. For in_bound, unobstructed, valid moves, and
-    targets this is 27. Move history is more, rest are intuitive."""
-    dtype = [('field', (np.str_, 10)), ('x', np.int8), ('y', np.int8)]
+    targets this is 27. Move history is more, rest are intuitive. Records are
+    read as (field, x, y), where the field is a packed move for move arrays
+    (x and y being its destination) and a piece type for the others. They
+    live packed in the RecordStore of the piece's board."""
+    __slots__ = ('store', 'slot', 'kind')
     size_dict = {
         'ib_moves': 27, # Most possible moves is 27 by the queen
         'uo_moves': 27,
         'v_moves': 27,
-        'hist': 100, # A single piece is not likely to be moved more
-        'sq_tgts': 27,
+        'hist': 40, # Later moves are counted in len but not stored
         'backing_up': 15, # 15 allied pieces
         'backups': 15, # 15 allied pieces
         'targets': 8, # Queen and Knight can only attack 8
         'threats': 16, # 16 enemy pieces
         }
 
-    def __init__(self, array_type):
-        n = CustArray.size_dict[array_type]
-        self.array_type = array_type
-        self.array = np.empty((n,),dtype=CustArray.dtype)
-        self.len = 0
+    def __init__(self, array_type, store=None, slot=0):
+        self.store = store if store is not None else RecordStore(1)
+        self.slot = slot
+        self.kind = array_types.index(array_type)
 
     def __repr__(self):
-        return repr(self.array)
+        return repr(list(self))
+
+    @property
+    def array_type(self):
+        return array_types[self.kind]
+
+    @property
+    def len(self):
+        return int(self.store.lens[self.slot, self.kind])
 
     def __iter__(self):
-        self.curr_index = 0
-        return self
-
-    def __next__(self):
-        if self.curr_index < self.len:
-            val = self.array[self.curr_index]
-            self.curr_index = self.curr_index + 1
-            return val
-        else:
-            raise StopIteration
+        start, size = record_offsets[self.kind], record_sizes[self.kind]
+        n = min(self.len, size)
+        rows = self.store.records[self.slot, start:start + n].tolist()
+        if self.kind < move_arrays:
+            return iter([(m, m >> 6 & 7, m >> 9 & 7) for m in rows])
+        return iter([(piece_types[r >> 6], r & 7, r >> 3 & 7) for r in rows])
 
     def add(self, obj):
-        """Insert an item into next position of array."""
-        self.array = np.insert(self.array, self.len, obj)
-        self.len += 1
+        """Insert an item into next position of array. Move arrays take a
+        packed move, the others a (piece type, x, y) tuple."""
+        n = self.store.lens[self.slot, self.kind]
+        if n < record_sizes[self.kind]:
+            if self.kind >= move_arrays:
+                ptype, x, y = obj
+                obj = type_codes[ptype] << 6 | y * 8 + x
+            self.store.records[self.slot, record_offsets[self.kind] + n] = obj
+        self.store.lens[self.slot, self.kind] = n + 1
 
     def reset(self):
-        """Reset the array to being filled with zeros."""
-        n = CustArray.size_dict[self.array_type]
-        self.array = np.empty((n,),dtype=CustArray.dtype)
-        self.len = 0
+        """Reset the array to being empty."""
+        self.store.lens[self.slot, self.kind] = 0
 
     def filt(self, objs):
-        """Return filtered array based on list of (field, val) tuples."""
-        filt = (self.array[objs[0][0]] == objs[0][1])
-        for i in objs[1:]:
-            filt = (filt) & (self.array[i[0]] == i[1])
-        return self.array[filt]
+        """Return list of records matching a list of (field, val) tuples."""
+        cols = [(record_fields.index(field), val) for field, val in objs]
+        return [i for i in self if all(i[col] == val for col, val in cols)]
 
     def __getitem__(self, sliced):
-        return self.array[sliced]
+        return list(self)[sliced]
+
+
+# Where each kind of CustArray's records start within its piece's slot
+record_sizes = [CustArray.size_dict[i] for i in array_types]
+record_offsets = [sum(record_sizes[:i]) for i in range(len(array_types))]
+record_width = sum(record_sizes)
 
 
 class ChessSquare:
     """Class representing game squares with info about surroundings."""
+    __slots__ = ('sq', 'color_id', 'occ')
+
     def __init__(self, color, x, y, occ=None):
-        self.color = color
-        self.x = x
-        self.y = y
-        self.pos = (x, y)
+        self.sq = y * 8 + x
+        self.color_id = color_list.index(color)
         self.occ = occ
 
     def __repr__(self):
         return self.color.title() + " square at " + str(self.pos)
 
+    @property
+    def color(self):
+        return color_list[self.color_id]
+
+    @property
+    def x(self):
+        return self.sq & 7
+
+    @property
+    def y(self):
+        return self.sq >> 3
+
+    @property
+    def pos(self):
+        return square_pos[self.sq]
+
+
 class Piece():
-    """Class representing game pieces and holding info about their position."""
-    def __init__(self, color, piece_type, x, y):
-        self.color = color
-        self.type = piece_type
-        self.x = x
-        self.y = y
-        self.pos = (x, y)
-        self.symbol = color[0].upper() + "_" + piece_type.title()
-        self.kill_list = []
-        self.ib_moves = CustArray('ib_moves')
-        self.uo_moves = CustArray('uo_moves')
-        self.v_moves = CustArray('v_moves')
-        self.hist = CustArray('hist')
-        self.backups = CustArray('backups')
-        self.backing_up = CustArray('backing_up')
-        self.targets = CustArray('targets')
-        self.threats = CustArray('threats')
+    """Class representing game pieces and holding info about their position.
+    Color, type and square are stored as integers; the string and tuple forms
+    are read-only properties, except pos which also moves the piece."""
+    __slots__ = ('color_id', 'type_id', 'sq', 'slot', 'kill_list',
+                 *array_types)
+
+    def __init__(self, color, piece_type, x, y, store=None, slot=0):
+        self.color_id = color_list.index(color)
+        self.type_id = piece_types.index(piece_type)
+        self.sq = y * 8 + x
+        self.slot = slot
+        self.kill_list = ()
+        store = store if store is not None else RecordStore(1)
+        for array_type in array_types:
+            setattr(self, array_type, CustArray(array_type, store, slot))
 
     def __repr__(self):
         return self.symbol + " at " + str(self.pos)
 
+    @property
+    def color(self):
+        return color_list[self.color_id]
+
+    @property
+    def type(self):
+        return piece_types[self.type_id]
+
+    @property
+    def symbol(self):
+        return symbols[self.color_id][self.type_id]
+
+    @property
+    def x(self):
+        return self.sq & 7
+
+    @property
+    def y(self):
+        return self.sq >> 3
+
+    @property
+    def pos(self):
+        return square_pos[self.sq]
+
+    @pos.setter
+    def pos(self, pos):
+        self.sq = pos[1] * 8 + pos[0]
+
+    def copy(self, store):
+        """Returns a copy of the piece whose records live in store."""
+        new = Piece.__new__(Piece)
+        new.color_id = self.color_id
+        new.type_id = self.type_id
+        new.sq = self.sq
+        new.slot = self.slot
+        new.kill_list = self.kill_list
+        for array_type in array_types:
+            setattr(new, array_type, CustArray(array_type, store, self.slot))
+        return new
+
     def info(self):
         """Gets attributes for the piece"""
 
@@ -150,8 +342,10 @@ class Piece():
         new_pos = "".join(lookup_dict[self.pos].split('_')).upper()
         print(self.symbol + " on " + new_pos + ".")
         print("\nNote: Valid moves does not consider check!")
-        print("Valid moves: " + str(ti(self.v_moves)))
-        print("Move history: " + str(ti(self.hist)))
+        print("Valid moves: " + str([move_to_text(m) for m, x, y in
+                                     self.v_moves]))
+        print("Move history: " + str([move_to_text(m) for m, x, y in
+                                      self.hist]))
         print("Backed up by: " + str(ti(self.backups)))
         print("Backing up: " + str(ti(self.backing_up)))
         print("Targeting: " + str(ti(self.targets)))
@@ -162,57 +356,46 @@ class Piece():
         """Returns destination given some difference from the orig. position"""
         return self.x + x_diff, self.y + y_diff
 
+    def add_ib_moves(self, diffs):
+        """Adds moves for a list of (x_diff, y_diff, flag) that stay
+        in-bounds to ib_moves."""
+        for x_diff, y_diff, flag in diffs:
+            dest = self.get_dest(x_diff, y_diff)
+            if max(dest) <= 7 and min(dest) >= 0: # Ensure in-bounds
+                self.ib_moves.add(encode_move(self.pos, dest, flag))
+
     def get_pawn_ib_moves(self):
         """All possible in-bounds moves for pawn. Includes en passant."""
         assert self.type == "pawn"
-        p_num, p_dir = (-1, 's') if self.color == 'black' else (1, 'n')
-        moves = {
-            p_dir + '_1': self.get_dest(0, p_num),
-            p_dir + '_2': self.get_dest(0, p_num * 2),
-            p_dir + 'e_1': self.get_dest(1, p_num),
-            p_dir + 'w_1': self.get_dest(-1, p_num)
-            }
-        # Add in-bound moves to ib_moves
-        for move, dest in moves.items():
-            if max(dest) <= 7 and min(dest) >= 0: # Ensure in-bounds
-                self.ib_moves.add((move, *dest))
+        p_num = pawn_dir[self.color]
+        self.add_ib_moves([(0, p_num, quiet_move),
+                           (0, p_num * 2, double_push),
+                           (1, p_num, quiet_move),
+                           (-1, p_num, quiet_move)])
 
     def get_rook_ib_moves(self):
         """Get all possible moves for rook (or queen) that stay in-bounds.
         Does not consider castling, which is attributed to the King."""
         assert self.type == 'rook' or self.type == 'queen'
-        n_moves = {'n_' + str(i): (self.x, i) for i in range(8) if i < self.y}
-        e_moves = {'e_' + str(i): (i, self.y) for i in range(8) if i > self.x}
-        s_moves = {'s_' + str(i): (self.x, i) for i in range(8) if i > self.y}
-        w_moves = {'w_' + str(i): (i, self.y) for i in range(8) if i < self.x}
-        moves = {**n_moves, **e_moves, **s_moves, **w_moves}
-        [self.ib_moves.add((move, *dest)) for move, dest in moves.items()]
+        dests = [(self.x, i) for i in range(8) if i < self.y]
+        dests += [(i, self.y) for i in range(8) if i > self.x]
+        dests += [(self.x, i) for i in range(8) if i > self.y]
+        dests += [(i, self.y) for i in range(8) if i < self.x]
+        [self.ib_moves.add(encode_move(self.pos, dest)) for dest in dests]
 
     def get_bishop_ib_moves(self):
         """Get all possible moves for bishop (or queen) that stay in-bounds."""
         assert self.type == 'bishop' or self.type == 'queen'
-        ne_dests = {'ne_' + str(i): (self.x + i, self.y - i) for i in
-                    range(1,8) if self.x + i < 8 and self.y - i > -1}
-        se_dests = {'se_' + str(i): (self.x + i, self.y + i) for i in
-                    range(1,8) if self.x + i < 8 and self.y + i < 8}
-        sw_dests = {'sw_' + str(i): (self.x - i, self.y + i) for i in
-                    range(1,8) if self.x - i > -1 and self.y + i < 8}
-        nw_dests = {'nw_' + str(i): (self.x - i, self.y - i) for i in
-                    range(1,8) if self.x - i > -1 and self.y - i > -1}
-        moves = {**ne_dests, **se_dests, **sw_dests, **nw_dests}
-        [self.ib_moves.add((move, *dest)) for move, dest in moves.items()]
+        diffs = [(i * x_sign, i * y_sign, quiet_move)
+                 for x_sign, y_sign in [(1, -1), (1, 1), (-1, 1), (-1, -1)]
+                 for i in range(1, 8)]
+        self.add_ib_moves(diffs)
 
     def get_knight_ib_moves(self):
         """Gets all possible moves for knight that stay in-bounds."""
         assert self.type == 'knight'
-        diffs = {'nne_': (1, -2), 'ene_': (2, -1), 'ese_':(2, 1),
-                 'sse_': (1, 2), 'ssw_': (-1, 2), 'wsw_':(-2, 1),
-                 'wnw_': (-2, -1), 'nnw_': (-1, -2)}
-        moves = {move: self.get_dest(*diff) for move, diff in diffs.items()}
-        # Add in-bound moves to ib_moves
-        for move, dest in moves.items():
-            if max(dest) <= 7 and min(dest) >= 0: # Ensure in-bounds
-                self.ib_moves.add((move, *dest))
+        self.add_ib_moves([(1, -2, 0), (2, -1, 0), (2, 1, 0), (1, 2, 0),
+                           (-1, 2, 0), (-2, 1, 0), (-2, -1, 0), (-1, -2, 0)])
 
     def get_queen_ib_moves(self):
         assert self.type == 'queen'
@@ -222,14 +405,8 @@ class Piece():
     def get_king_ib_moves(self):
         """Gets all possible non-castle moves for king that stay in-bounds."""
         assert self.type == 'king'
-        diffs = {'n_1': (0, -1), 'ne_1': (1, -1), 'e_1':(1, 0),
-                 'se_1': (1, 1), 's_1': (0, 1), 'sw_1':(-1, 1),
-                 'w_1': (-1, 0), 'nw_1': (-1, -1)}
-        moves = {move: self.get_dest(*diff) for move, diff in diffs.items()}
-        # Add in-bound moves to ib_moves
-        for move, dest in moves.items():
-            if max(dest) <= 7 and min(dest) >= 0: # Ensure in-bounds
-                self.ib_moves.add((move, *dest))
+        self.add_ib_moves([(0, -1, 0), (1, -1, 0), (1, 0, 0), (1, 1, 0),
+                           (0, 1, 0), (-1, 1, 0), (-1, 0, 0), (-1, -1, 0)])
 
     def get_ib_moves(self):
         """Gets all in-bound moves for a piece based on the piece type."""
@@ -250,25 +427,77 @@ class Chessboard:
     understand their surroundings. Also handles moves."""
     def __init__(self, turn='white', player_color = 'white'):
         flipper = 0 # flips between 0 and 1 each iteration
-        row_list = []
+        self.squares = [] # Indexed by y * 8 + x
         for y in range(8):
-            square_list = []
             for x in range(8):
-                square = ChessSquare(color_list[flipper], x, y)
-                square_list = square_list + [square]
+                self.squares += [ChessSquare(color_list[flipper], x, y)]
                 flipper = flipper * -1 + 1
-            row_list = row_list + [square_list]
-        self.board = np.array(row_list)
+        self.store = RecordStore()
+        self.next_slot = 0
         self.turn = turn
         self.nonturn = 'black' if turn == 'white' else 'white'
         self.turn_num = 1
         self.last_capture_turn = 1
-        self.alive = []
+        self.halfmove_clock = 0 # Plies since the last capture or pawn move
+        self.key_history = [] # get_key() of every position reached so far
+        self.start_fen = start_fen # Position the game started from
+        self.game_moves = [] # Packed moves played since then
+        # Pieces on the board, by color then type code
+        self.index = [[[] for t in piece_types] for c in color_list]
+        # Number of each color's pieces attacking each square
+        self.attacks = np.zeros((len(color_list), 64), dtype=np.int16)
+        # Kept up to date as pieces are added, moved and removed. White's
+        # material and piece-square totals minus black's, and the phase.
+        self.material = 0
+        self.pst_mg = 0
+        self.pst_eg = 0
+        self.phase = 0
+        # Zobrist key of the pawns alone, and a bitmask of each color's pawns
+        self.pawn_key = 0
+        self.pawns = [0, 0]
+        # An nnue.Network, once attached, and its first layer output
+        self.network = None
+        self.accumulator = None
         self.player_color = player_color
+        # A pretty_board.BoardRenderer for view to redraw with, if set
+        self.renderer = None
         self.move_history = []
+        self.last_move = None
 
     def __getitem__(self, tup):
-        return self.board[tup[1],tup[0]]
+        return self.squares[tup[1] * 8 + tup[0]]
+
+    def __deepcopy__(self, memo):
+        """Copies the board by copying its RecordStore and rebuilding the
+        squares and pieces around it, rather than copying every attribute."""
+        new = Chessboard.__new__(Chessboard)
+        memo[id(self)] = new
+        new.__dict__.update(self.__dict__)
+        new.store = self.store.copy()
+        new.move_history = self.move_history.copy()
+        new.key_history = self.key_history.copy()
+        new.game_moves = self.game_moves.copy()
+        new.pawns = self.pawns.copy()
+        if self.accumulator is not None:
+            new.accumulator = self.accumulator.copy()
+        pieces = {id(i): i.copy(new.store) for i in self.alive}
+        new.index = [[[pieces[id(i)] for i in by_type] for by_type in by_color]
+                     for by_color in self.index]
+        new.squares = []
+        for square in self.squares:
+            new_square = ChessSquare.__new__(ChessSquare)
+            new_square.sq = square.sq
+            new_square.color_id = square.color_id
+            occ = square.occ
+            new_square.occ = pieces[id(occ)] if occ else None
+            new.squares += [new_square]
+        return new
+
+    def new_piece(self, color, piece_type, x, y):
+        """Creates a piece whose records live in the board's RecordStore."""
+        piece = Piece(color, piece_type, x, y, self.store, self.next_slot)
+        self.next_slot += 1
+        return piece
 
     def set_up_board(self):
         """Puts pieces in starting positions."""
@@ -276,47 +505,199 @@ class Chessboard:
                       'king', 'bishop', 'knight', 'rook']
         for x, piece in enumerate(piece_list):
             for y, color in zip([0, 7], color_list):
-                self[x,y].occ = Piece(color, piece, x, y)
+                self[x,y].occ = self.new_piece(color, piece, x, y)
             for y, color in zip([1, 6], color_list):
-                self[x,y].occ = Piece(color, 'pawn', x, y)
+                self[x,y].occ = self.new_piece(color, 'pawn', x, y)
 
     def set_up_board_randomly(self):
         """Puts starting pieces in randomly assigned positions. For testing."""
         full_pos_list = [(x,y) for x in range(8) for y in range(8)]
         pos_list = sample(full_pos_list, 32)
         piece_list = ['rook','knight','bishop']*2+['king','queen']+['pawn']*8
-        color_list = np.repeat(sample(color_list, 2), 16)
-        for color, pos, piece in zip(color_list, pos_list, piece_list*2):
-            self[pos].occ=Piece(color,piece,pos[0],pos[1])
-            self[pos].occ.has_moved = True
+        colors = np.repeat(sample(color_list, 2), 16)
+        for color, pos, piece in zip(colors, pos_list, piece_list*2):
+            self[pos].occ = self.new_piece(color, piece, pos[0], pos[1])
+
+    def set_up_board_fen(self, fen):
+        """Puts pieces where a FEN string says, and takes the side to move,
+        castling rights, en passant square and move counters from it. Pieces
+        that have moved according to the FEN get a placeholder move in hist,
+        since castling and double pushes depend on hist being empty."""
+        fields = fen.split()
+        if len(fields) < 2 or len(fields[0].split('/')) != 8:
+            raise ValueError("Invalid FEN: " + fen)
+        fields += ['-', '-', '0', '1'][len(fields) - 2:]
+        for i, row in enumerate(fields[0].split('/')):
+            x, y = 0, 7 - i
+            for char in row:
+                if char.isdigit():
+                    x += int(char)
+                elif char.lower() in fen_letters and x < 8:
+                    color = 'white' if char.isupper() else 'black'
+                    ptype = piece_types[fen_letters.index(char.lower())]
+                    self[x,y].occ = self.new_piece(color, ptype, x, y)
+                    x += 1
+                else:
+                    raise ValueError("Invalid FEN: " + fen)
+        if fields[1] not in ['w', 'b']:
+            raise ValueError("Invalid FEN: " + fen)
+        self.turn = 'white' if fields[1] == 'w' else 'black'
+        self.nonturn = opponent[self.turn]
+        rights = fields[2]
+        for square in self.squares:
+            piece = square.occ
+            if not piece:
+                continue
+            home = 0 if piece.color == 'white' else 7
+            letters = 'KQ' if piece.color == 'white' else 'kq'
+            if piece.type == 'pawn':
+                moved = piece.y != home + pawn_dir[piece.color]
+            elif piece.type == 'king':
+                moved = (piece.pos != (4, home) or
+                         not any(i in rights for i in letters))
+            elif piece.type == 'rook':
+                letter = {7: letters[0], 0: letters[1]}.get(piece.x)
+                moved = piece.y != home or not letter or letter not in rights
+            else:
+                moved = False
+            if moved:
+                piece.hist.add(encode_move(piece.pos, piece.pos))
+        if fields[3] != '-':
+            x, y = rev_lookup[fields[3][0] + '_' + fields[3][1]]
+            step = pawn_dir[self.nonturn]
+            self.last_move = encode_move((x, y - step), (x, y + step),
+                                         double_push)
+        self.halfmove_clock = int(fields[4])
+        self.turn_num = (int(fields[5]) - 1) * 2 + 1 + (self.turn == 'black')
+        self.last_capture_turn = self.turn_num - self.halfmove_clock
+
+    def get_fen(self):
+        """Returns the position as a FEN string."""
+        rows = []
+        for y in range(7, -1, -1):
+            row, empty = '', 0
+            for x in range(8):
+                piece = self[x,y].occ
+                if not piece:
+                    empty += 1
+                    continue
+                letter = fen_letters[piece.type_id]
+                row += (str(empty) if empty else '') + \
+                    (letter.upper() if piece.color == 'white' else letter)
+                empty = 0
+            rows += [row + (str(empty) if empty else '')]
+        rights = ''
+        for k in self.get_pieces(['king']):
+            if k.x != 4 or k.y not in [0, 7] or k.hist.len != 0:
+                continue
+            for r_x, letter in [(7, 'k'), (0, 'q')]:
+                r = self[r_x, k.y].occ
+                if (r and r.type == 'rook' and r.color == k.color and
+                        r.hist.len == 0):
+                    rights += letter.upper() if k.color == 'white' else letter
+        rights = "".join(sorted(rights, key='KQkq'.index)) or '-'
+        ep = '-'
+        if self.last_move is not None and \
+                move_flag(self.last_move) == double_push:
+            orig, dest = move_orig(self.last_move), move_dest(self.last_move)
+            ep = square_names[(orig[1] + dest[1]) // 2 * 8 + orig[0]]
+        return " ".join(["/".join(rows), self.turn[0], rights, ep,
+                         str(self.halfmove_clock),
+                         str((self.turn_num - 1) // 2 + 1)])
 
     def view(self, reverse = False):
-        """Returns nice-looking view of board. Not used in calculations."""
-        pretty_board(self, reverse)
+        """Returns nice-looking view of board. Not used in calculations.
+        With a renderer, only the squares that changed are redrawn."""
+        from pretty_board import pretty_board, enable_colors # Only the UI
+        if self.renderer is not None:
+            enable_colors()
+            print(self.renderer.draw(self, reverse), end='')
+        else:
+            pretty_board(self, reverse)
+
+    @property
+    def alive(self):
+        """All pieces on the board, read from the piece index."""
+        return [piece for by_color in self.index for by_type in by_color
+                for piece in by_type]
 
     def get_pieces(self, piece_type=[], color=[]):
         """Returns a list of pieces meeting the parameters (and, not or).
         Ex: if you provide king, queen and no color, it gets 4 pieces.
         Ex: If you provide king, queen and white, it gets 2 pieces."""
-        piece_list = []
-        for x in range(8):
-            for y in range(8):
-                if self[x,y].occ:
-                    piece_list = piece_list + [self[x,y].occ]
-        if color:
-            for piece in piece_list.copy():
-                if piece.color not in color:
-                    piece_list.remove(piece)
-        if piece_type:
-            for piece in piece_list.copy():
-                if piece.type not in piece_type:
-                    piece_list.remove(piece)
-        return piece_list
+        colors = [color_codes[i] for i in color] if color else [0, 1]
+        types = [type_codes[i] for i in piece_type] if piece_type else \
+            range(len(piece_types))
+        return [piece for c in colors for t in types
+                for piece in self.index[c][t]]
+
+    def get_king(self, color):
+        """Returns the king of color, or None if it has been captured."""
+        kings = self.index[color_codes[color]][type_codes['king']]
+        return kings[0] if kings else None
+
+    def add_piece(self, piece):
+        """Adds a piece to the piece index. Does not place it on a square."""
+        self.index[piece.color_id][piece.type_id].append(piece)
+        self.update_eval(piece, 1)
+
+    def remove_piece(self, piece):
+        """Removes a piece from the piece index."""
+        self.index[piece.color_id][piece.type_id].remove(piece)
+        self.update_eval(piece, -1)
+
+    def update_eval(self, piece, sign):
+        """Adds (sign 1) or takes away (sign -1) a piece on its current
+        square from the running evaluation totals, and pawns from the pawn
+        key and bitmasks. Also updates an attached network's accumulator."""
+        side = sign if piece.color_id == 0 else -sign
+        mg, eg = psqt[piece.color_id][piece.type_id][piece.sq]
+        self.material += side * material_values[piece.type_id]
+        self.pst_mg += side * mg
+        self.pst_eg += side * eg
+        self.phase += sign * phase_values[piece.type_id]
+        if piece.type_id == type_codes['pawn']:
+            self.pawn_key ^= zobrist_pieces[(piece.color, 'pawn', piece.x,
+                                             piece.y)]
+            self.pawns[piece.color_id] ^= 1 << piece.sq
+        if self.network is not None:
+            row = self.network.w1_q[(piece.color_id * len(piece_types) +
+                                     piece.type_id) * 64 + piece.sq]
+            if sign > 0:
+                self.accumulator += row
+            else:
+                self.accumulator -= row
+
+    def get_key(self):
+        """Returns a 64-bit Zobrist hash of the position. Covers pieces,
+        side to move, castling rights and en passant candidates."""
+        key = zobrist_black if self.turn == 'black' else 0
+        for piece in self.alive:
+            key ^= zobrist_pieces[(piece.color, piece.type, piece.x, piece.y)]
+        # A pawn that just double-pushed can be taken en passant
+        if self.last_move is not None and \
+                move_flag(self.last_move) == double_push:
+            key ^= zobrist_ep[self.last_move >> 6 & 7]
+        for k in self.get_pieces(['king']):
+            if k.x != 4 or k.y not in [0, 7] or k.hist.len != 0:
+                continue
+            for r_x in [0, 7]:
+                r = self[r_x, k.y].occ
+                if (r and r.type == 'rook' and r.color == k.color and
+                        r.hist.len == 0):
+                    key ^= zobrist_castle[(r_x, k.y)]
+        return key
 
     def get_alive_pieces(self):
-        self.alive = self.get_pieces(
-            piece_type=['pawn', 'rook', 'knight','bishop', 'queen', 'king']
-        )
+        """Rebuilds the piece index from the pieces on the squares."""
+        self.index = [[[] for t in piece_types] for c in color_list]
+        self.material = self.pst_mg = self.pst_eg = self.phase = 0
+        self.pawn_key, self.pawns = 0, [0, 0]
+        if self.network is not None:
+            self.accumulator = self.network.b1_q.copy()
+        for square in self.squares:
+            if square.occ:
+                self.add_piece(square.occ)
 
     def get_ib_moves(self):
         """Given each piece's position, get all moves for each piece that are
@@ -332,7 +713,7 @@ class Chessboard:
         for piece in self.alive:
             if piece.type in ['knight', 'king']:
                 for move, x, y in piece.ib_moves:
-                    piece.uo_moves.add((move, x, y))
+                    piece.uo_moves.add(move)
             else:
                 for move, x, y in piece.ib_moves:
                     add = True
@@ -340,38 +721,45 @@ class Chessboard:
                         if self[btwn_pos].occ:
                             add = False
                             break
-                    if add: piece.uo_moves.add((move, x, y))
+                    if add: piece.uo_moves.add(move)
 
     def get_valid_pawn_moves(self, piece):
-        """Get legal moves for pawns including en passant."""
+        """Get legal moves for pawns including en passant. Moves to the last
+        rank are flagged as promotions to a queen."""
         assert piece.type == 'pawn'
         for move, x, y in piece.uo_moves:
+            occ = self[x, y].occ
+            promotes = y in [0, 7]
             # Advance Single Space
-            if (move == 's_1' or move == 'n_1') and not self[x, y].occ:
-                piece.v_moves.add((move, x, y))
+            if x == piece.x and move_flag(move) == quiet_move:
+                if not occ:
+                    if promotes:
+                        move |= (promotion_move + 3) << 12
+                    piece.v_moves.add(move)
             # Advance Two Spaces
-            elif move.split('_')[-1] == '2' and piece.hist.len == 0:
-                if not self[x, y].occ: piece.v_moves.add((move, x, y))
-            elif len(move) == 4: # Only look at diagonal moves which have len 4
-                occ = self[x, y].occ
+            elif move_flag(move) == double_push and piece.hist.len == 0:
+                if not occ: piece.v_moves.add(move)
+            elif x != piece.x: # Diagonal moves
                 # Attacks
                 if occ and occ.color != piece.color:
-                    piece.v_moves.add((move, x, y))
+                    flag = promotion_capture + 3 if promotes else capture_move
+                    piece.v_moves.add(move | flag << 12)
                     piece.targets.add((occ.type, x, y))
                     occ.threats.add((piece.type, piece.x, piece.y))
                     continue
                 elif occ and occ.color == piece.color:
                     occ.backups.add((piece.type, piece.x, piece.y))
                     piece.backing_up.add((occ.type, x, y))
-                # En Passant
+                # En Passant, only right after the neighbor's double push
                 elif not occ:
                     # Identify east/west neighbor in attack direction
                     neighbor = self[x, piece.y].occ
+                    last = self.last_move
                     if (neighbor and neighbor.color != piece.color and
-                        neighbor.type == 'pawn' and
-                        neighbor.hist.len == 1 and
-                        '2' in list(iter(neighbor.hist))[0][0]):
-                        piece.v_moves.add((move, x, y))
+                        neighbor.type == 'pawn' and last is not None and
+                        move_flag(last) == double_push and
+                        last >> 6 & 63 == neighbor.sq):
+                        piece.v_moves.add(move | en_passant << 12)
                         piece.targets.add((neighbor.type, x, y))
                         neighbor.threats.add((piece.type, piece.x, piece.y))
 
@@ -382,7 +770,7 @@ class Chessboard:
             occ = self[x, y].occ
             # If square is occupied by the enemy
             if occ and occ.color != piece.color:
-                piece.v_moves.add((move, x, y))
+                piece.v_moves.add(move | capture_move << 12)
                 piece.targets.add((occ.type, x, y))
                 occ.threats.add((piece.type, piece.x, piece.y))
             # If square is occupied by ally
@@ -391,7 +779,7 @@ class Chessboard:
                 piece.backing_up.add((occ.type, x, y))
             # If square is empty
             elif not occ:
-                piece.v_moves.add((move, x, y))
+                piece.v_moves.add(move)
 
     def get_valid_moves(self):
         """Given the board's pieces', gets all legal moves for each piece.
@@ -406,122 +794,169 @@ class Chessboard:
         }
         for piece in self.alive:
             move_dict[piece.type](piece)
+        self.get_attack_maps()
+
+    def get_attack_maps(self):
+        """Counts how many pieces of each color attack each square, from the
+        uo_moves records of the whole board at once. Pawn pushes attack
+        nothing, while pawn diagonals do even onto empty squares."""
+        kind = array_types.index('uo_moves')
+        start, size = record_offsets[kind], record_sizes[kind]
+        self.attacks = np.zeros((len(color_list), 64), dtype=np.int16)
+        for color_id, by_type in enumerate(self.index):
+            slots = [piece.slot for pieces in by_type for piece in pieces]
+            if not slots:
+                continue
+            records = self.store.records[slots, start:start + size]
+            mask = np.arange(size) < self.store.lens[slots, kind][:, None]
+            # Pawns come first in the index, drop their straight moves
+            pawns = len(by_type[type_codes['pawn']])
+            pawn_records = records[:pawns]
+            mask[:pawns] &= (pawn_records & 7) != (pawn_records >> 6 & 7)
+            self.attacks[color_id] = np.bincount(records[mask] >> 6 & 63,
+                                                 minlength=64)
+
+    def is_attacked(self, sq, color):
+        """True if any piece of color attacks square index sq."""
+        return self.attacks[color_codes[color], sq] > 0
+
+    def is_in_check(self, color):
+        """True if color's king is attacked. False if it has no king."""
+        king = self.get_king(color)
+        return bool(king) and self.is_attacked(king.sq, opponent[color])
 
     def are_squares_safe(self, square_list, color):
-        """False if color has valid moves targeting any of squarelist."""
-        pos_list = [square.pos for square in square_list]
-        color_pieces = self.get_pieces(color=[color])
-        for piece in color_pieces:
-            for move, x, y in piece.v_moves:
-                if (x, y) in pos_list:
-                    return False # threatened
-        return True
+        """False if color attacks any of square_list."""
+        return not any(self.attacks[color_codes[color], square.sq]
+                       for square in square_list)
 
     def get_valid_castles(self):
-        # Loop through what OUGHT to be the kings. Confirmed if hist.len==0.
-        for k in [self[4,0].occ, self[4,7].occ]:
-            if (not k or k.hist.len != 0):
+        # Loop through the kings, which can castle if they haven't moved
+        for k in self.get_pieces(['king']):
+            if k.x != 4 or k.y not in [0, 7] or k.hist.len != 0:
                 continue
             y = k.y
-            color = list(set(['black','white']) - set([k.color]))[0]
+            color = opponent[k.color]
             # Loop through what ought to be the rook's matching k's color
             rooks = [self[0,y].occ, self[7,y].occ]
             safe_sqs = [[2, 3, 4], [6, 5, 4]]
             emp_sqs = [(not self[1,y].occ and not self[2,y].occ
                        and not self[3,y].occ),
                        (not self[5,y].occ and not self[6,y].occ)]
-            moves = ['c_q','c_k']
+            flags = [queen_castle, king_castle]
             # First element of each list has info for queenside castling
-            for r, sqs, emp, move in zip(rooks, safe_sqs, emp_sqs, moves):
-                if (not r or r.hist.len != 0):
+            for r, sqs, emp, flag in zip(rooks, safe_sqs, emp_sqs, flags):
+                if (not r or r.type != 'rook' or r.color != k.color or
+                        r.hist.len != 0):
                     continue
                 if not emp:
                     continue
                 square_list = [self[sq_x, y] for sq_x in sqs]
                 if self.are_squares_safe(square_list, color):
-                    k.v_moves.add((move, sqs[0], y))
+                    k.v_moves.add(encode_move(k.pos, (sqs[0], y), flag))
 
     def reset_info(self):
         """Resets most information about the board's pieces."""
-        for piece in self.alive:
-            piece.uo_moves.reset()
-            piece.v_moves.reset()
-            piece.backups.reset()
-            piece.backing_up.reset()
-            piece.targets.reset()
-            piece.threats.reset()
-
-    def full_set_up(self, mode="standard"):
-        """Set up board and generate all valid moves. Mode can be "random"."""
+        kinds = [array_types.index(i) for i in ['uo_moves', 'v_moves',
+                 'backups', 'backing_up', 'targets', 'threats']]
+        self.store.lens[:, kinds] = 0
+
+    def full_set_up(self, mode="standard", fen=None):
+        """Set up board and generate all valid moves. Mode can be "random",
+        or "fen" to set up the position in fen."""
         if mode == "standard":
             self.set_up_board()
         elif mode == "random":
             self.set_up_board_randomly()
+        elif mode == "fen":
+            self.set_up_board_fen(fen)
         self.get_alive_pieces()
         self.get_ib_moves()
         self.get_unobstructed_moves()
         self.get_valid_moves()
         self.get_valid_castles()
+        self.key_history = [self.get_key()]
+        self.start_fen = self.get_fen()
+        self.game_moves = []
 
     def move_piece(self, piece, dest, validate=True, printer = False,
                    human=True):
-        """Move piece, potentially capture, and update all values."""
+        """Move piece to dest, potentially capture, and update all values.
+        Looks up the move in the piece's valid moves and plays it."""
         # Validate move
         if validate:
             assert piece
             assert dest in [(x, y) for move, x, y in piece.v_moves]
             assert piece.color == self.turn
-        # Get move name
         move = piece.v_moves.filt([('x',dest[0]),('y',dest[1])])[0][0]
+        return self.play_move(move, printer, human)
+
+    def play_move(self, move, printer=False, human=False):
+        """Make a packed move, potentially capture, and update all values.
+        Returns whether the side now to move is in check."""
+        orig, dest, flag = move_orig(move), move_dest(move), move_flag(move)
+        piece = self[orig].occ
         # Format print statement
-        origin_string = lookup_dict[piece.pos].replace('_',"").upper()
+        origin_string = lookup_dict[orig].replace('_',"").upper()
         dest_string = lookup_dict[dest].replace('_',"").upper()
         statement = "Moved " + piece.symbol + " from " + origin_string + \
                     " to " + dest_string + ". "
+        notes = [] # Printed with the statement
         dest_piece = self[dest].occ
+        if flag == en_passant:
+            dest_piece = self[dest[0], orig[1]].occ
+            self[dest[0], orig[1]].occ = None
         flavor = False
+        if dest_piece or piece.type == 'pawn':
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
         if dest_piece: # Handle capture
             statement = statement + dest_piece.symbol + " has been captured!"
-            self.alive.remove(dest_piece)
+            self.remove_piece(dest_piece)
             self.move_history += [piece.symbol + ' ' + origin_string + ' > ' \
                                   + dest_string + ': ' + dest_piece.symbol \
                                   + " captured."]
             self.last_capture_turn = self.turn_num
-            piece.kill_list += [dest_piece]
+            piece.kill_list += (dest_piece,)
             if self.turn != self.player_color:
                 flavor = True
         else:
-            self.move_history += [piece.symbol + ' ' + origin_string + ' > ' + \
-                                  dest_string + ': No capture.']
+            self.move_history += [piece.symbol + ' ' + origin_string + ' > ' \
+                                  + dest_string + ': No capture.']
         # Update board information
-        self[piece.pos].occ = None
+        self[orig].occ = None
         self[dest].occ = piece
         self.turn, self.nonturn = self.nonturn, self.turn
         self.turn_num += 1
+        self.last_move = move
         # Update piece information
-        piece.x, piece.y = dest
+        self.update_eval(piece, -1)
         piece.pos = dest
-        piece.hist.add((piece.v_moves.filt([('x',dest[0]),('y',dest[1])])))
+        self.update_eval(piece, 1)
+        piece.hist.add(move)
         piece.get_ib_moves()
         # Handle castling
-        if move == 'c_k' or move == 'c_q':
-            if move == 'c_k':
-                if printer: print("Kingside castle!")
-                rook = self[7, piece.y].occ
-                new_dest = (5, piece.y)
-            elif move == 'c_q':
-                if printer: print("Queenside castle!")
-                rook = self[0, piece.y].occ
-                new_dest = (3, piece.y)
-            self.turn, self.nonturn = self.nonturn, self.turn
-            self.turn_num -= 1
-            self.move_piece(rook, new_dest, False, False)
-            self.move_history = self.move_history[:-1]
+        if flag == king_castle or flag == queen_castle:
+            if flag == king_castle:
+                notes += ["Kingside castle!"]
+                rook_orig, rook_dest = (7, dest[1]), (5, dest[1])
+            elif flag == queen_castle:
+                notes += ["Queenside castle!"]
+                rook_orig, rook_dest = (0, dest[1]), (3, dest[1])
+            rook = self[rook_orig].occ
+            self[rook_orig].occ = None
+            self[rook_dest].occ = rook
+            self.update_eval(rook, -1)
+            rook.pos = rook_dest
+            self.update_eval(rook, 1)
+            rook.hist.add(encode_move(rook_orig, rook_dest))
+            rook.get_ib_moves()
         # Handle pawn promotion
-        if piece.type == 'pawn' and dest[1] in [0, 7]:
+        if flag & promotion_move:
             if human == False:
-                promotion = 'queen'
-                if printer: print(piece.symbol + " promoted to queen!")
+                promotion = promotion_types[flag & 3]
+                notes += [piece.symbol + " promoted to " + promotion + "!"]
             else:
                 promotion = input("Pawn promotion! What piece would you like? "
                               "Enter the name of the piece \nyou want, such "
@@ -537,11 +972,15 @@ class Chessboard:
                                   "your pawn to be promoted to.")
                 if promotion.lower() == 'quit':
                     quit()
-                elif promotion.lower() in ['queen', 'rook', 'knight', 'bishop']:
+                elif promotion.lower() in ['queen', 'rook', 'knight',
+                                           'bishop']:
                     invalid_type = False
-            new_queen = Piece(piece.color, promotion, piece.x, piece.y)
+            self.last_move = set_promotion(move, promotion.lower())
+            new_queen = self.new_piece(piece.color, promotion.lower(),
+                                       piece.x, piece.y)
             self[piece.x, piece.y].occ = new_queen
-            self.alive += [new_queen]
+            self.remove_piece(piece)
+            self.add_piece(new_queen)
             new_queen.get_ib_moves()
             del piece
         # Update board
@@ -549,27 +988,65 @@ class Chessboard:
         self.get_unobstructed_moves()
         self.get_valid_moves()
         self.get_valid_castles()
+        self.key_history += [self.get_key()]
+        self.game_moves += [self.last_move]
         # Check if in check for printing purposes
-        check = False
-        try:
-            king = self.get_pieces(['king'],[self.turn])[0]
-            if king.threats.len > 0:
-                check = True
-        except:
-            pass
+        check = self.is_in_check(self.turn)
         # Display
         if printer:
             if check:
                 statement = "Check! " + statement
-            print(statement)
-            if self.player_color == 'white':
-                self.view(True)
-            else:
-                self.view(False)
+            # A renderer redraws the board in place at the top of the
+            # screen, so the messages go below it
+            if self.renderer is None:
+                print("\n".join(notes + [statement]))
+            self.view(self.player_color == 'white')
+            if self.renderer is not None:
+                print("\n".join(notes + [statement]))
             if flavor:
                 flavor_spitter(dest_piece.type)
         return check
 
+    def repetitions(self):
+        """Number of times the current position occurred before. Only
+        positions since the last capture or pawn move can repeat, and only
+        every other one has the same side to move."""
+        keys = self.key_history
+        last = len(keys) - 1
+        first = max(last - self.halfmove_clock, 0)
+        return sum(1 for i in range(last - 2, first - 1, -2)
+                   if keys[i] == keys[last])
+
+    def insufficient_material(self):
+        """True if neither side can possibly mate: bare kings, a single
+        minor piece, or bishops that all stand on one square color."""
+        counts = [[len(pieces) for pieces in by_color]
+                  for by_color in self.index]
+        minors = []
+        for color_counts in counts:
+            if (color_counts[type_codes['pawn']] or
+                    color_counts[type_codes['rook']] or
+                    color_counts[type_codes['queen']]):
+                return False
+            minors += [color_counts[type_codes['knight']] +
+                       color_counts[type_codes['bishop']]]
+        if sum(minors) <= 1:
+            return True
+        knights = sum(i[type_codes['knight']] for i in counts)
+        bishops = self.get_pieces(['bishop'])
+        return knights == 0 and len(set((i.x + i.y) % 2 for i in bishops)) == 1
+
+    def draw_check(self):
+        """Returns the reason the position is a draw by rule, or an empty
+        string if it isn't one."""
+        if self.halfmove_clock >= 100:
+            return "The game is a draw due to the 50-move rule."
+        if self.repetitions() >= 2:
+            return "The game is a draw by threefold repetition."
+        if self.insufficient_material():
+            return "The game is a draw due to insufficient material."
+        return ""
+
     def game_over_check(self):
         """The computer wins if the player loses all their pieces except the
         king, and the AI has a certain number of specific pieces. This is to
@@ -577,9 +1054,10 @@ class Chessboard:
         and a king, but there is no need to go through the exercise.) Also
         ends the game if a certain number of turns have passed. Returns boolean
         for whether the game will end plus a reason."""
-        # 50 Move Rule
-        if self.turn_num - self.last_capture_turn >= 100:
-            return True, "The game is a draw due to the 50-move rule."
+        # 50 move rule, repetition and insufficient material
+        draw = self.draw_check()
+        if draw:
+            return True, draw
         # AI has specific pieces and human has just a king
         reason = "You resign. Checkmate is trivial at this point."
         ai_pieces = []
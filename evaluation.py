@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Evaluation terms the board keeps as running totals, so that reading them at
+a leaf costs nothing: material, and piece-square tables with a middlegame
+and an endgame value for every piece on every square. The two are blended
+by game phase, which falls from max_phase to 0 as pieces come off.
+
+Pawn structure (passed, doubled, isolated and backward pawns) is worked out
+from the board's pawn bitmasks, one bit per square (y * 8 + x), and cached
+in a PawnTable under the board's pawn-only Zobrist key, since most moves
+leave the pawns alone.
+
+The weight of each term of score_position is in weights. Tuned weights, as
+written by tune.py, are read from weights.json at import if it exists.
+"""
+
+# Imports
+import json
+import os
+
+# Constants
+pvals = {'pawn':1,
+        'bishop':3,
+        'knight':3,
+        'rook':5,
+        'queen':9,
+        'king':9}
+pawn_units = 3 # score_position counts a pawn as 3
+pst_scale = pawn_units / 100 # The tables are in centipawns
+phase_weights = {'pawn': 0, 'knight': 1, 'bishop': 1, 'rook': 2, 'queen': 4,
+                 'king': 0}
+max_phase = 24 # All pieces on the board
+pawn_table_size = 2 ** 14
+weights_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'weights.json')
+
+# Weights of the terms of score_position, in the order tune.py fits them
+material_names = ['pawn', 'knight', 'bishop', 'rook', 'queen']
+feature_names = ['targeting', 'targeted', 'backups', 'center', 'mobility'] + \
+    material_names + ['placement', 'pawn_structure']
+default_weights = {
+    'targeting': 1/2, # Per point of value targeted, less if backed up
+    'targeted': 2, # Per point of value at risk from a threat
+    'backups': 1/20, # Per point of value of each backed up piece
+    'center': .2, # Per move to one of the four center squares
+    'mobility': .1, # Per other move
+    'placement': 1, # Piece-square tables, already in score units
+    'pawn_structure': 1,
+    }
+default_weights.update({ptype: pvals[ptype] * pawn_units
+                        for ptype in material_names})
+weights = dict(default_weights)
+
+# Pawn structure terms in centipawns, (middlegame, endgame)
+doubled_penalty = (-10, -20) # For each pawn behind another on its file
+isolated_penalty = (-10, -15) # No friendly pawns on the adjacent files
+backward_penalty = (-8, -10) # Behind its neighbours and can't advance safely
+passed_bonus = [(0, 0), (5, 10), (10, 20), (15, 35), (25, 60), (40, 90),
+                (60, 130), (0, 0)] # By rank counted from the pawn's side
+
+# Bitmasks over the 64 squares
+all_squares = (1 << 64) - 1
+file_masks = [sum(1 << (y * 8 + x) for y in range(8)) for x in range(8)]
+adjacent_files = [(file_masks[x - 1] if x > 0 else 0) |
+                  (file_masks[x + 1] if x < 7 else 0) for x in range(8)]
+# Ranks strictly in front of, and at or behind, a rank, by color code
+ranks_ahead = [[sum(0xff << (r * 8) for r in range(y + 1, 8)) for y in
+                range(8)],
+               [sum(0xff << (r * 8) for r in range(y)) for y in range(8)]]
+ranks_behind = [[all_squares ^ ranks_ahead[0][y] for y in range(8)],
+                [all_squares ^ ranks_ahead[1][y] for y in range(8)]]
+
+# Piece-square tables in centipawns, from white's side, rank 8 first
+mg_tables = {
+    'pawn': [
+          0,   0,   0,   0,   0,   0,   0,   0,
+         50,  50,  50,  50,  50,  50,  50,  50,
+         10,  10,  20,  30,  30,  20,  10,  10,
+          5,   5,  10,  25,  25,  10,   5,   5,
+          0,   0,   0,  20,  20,   0,   0,   0,
+          5,  -5, -10,   0,   0, -10,  -5,   5,
+          5,  10,  10, -20, -20,  10,  10,   5,
+          0,   0,   0,   0,   0,   0,   0,   0],
+    'knight': [
+        -50, -40, -30, -30, -30, -30, -40, -50,
+        -40, -20,   0,   0,   0,   0, -20, -40,
+        -30,   0,  10,  15,  15,  10,   0, -30,
+        -30,   5,  15,  20,  20,  15,   5, -30,
+        -30,   0,  15,  20,  20,  15,   0, -30,
+        -30,   5,  10,  15,  15,  10,   5, -30,
+        -40, -20,   0,   5,   5,   0, -20, -40,
+        -50, -40, -30, -30, -30, -30, -40, -50],
+    'bishop': [
+        -20, -10, -10, -10, -10, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,  10,  10,   5,   0, -10,
+        -10,   5,   5,  10,  10,   5,   5, -10,
+        -10,   0,  10,  10,  10,  10,   0, -10,
+        -10,  10,  10,  10,  10,  10,  10, -10,
+        -10,   5,   0,   0,   0,   0,   5, -10,
+        -20, -10, -10, -10, -10, -10, -10, -20],
+    'rook': [
+          0,   0,   0,   0,   0,   0,   0,   0,
+          5,  10,  10,  10,  10,  10,  10,   5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+         -5,   0,   0,   0,   0,   0,   0,  -5,
+          0,   0,   0,   5,   5,   0,   0,   0],
+    'queen': [
+        -20, -10, -10,  -5,  -5, -10, -10, -20,
+        -10,   0,   0,   0,   0,   0,   0, -10,
+        -10,   0,   5,   5,   5,   5,   0, -10,
+         -5,   0,   5,   5,   5,   5,   0,  -5,
+          0,   0,   5,   5,   5,   5,   0,  -5,
+        -10,   5,   5,   5,   5,   5,   0, -10,
+        -10,   0,   5,   0,   0,   0,   0, -10,
+        -20, -10, -10,  -5,  -5, -10, -10, -20],
+    'king': [
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -30, -40, -40, -50, -50, -40, -40, -30,
+        -20, -30, -30, -40, -40, -30, -30, -20,
+        -10, -20, -20, -20, -20, -20, -20, -10,
+         20,  20,   0,   0,   0,   0,  20,  20,
+         20,  30,  10,   0,   0,  10,  30,  20],
+    }
+eg_tables = dict(mg_tables)
+eg_tables['pawn'] = [0] * 8 + [80] * 8 + [50] * 8 + [30] * 8 + [20] * 8 + \
+                    [10] * 8 + [10] * 8 + [0] * 8 # Passers matter more
+eg_tables['king'] = [ # The king comes out to help
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10,   0,   0, -10, -20, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  30,  40,  40,  30, -10, -30,
+    -30, -10,  20,  30,  30,  20, -10, -30,
+    -30, -30,   0,   0,   0,   0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50]
+
+
+# Functions
+def table_square(color, sq):
+    """Index into a table (rank 8 first, from white's side) for a piece of
+    color on sq (y * 8 + x). Black's tables are white's, mirrored."""
+    x, y = sq & 7, sq >> 3
+    return (7 - y if color == 'white' else y) * 8 + x
+
+
+def square_values(color, ptype):
+    """(middlegame, endgame) centipawns of a piece on each of the 64
+    squares, for that piece's own side."""
+    return [(mg_tables[ptype][table_square(color, sq)],
+             eg_tables[ptype][table_square(color, sq)]) for sq in range(64)]
+
+
+def tapered(mg, eg, phase):
+    """Blends a middlegame and an endgame value by game phase."""
+    phase = min(phase, max_phase) # Promotions can push it past the start
+    return (mg * phase + eg * (max_phase - phase)) / max_phase
+
+
+def positional_score(board):
+    """The board's piece-square total for white, in score_position units."""
+    return tapered(board.pst_mg, board.pst_eg, board.phase) * pst_scale
+
+
+def load_weights(path=weights_file):
+    """Replaces weights with the ones in a JSON file, keeping the defaults
+    for any it leaves out. Does nothing if the file doesn't exist."""
+    if not os.path.exists(path):
+        return
+    with open(path) as f:
+        loaded = json.load(f)
+    weights.clear()
+    weights.update(default_weights)
+    weights.update({name: float(value) for name, value in loaded.items()
+                    if name in default_weights})
+
+
+def squares_of(mask):
+    """Generator over the squares set in a bitmask."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def pawn_attacks(pawns, color_id):
+    """Squares attacked by a bitmask of pawns of color code color_id."""
+    not_a, not_h = all_squares ^ file_masks[0], all_squares ^ file_masks[7]
+    if color_id == 0:
+        return ((pawns << 9 & not_a) | (pawns << 7 & not_h)) & all_squares
+    return (pawns >> 7 & not_a) | (pawns >> 9 & not_h)
+
+
+def pawn_structure(pawns):
+    """(middlegame, endgame) centipawns for white of the pawn structure,
+    given the bitmasks of white's and black's pawns."""
+    mg = eg = 0
+    for color_id, side in [(0, 1), (1, -1)]:
+        mine, theirs = pawns[color_id], pawns[1 - color_id]
+        attacked = pawn_attacks(theirs, 1 - color_id)
+        for sq in squares_of(mine):
+            x, y = sq & 7, sq >> 3
+            terms = []
+            front = file_masks[x] & ranks_ahead[color_id][y]
+            if mine & front:
+                terms += [doubled_penalty]
+            if not mine & adjacent_files[x]:
+                terms += [isolated_penalty]
+            elif not mine & adjacent_files[x] & ranks_behind[color_id][y]:
+                # Every neighbour is ahead: backward if the stop square is
+                # guarded by an enemy pawn
+                stop = sq + 8 if color_id == 0 else sq - 8
+                if 0 <= stop < 64 and attacked >> stop & 1:
+                    terms += [backward_penalty]
+            span = (file_masks[x] | adjacent_files[x]) & \
+                ranks_ahead[color_id][y]
+            # Only the front pawn of a doubled pair counts as passed
+            if not theirs & span and not mine & front:
+                terms += [passed_bonus[y if color_id == 0 else 7 - y]]
+            for term_mg, term_eg in terms:
+                mg += side * term_mg
+                eg += side * term_eg
+    return mg, eg
+
+
+def pawn_score(board, table=None):
+    """The board's pawn structure score for white, in score_position units,
+    looked up in table (the shared pawn_table by default)."""
+    mg, eg = (table or pawn_table).probe(board)
+    return tapered(mg, eg, board.phase) * pst_scale
+
+
+# Classes
+class PawnTable:
+    """Cache of pawn_structure results by the board's pawn key. Each key has
+    one slot, and a store replaces what is there. Counts probes and hits."""
+    def __init__(self, size=pawn_table_size):
+        self.size = size
+        self.slots = [None] * size
+        self.probes = 0
+        self.hits = 0
+
+    def __repr__(self):
+        return "PawnTable({} slots, {} probes, {:.1%} hits)".format(
+            self.size, self.probes, self.hit_rate())
+
+    def probe(self, board):
+        """pawn_structure of board's pawns, from the cache if it has it."""
+        self.probes += 1
+        slot = board.pawn_key % self.size
+        entry = self.slots[slot]
+        if entry and entry[0] == board.pawn_key:
+            self.hits += 1
+            return entry[1]
+        value = pawn_structure(board.pawns)
+        self.slots[slot] = (board.pawn_key, value)
+        return value
+
+    def hit_rate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def clear(self):
+        self.slots = [None] * self.size
+
+
+pawn_table = PawnTable()
+load_weights()
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Differential fuzzing of the engine's fast paths against the plain
+Chessboard. Seeded random games are played in lockstep, and every position
+is reached three ways: by move_piece on one board kept for the whole game
+(the UI's path), by make_move copies (the search's path, with running
+evaluation totals and an nnue accumulator) and by a BoardBatch made from the
+previous positions. No copy of an older engine is kept to compare with, so
+the reference is a board rebuilt from scratch from the FEN at every check,
+which shares no incremental state with the boards under test.
+
+At every ply the legal moves, the pieces' records (moves, targets, threats
+and backups), the attack maps, the running totals and score_position must
+agree. The random mover favours castles, en passant, promotions and
+captures, where the paths differ most. A divergence is replayed from the
+FEN before its move, and pieces are taken off while it still shows, to
+leave a small position that reproduces it. Game n uses seed n, so any game
+can be played again alone.
+
+    python fuzz.py --games 200 --jobs 4
+    python fuzz.py --seed 1234 --games 1 --plies 120
+    python fuzz.py --replay "r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1" e1g1
+"""
+
+# Imports
+import argparse
+import copy as c
+from multiprocessing import Pool
+from random import Random
+from time import perf_counter
+import numpy as np
+from batch import BoardBatch
+from classes import (Chessboard, array_types, move_orig, move_dest,
+                     move_to_text, text_to_move, square_names, quiet_move,
+                     double_push)
+from nnue import Network
+from search import TurnAnalysis, make_move
+from simulate import score_position, staged_moves, get_all_moves
+
+# Constants
+default_plies = 60
+lockstep_games = 16 # Games played together, sharing a BoardBatch
+special_share = .5 # Chance of picking among the special moves, if any
+default_full_every = 4 # Plies between comparisons of every legal move
+# Records compared square by square. hist isn't, since a board set up from a
+# FEN has placeholder moves there.
+record_kinds = [kind for kind in array_types if kind != 'hist']
+totals = ['material', 'pst_mg', 'pst_eg', 'phase', 'pawn_key', 'pawns']
+network = Network()
+
+
+# Functions
+def rebuild(board):
+    """A board set up from board's FEN, with everything worked out afresh,
+    and with an accumulator if board has one."""
+    fresh = Chessboard()
+    fresh.full_set_up('fen', fen=board.get_fen())
+    if board.network is not None:
+        board.network.attach(fresh)
+    return fresh
+
+
+def moves_text(moves):
+    return " ".join(move_to_text(move) for move in sorted(moves))
+
+
+def records(board):
+    """Each piece's records, sorted, by square and kind."""
+    return {piece.sq: {kind: sorted(getattr(piece, kind)) for kind in
+                       record_kinds} for piece in board.alive}
+
+
+def batch_views(batch):
+    """What a BoardBatch says about each of its boards: the sorted
+    pseudo-legal moves, the set of legal ones, the attack maps, whether the
+    side to move is in check and the FEN."""
+    board_ids, moves = batch.generate()
+    legal = batch.legal(board_ids, moves)
+    maps, checks, fens = batch.attack_maps(), batch.in_check(), batch.fens()
+    views = []
+    for i in range(len(batch)):
+        mine = board_ids == i
+        views += [(sorted(moves[mine].tolist()),
+                   set(moves[mine & legal].tolist()), maps[i],
+                   bool(checks[i]), fens[i])]
+    return views
+
+
+def differences(ui, fast, legal, view):
+    """How the ui board, the fast board (whose legal moves are legal,
+    unless that's None) and a batch view of the same position disagree with
+    each other and with the position set up afresh. A list of
+    'check: detail' strings, empty if they all agree."""
+    found = []
+    fresh = rebuild(fast)
+    pseudo, batch_legal, maps, check, batch_fen = view
+    fen = fast.get_fen()
+    if ui.get_fen() != fen:
+        found += ["fen: ui {} vs fast {}".format(ui.get_fen(), fen)]
+    if batch_fen != fen:
+        found += ["fen: batch {} vs fast {}".format(batch_fen, fen)]
+    expected = records(fresh)
+    expected_score = score_position(fresh, printer=False)
+    for name, board in [('ui', ui), ('fast', fast)]:
+        for total in totals:
+            if getattr(board, total) != getattr(fresh, total):
+                found += ["totals: {} {} {} vs {} afresh".format(
+                    name, total, getattr(board, total), getattr(fresh, total))]
+        if board.get_key() != fresh.get_key():
+            found += ["key: {} {:x} vs {:x} afresh".format(
+                name, board.get_key(), fresh.get_key())]
+        if board.accumulator is not None and \
+                not np.array_equal(board.accumulator, fresh.accumulator):
+            found += ["accumulator: {} differs from afresh".format(name)]
+        got = records(board)
+        for sq in sorted(set(got) | set(expected)):
+            for kind in record_kinds:
+                mine = got.get(sq, {}).get(kind)
+                theirs = expected.get(sq, {}).get(kind)
+                if mine != theirs:
+                    found += ["records: {} {} on {} {} vs {} afresh".format(
+                        name, kind, square_names[sq], mine, theirs)]
+        if not np.array_equal(board.attacks, fresh.attacks):
+            found += ["attacks: {} attack maps differ from afresh".format(
+                name)]
+        score = score_position(board, printer=False)
+        if score != expected_score:
+            found += ["score: {} {} vs {} afresh".format(name, score,
+                                                         expected_score)]
+    staged = sorted(staged_moves(fast))
+    if staged != sorted(get_all_moves(fresh)):
+        found += ["pseudo-legal: staged_moves {} vs get_all_moves {} "
+                  "afresh".format(moves_text(staged),
+                                  moves_text(get_all_moves(fresh)))]
+    if pseudo != staged:
+        found += ["pseudo-legal: batch {} vs staged_moves {}".format(
+            moves_text(pseudo), moves_text(staged))]
+    if legal is not None and batch_legal != set(legal):
+        found += ["legal: batch {} vs make_move {}".format(
+            moves_text(batch_legal), moves_text(legal))]
+    if not np.array_equal(maps, fresh.attacks):
+        found += ["attacks: batch attack maps differ from afresh"]
+    if check != fresh.is_in_check(fresh.turn):
+        found += ["check: batch says {}, afresh {}".format(
+            check, fresh.is_in_check(fresh.turn))]
+    return found
+
+
+def ui_move(board, move):
+    """Plays move on board in place with move_piece, as the UI does with
+    human=False (so promotions become queens). An error or failed
+    validation comes back as a difference."""
+    try:
+        board.move_piece(board[move_orig(move)].occ, move_dest(move), True,
+                         False, False)
+    except (AssertionError, AttributeError, IndexError) as error:
+        return ["ui: move_piece failed on {}: {!r}".format(
+            move_to_text(move), error)]
+    return []
+
+
+def choose(rng, moves):
+    """A random move, picked among the castles, en passant, promotions and
+    captures half the time if there are any."""
+    moves = sorted(moves)
+    special = [move for move in moves
+               if move >> 12 not in [quiet_move, double_push]]
+    if special and rng.random() < special_share:
+        return rng.choice(special)
+    return rng.choice(moves)
+
+
+def replay(fen, move=None):
+    """differences after move is made on a board set up from fen, or of
+    the position itself without a move. None if move isn't legal there,
+    which includes a capture of a piece minimize took off."""
+    board = Chessboard()
+    board.full_set_up('fen', fen=fen)
+    network.attach(board)
+    if move is None:
+        ui, fast = c.deepcopy(board), board
+        batch = BoardBatch.from_boards([board])
+    else:
+        fast = make_move(board, move) if move in get_all_moves(board) \
+            else None
+        if fast is None:
+            return None
+        ui = c.deepcopy(board)
+        failed = ui_move(ui, move)
+        if failed:
+            return failed
+        batch = BoardBatch.from_boards([board]).play(np.array([move]))
+    children = TurnAnalysis(fast).children
+    return differences(ui, fast, [m for m, child in children],
+                       batch_views(batch)[0])
+
+
+def kinds(found):
+    return {difference.split(':')[0] for difference in found}
+
+
+def minimize(fen, move, found):
+    """Takes pieces off the board of fen one at a time, other than kings and
+    the moving piece, keeping each removal after which move is still legal
+    and a divergence of the same kinds still shows. Returns the smaller FEN
+    and its differences."""
+    wanted = kinds(found)
+    shrunk = True
+    while shrunk:
+        shrunk = False
+        board = Chessboard()
+        board.full_set_up('fen', fen=fen)
+        keep = [move & 63] if move is not None else []
+        for piece in board.alive:
+            if piece.type == 'king' or piece.sq in keep:
+                continue
+            trial = c.deepcopy(board)
+            trial[piece.pos].occ = None
+            try:
+                candidate = rebuild(trial).get_fen()
+                again = replay(candidate, move)
+            except (ValueError, KeyError, IndexError, AssertionError):
+                continue
+            if again and wanted & kinds(again):
+                fen, found, shrunk = candidate, again, True
+                break
+    return fen, found
+
+
+def report(game, found):
+    """What to print about a game that diverged: its seed and moves, and
+    the FEN and move that showed the divergence (no move if it was in the
+    starting position)."""
+    move = game['moves'][-1] if game['moves'] else None
+    return {'seed': game['seed'], 'moves': game['moves'], 'move': move,
+            'fen': game['parent'] if move is not None else
+            game['fast'].get_fen(), 'differences': found}
+
+
+def fuzz_games(seeds, plies=default_plies, fen=None,
+               full_every=default_full_every):
+    """Plays a random game for each seed in lockstep from fen (the start
+    position if None), checking every position, and stops a game at its
+    first divergence. Making every legal move with make_move, to compare the
+    legal moves with the batch's, is most of the work, so that is only done
+    every full_every plies. In between, moves are picked among the batch's
+    legal moves and only the one played is made. Returns the number of
+    positions checked and a report of each game that diverged."""
+    games = []
+    for seed in seeds:
+        board = Chessboard()
+        if fen:
+            board.full_set_up('fen', fen=fen)
+        else:
+            board.full_set_up()
+        network.attach(board)
+        games += [{'seed': seed, 'rng': Random(seed), 'fast': board,
+                   'ui': c.deepcopy(board), 'moves': [], 'parent': None}]
+    batch = BoardBatch.from_boards([game['fast'] for game in games])
+    positions, reports = 0, []
+    for ply in range(plies + 1):
+        live = []
+        for game, view in zip(games, batch_views(batch)):
+            positions += 1
+            children, legal = None, None
+            if ply % full_every == 0:
+                children = dict(TurnAnalysis(game['fast']).children)
+                legal = list(children)
+            found = differences(game['ui'], game['fast'], legal, view)
+            if found:
+                reports += [report(game, found)]
+            elif view[1] and not game['fast'].draw_check() and ply < plies:
+                live += [(game, view[1], children)]
+        games, parents, moves = [], [], []
+        for game, legal, children in live:
+            move = choose(game['rng'], legal)
+            game['parent'] = game['fast'].get_fen()
+            game['moves'] += [move]
+            child = children[move] if children else \
+                make_move(game['fast'], move)
+            if child is None:
+                reports += [report(game, ["legal: make_move refuses {}, which "
+                                          "the batch allows".format(
+                                              move_to_text(move))])]
+                continue
+            failed = ui_move(game['ui'], move)
+            if failed:
+                reports += [report(game, failed)]
+                continue
+            parents += [game['fast']]
+            game['fast'] = child
+            games += [game]
+            moves += [move]
+        if not games:
+            break
+        # The batch makes the moves itself, from the positions before them
+        batch = BoardBatch.from_boards(parents).play(np.array(moves))
+    return positions, reports
+
+
+def fuzz_chunk(task):
+    """fuzz_games for a (seeds, plies, fen, full_every) task, for a pool of
+    workers."""
+    return fuzz_games(*task)
+
+
+def print_report(found):
+    """Prints a diverged game and a minimized position reproducing it, or
+    says that only the whole game does."""
+    print("Game {} diverged after {}".format(
+        found['seed'], " ".join(move_to_text(move) for move in
+                                found['moves']) or "no moves"))
+    for difference in found['differences']:
+        print("    " + difference)
+    fen, move = found['fen'], found['move']
+    again = replay(fen, move)
+    if again is None:
+        # make_move refused the move, so the position before it is at fault
+        move, again = None, replay(fen)
+    if not again:
+        print("  Only the whole game reproduces it: python fuzz.py --seed "
+              "{} --games 1".format(found['seed']))
+        return
+    fen, again = minimize(fen, move, again)
+    print("  Reproduce with: python fuzz.py --replay \"{}\"{}".format(
+        fen, " " + move_to_text(move) if move is not None else ""))
+    for difference in again:
+        print("    " + difference)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--plies', type=int, default=default_plies)
+    parser.add_argument('--seed', type=int, default=0,
+                        help="Seed of the first game, the others counting "
+                             "up from it.")
+    parser.add_argument('--fen', help="Play the games from this position.")
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--full-every', type=int,
+                        default=default_full_every,
+                        help="Compare every legal move made with make_move "
+                             "only every this many plies, for speed.")
+    parser.add_argument('--replay', nargs='+', metavar=('FEN', 'MOVE'),
+                        help="Check one position, or the move from it, "
+                             "like 'e1g1'.")
+    args = parser.parse_args()
+
+    if args.replay:
+        fen = args.replay[0]
+        move = None
+        if len(args.replay) > 1:
+            board = Chessboard()
+            board.full_set_up('fen', fen=fen)
+            move = text_to_move(board, args.replay[1])
+            if move is None:
+                parser.error("No such move: " + args.replay[1])
+        found = replay(fen, move)
+        if found is None:
+            parser.error("Illegal move: " + args.replay[1])
+        for difference in found:
+            print(difference)
+        print("{} differences".format(len(found)))
+        raise SystemExit(1 if found else 0)
+
+    seeds = list(range(args.seed, args.seed + args.games))
+    tasks = [(seeds[i:i + lockstep_games], args.plies, args.fen,
+              args.full_every)
+             for i in range(0, len(seeds), lockstep_games)]
+    start = perf_counter()
+    positions, diverged = 0, []
+    with Pool(args.jobs) as pool:
+        for checked, reports in pool.imap_unordered(fuzz_chunk, tasks):
+            positions += checked
+            diverged += reports
+    seconds = perf_counter() - start
+    for found in sorted(diverged, key=lambda found: found['seed']):
+        print_report(found)
+    print("{} games, {} positions, {} diverged in {:.1f}s ({:,.0f} games/"
+          "min, {:,.0f} positions/s)".format(
+              args.games, positions, len(diverged), seconds,
+              args.games / seconds * 60, positions / seconds))
+    raise SystemExit(1 if diverged else 0)
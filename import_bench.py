@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measures how long each module takes to import in a fresh interpreter, using
+python -X importtime, and checks the times against a budget. Headless
+workers only need classes and search, so those must stay clear of pandas
+and colorama.
+
+    python import_bench.py --runs 5
+"""
+
+# Imports
+import argparse
+import subprocess
+import sys
+
+# Constants
+# Milliseconds allowed for each module, including everything it imports
+budgets = {
+    'classes': 250,
+    'search': 300,
+    'selfplay': 350,
+    'pretty_board': 50,
+    'main': 400,
+    }
+slow_modules = ['pandas', 'colorama'] # Must not load with classes or search
+
+
+# Functions
+def import_times(module):
+    """Imports module in a new interpreter. Returns a dict of the cumulative
+    import time in milliseconds of every module it loaded."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             'import ' + module],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[12:].split('|')
+        times[name.strip()] = int(cumulative_us) / 1000
+    return times
+
+
+def measure(module, runs=3):
+    """Best time of several runs for module, and the modules it loaded."""
+    best, loaded = None, set()
+    for i in range(runs):
+        times = import_times(module)
+        loaded |= set(times)
+        if best is None or times[module] < best:
+            best = times[module]
+    return best, loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    for module, budget in budgets.items():
+        ms, loaded = measure(module, args.runs)
+        slow = [i for i in slow_modules if i in loaded]
+        over = ms > budget or (module in ['classes', 'search'] and slow)
+        failed = failed or over
+        print("{:<14}{:>8.1f} ms  budget {:>4} ms  {}{}".format(
+            module, ms, budget, 'OVER' if over else 'ok',
+            '  (loads ' + ', '.join(slow) + ')' if slow else ''))
+    sys.exit(1 if failed else 0)
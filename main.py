@@ -4,20 +4,35 @@
 """The main file through which chess can be played."""
 
 # Import packages
-from time import sleep
+from time import sleep, perf_counter
+import argparse
 import os
 
 # Import modules
-from pretty_board import pretty_board
-from classes import Chessboard
+from pretty_board import BoardRenderer, fits_terminal
+from classes import Chessboard, move_to_text, opponent
 from simulate import Simulator
 from flavor import flavor_spitter
+from pgn import write_game
+from search import Searcher, TurnAnalysis
+from mate import MateSearch, worth_trying
+from timeman import TimeManager
 
 # Define constants
 wait = 2 # Amount of time to wait between printouts.
+fast = False # Set by --fast: no waits and no screen clears
 letter_list = ['a','b','c','d','e','f','g','h']
+max_depth = 20 # The AI searches as deep as its clock or node budget allows
+multipv_lines = 5 # Moves shown by the scores and ai commands
+multipv_depth = 2
+mate_moves = 3 # Longest mate the AI looks for against little material
+mate_nodes = 2000 # Cap on the mate search's tree, a few seconds
+mate_rate = 600 # Mate search nodes per second, roughly
+mate_share = .5 # Under a clock, the part of a move's time it may take
 
-# For each difficulty how many moves to consider, and responses to consider
+# For each difficulty how many moves to consider, and responses to consider.
+# A level can instead be a number of nodes, for the alpha-beta search with
+# that node budget, which plays the same moves on any machine.
 difficulty_map = {
         1: (1,1),
         2: (2,1),
@@ -28,6 +43,7 @@ difficulty_map = {
         7: (5,2),
         8: (5,3),
         9: (6,3),
+        10: 2000,
         }
 
 
@@ -39,107 +55,168 @@ def interpret_string(string):
     return (x,y)
 
 
-# Main code begins here
-os.system('cls' if os.name == 'nt' else 'clear')
-print("Welcome to jerk chess! The chess bot that insults you.")
-sleep(wait)
-print("You'll be prompted to submit moves, questions, and decisions via text.")
-sleep(wait)
-print("If you want to quit, just type 'quit' at any time.\n\n")
-sleep(wait)
-
-# Difficulty selection
-failed_input_count = 0
-valid_input_list = [str(i) for i in [1,2,3,4,5,6,7,8,9]]
-difficulty = input("To begin, enter a difficulty between 1 and 9, with 9 "
-                   "being the most difficult: ")
-if difficulty == 'quit':
-        quit()
-while difficulty not in valid_input_list:
-    failed_input_count += 1
-    if failed_input_count == 1:
-        difficulty = input("Seriously, it's not that hard. If you want "
-                           "difficult enter 9, if you want easy enter 1. "
-                           "Simple. Now go ahead: ")
-    elif failed_input_count == 2:
-        difficulty = input("I am beginning to suspect you're doing this "
-                           "on purpose. One more time. Enter a number "
-                           "between 1 and 9, 9 being the hardest difficulty: ")
-    elif failed_input_count == 3:
-        print("You're being difficult. Well, that makes two of us.")
-        sleep(wait)
-        difficulty = '9'
+def pause(seconds):
+    """Sleeps between printouts, unless running with --fast."""
+    if not fast:
+        sleep(seconds)
+
+
+def clear_screen():
+    """Clears the terminal, unless running with --fast."""
+    if not fast:
+        os.system('cls' if os.name == 'nt' else 'clear')
+
+
+def intro():
+    """Greets the player."""
+    clear_screen()
+    print("Welcome to jerk chess! The chess bot that insults you.")
+    pause(wait)
+    print("You'll be prompted to submit moves, questions, and decisions via "
+          "text.")
+    pause(wait)
+    print("If you want to quit, just type 'quit' at any time.\n\n")
+    pause(wait)
+
+
+def choose_difficulty():
+    """Asks for a difficulty. Returns it and the number of failed inputs."""
+    failed_input_count = 0
+    valid_input_list = [str(i) for i in difficulty_map]
+    difficulty = input("To begin, enter a difficulty between 1 and 10, with "
+                       "10 being the most difficult: ")
     if difficulty == 'quit':
-        quit()
-print("You have chosen difficulty: " + difficulty + "!")
-sleep(wait)
-if difficulty in ['1','2','3']:
-    print("I didn't expect to have to play against cowards. Oh well.\n\n")
-elif difficulty in ['4','5','6','7']:
-    print("Pretty boring difficulty selection, not gonna lie.\n\n")
-elif difficulty in ['8','9']:
-    print("I'm certain you will regret your decision.\n\n")
-sleep(wait)
-gen1, gen2 = difficulty_map[int(difficulty)]
-
-# Color selection
-failed_color_input_count = 0
-statement = ("Now it's time to select a color. Enter 'black' or 'white' "
-             "without quotes and we can begin playing: ")
-if failed_input_count >= 2:
-    statement = statement[:-2] + (". Please don't waste my time again. Just "
-                "enter a value: ")
-color = input(statement)
-if color == 'quit':
-    quit()
-while color not in ['black', 'white']:
-    failed_input_count += 1
-    failed_color_input_count += 1
-    if failed_color_input_count == 1:
-        print("You only get one more chance. #SorryNotSorry.")
-        sleep(wait)
-        color = input("Enter black or white. It's not hard: ")
-    elif failed_color_input_count == 2:
-        print("I warned you.")
-        sleep(wait)
-        color = 'black'
+            quit()
+    while difficulty not in valid_input_list:
+        failed_input_count += 1
+        if failed_input_count == 1:
+            difficulty = input("Seriously, it's not that hard. If you want "
+                               "difficult enter 10, if you want easy enter 1. "
+                               "Simple. Now go ahead: ")
+        elif failed_input_count == 2:
+            difficulty = input("I am beginning to suspect you're doing this "
+                               "on purpose. One more time. Enter a number "
+                               "between 1 and 10, 10 being the hardest "
+                               "difficulty: ")
+        elif failed_input_count == 3:
+            print("You're being difficult. Well, that makes two of us.")
+            pause(wait)
+            difficulty = '10'
+        if difficulty == 'quit':
+            quit()
+    print("You have chosen difficulty: " + difficulty + "!")
+    pause(wait)
+    if difficulty in ['1','2','3']:
+        print("I didn't expect to have to play against cowards. Oh well.\n\n")
+    elif difficulty in ['4','5','6','7']:
+        print("Pretty boring difficulty selection, not gonna lie.\n\n")
+    elif difficulty in ['8','9','10']:
+        print("I'm certain you will regret your decision.\n\n")
+    pause(wait)
+    return difficulty, failed_input_count
+
+
+def choose_color(failed_input_count=0):
+    """Asks for a color, with less patience after failed inputs."""
+    failed_color_input_count = 0
+    statement = ("Now it's time to select a color. Enter 'black' or 'white' "
+                 "without quotes and we can begin playing: ")
+    if failed_input_count >= 2:
+        statement = statement[:-2] + (". Please don't waste my time again. "
+                    "Just enter a value: ")
+    color = input(statement)
     if color == 'quit':
         quit()
-print("You have chosen " + color + "!\n\n")
-sleep(wait)
-
-# Begin game
-print("The game is afoot! You can always say 'help' for help, or 'quit' to "
-      "quit.")
-sleep(wait)
-print("You make moves by entering the origin square followed by the "
-      "destination square. \nFor instance, 'B7 B5' is a valid opener for white.")
-sleep(wait * 3)
-print("I hope you're ready to lose.")
-sleep(int(wait/2))
-print("3")
-sleep(int(wait/2))
-print("2")
-sleep(int(wait/2))
-print("1")
-sleep(int(wait/2))
-os.system('cls' if os.name == 'nt' else 'clear')
-cboard = Chessboard(player_color = color)
-cboard.full_set_up()
-if color == 'black':
-    pretty_board(cboard, False)
-else:
-    pretty_board(cboard, True)
-
-# Game loop
-ai_df = None
-check = False
-while True:
-    sim = Simulator(cboard)
-    df = sim.simulate()
-    # Checkmate Logic
-    if check:
-        if df.score.max() < -200:
+    while color not in ['black', 'white']:
+        failed_input_count += 1
+        failed_color_input_count += 1
+        if failed_color_input_count == 1:
+            print("You only get one more chance. #SorryNotSorry.")
+            pause(wait)
+            color = input("Enter black or white. It's not hard: ")
+        elif failed_color_input_count == 2:
+            print("I warned you.")
+            pause(wait)
+            color = 'black'
+        if color == 'quit':
+            quit()
+    print("You have chosen " + color + "!\n\n")
+    pause(wait)
+    return color
+
+
+def countdown():
+    """Explains how to move, then counts down to the first board."""
+    print("The game is afoot! You can always say 'help' for help, or 'quit' "
+          "to quit.")
+    pause(wait)
+    print("You make moves by entering the origin square followed by the "
+          "destination square. \nFor instance, 'B7 B5' is a valid opener for "
+          "white.")
+    pause(wait * 3)
+    print("I hope you're ready to lose.")
+    pause(int(wait/2))
+    print("3")
+    pause(int(wait/2))
+    print("2")
+    pause(int(wait/2))
+    print("1")
+    pause(int(wait/2))
+    clear_screen()
+
+
+def show_lines(analysis):
+    """Prints the best moves of the side to move in a TurnAnalysis with
+    their scores and the lines the search expects to follow."""
+    lines = analysis.lines(multipv_lines, multipv_depth)
+    for i, (move, score, pv) in enumerate(lines):
+        print("{}. {:<6} {:>7.1f}   {}".format(
+            i + 1, move_to_text(move), score,
+            " ".join(move_to_text(m) for m in pv)))
+
+
+def format_clock(seconds):
+    """Like '4:05' for 245 seconds."""
+    seconds = max(int(seconds), 0)
+    return "{}:{:02d}".format(seconds // 60, seconds % 60)
+
+
+def play(color, level, clock=None, increment=0):
+    """Runs the game loop until someone wins, draws or quits. level is the
+    difficulty_map entry for the AI. With a clock (minutes each) the AI uses
+    the alpha-beta search with a TimeManager instead, and running out of
+    time loses."""
+    cboard = Chessboard(player_color = color)
+    cboard.full_set_up()
+    # Redraw only the squares that change, unless the screen isn't cleared
+    # or is too small to hold the board, which then is printed in full
+    if not fast and fits_terminal():
+        cboard.renderer = BoardRenderer()
+    cboard.view(color == 'white')
+
+    # Game loop
+    analysis = None # Of the position on the board, remade after each move
+    ai_analysis = None # Of the position before the AI's last move
+    clocks = {'white': clock * 60, 'black': clock * 60} if clock else None
+    last_turn, turn_start = cboard.turn, perf_counter()
+    while True:
+        # Clock Logic: charge whoever just moved
+        if clocks and cboard.turn != last_turn:
+            clocks[last_turn] -= perf_counter() - turn_start
+            if clocks[last_turn] < 0:
+                print(last_turn.title() + " ran out of time! " +
+                      cboard.turn.upper() + " wins!")
+                input("Press enter to quit.\n")
+                quit()
+            clocks[last_turn] += increment
+            print("Clock: white {}, black {}".format(
+                format_clock(clocks['white']), format_clock(clocks['black'])))
+            last_turn, turn_start = cboard.turn, perf_counter()
+        if analysis is None or not analysis.is_current(cboard):
+            analysis = TurnAnalysis(cboard)
+        status = analysis.status()
+        # Checkmate Logic
+        if status == 'checkmate':
             print("That's checkmate! " + cboard.nonturn.upper() + " wins!")
             if cboard.nonturn == cboard.player_color:
                 flavor_spitter('loss')
@@ -147,79 +224,142 @@ while True:
                 flavor_spitter('victory')
             input("Press enter to quit.\n")
             quit()
-    # Stalemate Logic
-    else:
-        if df.shape[0] == 0 or df.score.max() < -200:
+        # Stalemate Logic
+        elif status == 'stalemate':
             print("That's stalemate! Tie game!")
             input("Press enter to quit.\n")
             quit()
-    # Other Game Ending Logic
-    end, reason = cboard.game_over_check()
-    if end:
-        input(reason + " Press enter to quit.\n")
-        quit()
-    # Player Turn Logic
-    if cboard.turn == color:
-        human_df = df
-        print("It's " + cboard.turn + "'s turn!")
-        move = input("\nEnter a move, 'help', or 'quit': ")
-        # Handle quit request
-        if move == 'quit':
+        # Other Game Ending Logic
+        end, reason = cboard.game_over_check()
+        if end:
+            input(reason + " Press enter to quit.\n")
             quit()
-        # Handle request for info
-        elif move == 'help':
-            info = ("I figured you'd probably need help. Here are some of the "
-                    "things you can do, besides lose.\n\n"
-                    "quit\t-\tQuits the game, like the pathetic quitter you are.\n"
-                    "help\t-\tYou should already know what this does.\n"
-                    "info a1\t-\tGives information about the piece on a1.\n"
-                    "scores\t-\tShows how the AI would score your moves.\n"
-                    "ai \t-\tShows how the AI scored its previous moves.\n"
-                    "a7 a6\t-\tMoves the piece on a7 to a6, if possible.\n"
-                    )
-            print(info)
-        # Handle request for human score dataframe
-        elif move == 'scores':
-            print(human_df)
-        # Handle reqest for AI score dataframe
-        elif move == 'ai':
-            if ai_df is not None:
-                print(ai_df)
-            else:
-                print("Not available yet.")
-        # Handle Info Request for Piece
-        elif ' ' in move and move.split(' ')[0] == 'info':
-            try:
-                position = interpret_string(move.split(' ')[1])
-                occ = cboard[position].occ
-                if occ:
-                    occ.info()
+        # Player Turn Logic
+        if cboard.turn == color:
+            print("It's " + cboard.turn + "'s turn!")
+            move = input("\nEnter a move, 'help', or 'quit': ")
+            # Handle quit request
+            if move == 'quit':
+                quit()
+            # Handle request for info
+            elif move == 'help':
+                info = ("I figured you'd probably need help. Here are some of "
+                        "the things you can do, besides lose.\n\n"
+                        "quit\t-\tQuits the game, like the pathetic quitter "
+                        "you are.\n"
+                        "help\t-\tYou should already know what this does.\n"
+                        "info a1\t-\tGives information about the piece on "
+                        "a1.\n"
+                        "scores\t-\tShows the best moves for you, and the "
+                        "lines behind them.\n"
+                        "ai \t-\tShows the best moves the AI had before its "
+                        "last move.\n"
+                        "pgn\t-\tShows the game so far in PGN.\n"
+                        "a7 a6\t-\tMoves the piece on a7 to a6, if possible.\n"
+                        )
+                print(info)
+            # Handle request for the human's best moves
+            elif move == 'scores':
+                show_lines(analysis)
+            # Handle reqest for the AI's best moves last turn
+            elif move == 'ai':
+                if ai_analysis is not None:
+                    show_lines(ai_analysis)
                 else:
-                    print("There's no piece there... use your head.")
-            except:
-                print("Invalid input.")
-        # Handle movement
-        elif ' ' in move:
-            try:
-                piece = interpret_string(move.split(' ')[0])
-                dest = interpret_string(move.split(' ')[1])
+                    print("Not available yet.")
+            # Handle request for the game record
+            elif move == 'pgn':
+                players = {color: 'You', opponent[color]: 'chessjerk'}
+                print(write_game(cboard, {'White': players['white'],
+                                          'Black': players['black']}))
+            # Handle Info Request for Piece
+            elif ' ' in move and move.split(' ')[0] == 'info':
+                try:
+                    position = interpret_string(move.split(' ')[1])
+                    occ = cboard[position].occ
+                    if occ:
+                        occ.info()
+                    else:
+                        print("There's no piece there... use your head.")
+                except:
+                    print("Invalid input.")
+            # Handle movement
+            elif ' ' in move:
+                try:
+                    piece = interpret_string(move.split(' ')[0])
+                    dest = interpret_string(move.split(' ')[1])
+                except:
+                    piece = dest = None
+                if piece is None or dest is None:
+                    print("Invalid move!")
                 # Identify if move leaves player in check
-                score = df.loc[(df.orig==piece) & (df.dest==dest),
-                               'score'].values[0]
-                if score < -200:
-                    print("Would put you in check! Try agin.")
+                elif analysis.find_move(piece, dest) is None:
+                    if analysis.leaves_in_check(piece, dest):
+                        print("Would put you in check! Try agin.")
+                    else:
+                        print("Invalid move!")
                 else:
-                    check = cboard.move_piece(cboard[piece].occ,
-                                                 (dest), True, True)
-            except:
-                print("Invalid move!")
+                    cboard.move_piece(cboard[piece].occ, (dest), True, True)
+            else:
+                print("Invalid input.")
+        # Handle AI Move
         else:
-            print("Invalid input.")
-    # Handle AI Move
-    else:
-        ai_df = df
-        print("That means me. :) Let me think...")
-        sim = Simulator(cboard, gen1, gen2)
-        orig, dest = sim.multi_level_simulate()
-        check = cboard.move_piece(cboard[orig].occ,
-                                         (dest), True, True, False)
+            ai_analysis = analysis
+            print("That means me. :) Let me think...")
+            # Against little material, a proven mate beats any evaluation.
+            # Under a clock it gets nodes for part of the move's time only.
+            nodes = mate_nodes
+            if clocks:
+                soft = TimeManager(clocks[cboard.turn] -
+                                   (perf_counter() - turn_start),
+                                   increment).soft
+                nodes = min(nodes, int(soft * mate_share * mate_rate))
+            if nodes > 0 and worth_trying(cboard):
+                found = MateSearch(nodes).solve(cboard, mate_moves)
+                if found:
+                    cboard.play_move(found[0], True, False)
+                    continue
+            if clocks:
+                timer = TimeManager(clocks[cboard.turn] -
+                                    (perf_counter() - turn_start), increment)
+                move, score = Searcher().search(cboard, max_depth, timer)
+                cboard.play_move(move, True, False)
+                continue
+            if isinstance(level, int):
+                move, score = Searcher().search(cboard, max_depth,
+                                                nodes=level)
+                cboard.play_move(move, True, False)
+                continue
+            gen1, gen2 = level
+            sim = Simulator(cboard, gen1, gen2)
+            orig, dest = sim.multi_level_simulate(analysis)
+            cboard.move_piece(cboard[orig].occ, (dest), True, True, False)
+
+
+def main(difficulty=None, color=None, clock=None, increment=0):
+    """Runs the intro, asks for whatever wasn't given, and plays."""
+    intro()
+    failed_input_count = 0
+    if difficulty is None:
+        difficulty, failed_input_count = choose_difficulty()
+    if color is None:
+        color = choose_color(failed_input_count)
+    countdown()
+    play(color, difficulty_map[int(difficulty)], clock, increment)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--fast', action='store_true',
+                        help="Skip the waits between printouts and the "
+                             "screen clears.")
+    parser.add_argument('--difficulty', type=int, choices=difficulty_map)
+    parser.add_argument('--color', choices=['black', 'white'])
+    parser.add_argument('--clock', type=float,
+                        help="Play with a clock of this many minutes each. "
+                             "The AI then manages its own time.")
+    parser.add_argument('--increment', type=float, default=0,
+                        help="Seconds added to a clock after each move.")
+    args = parser.parse_args()
+    fast = args.fast
+    main(args.difficulty, args.color, args.clock, args.increment)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Mate search by proof-number search. The attacker only tries checking moves
+and the defender every legal reply, so the tree stays narrow. It is grown
+one leaf at a time, at the most-proving node: the leaf that most cheaply
+helps to prove or disprove mate. A node's proof number is how many leaves
+must still turn out to be mates to prove it, its disproof number how many
+must turn out to escape to disprove it.
+
+Mate in 1, 2, ... moves is tried in turn, so the first mate proved is the
+shortest. The tree is capped at a number of nodes, past which the search
+gives up, and boards are only kept on the leaves. Most of the attacker's
+moves are ruled out as checks from the squares alone, without copying the
+board to make them.
+
+    python mate.py "6k1/5ppp/8/8/8/8/5PPP/R5K1 w - - 0 1" --moves 3
+"""
+
+# Imports
+import argparse
+import copy as c
+from time import perf_counter
+from classes import (move_to_text, move_orig, move_dest, quiet_move,
+                     double_push, capture_move)
+from evaluation import pvals
+from search import make_move, in_check, is_draw
+from simulate import staged_moves
+
+# Constants
+inf = float('inf')
+default_max_nodes = 20000
+low_material = 5 # Points of material, a rook, below which mates are likely
+plain_flags = [quiet_move, double_push, capture_move] # gives_check handles
+sliders = [([(1, 0), (-1, 0), (0, 1), (0, -1)], ['rook', 'queen']),
+           ([(1, 1), (1, -1), (-1, 1), (-1, -1)], ['bishop', 'queen'])]
+
+
+# Functions
+def material(board, color):
+    """Points of material color has, not counting the king."""
+    return sum(pvals[piece.type] for piece in board.get_pieces(color=[color])
+               if piece.type != 'king')
+
+
+def worth_trying(board):
+    """True if the side not to move is low enough on material for a mate
+    search to be worth its time."""
+    return material(board, board.nonturn) <= low_material
+
+
+def gives_check(board, move):
+    """True if move, a quiet move, double push or capture, checks the side
+    not to move. Only the moved piece can check directly, and sliders seen
+    from the king through its old square by discovery."""
+    orig, dest = move_orig(move), move_dest(move)
+    piece = board[orig].occ
+    king = board.get_king(board.nonturn)
+    if not king:
+        return False
+    dx, dy = abs(king.x - dest[0]), abs(king.y - dest[1])
+    if piece.type == 'knight' and sorted([dx, dy]) == [1, 2]:
+        return True
+    if piece.type == 'pawn':
+        step = 1 if board.turn == 'white' else -1
+        if king.y - dest[1] == step and dx == 1:
+            return True
+    for directions, types in sliders:
+        for step_x, step_y in directions:
+            x, y = king.x + step_x, king.y + step_y
+            while 0 <= x < 8 and 0 <= y < 8:
+                if (x, y) == dest:
+                    occ = piece
+                elif (x, y) == orig:
+                    occ = None
+                else:
+                    occ = board[x, y].occ
+                if occ:
+                    if occ.color == board.turn and occ.type in types:
+                        return True
+                    break
+                x, y = x + step_x, y + step_y
+    return False
+
+
+def mate_length(node):
+    """Plies to mate from a proven node, the attacker taking the quickest
+    mate and the defender the slowest."""
+    if not node.children:
+        return 0
+    if node.attacker:
+        return min(1 + mate_length(child) for child in node.children
+                   if child.proof == 0)
+    return max(1 + mate_length(child) for child in node.children)
+
+
+def mate_line(node):
+    """Moves of the line mate_length follows from a proven node."""
+    line = []
+    while node.children:
+        if node.attacker:
+            node = min((child for child in node.children if child.proof == 0),
+                       key=mate_length)
+        else:
+            node = max(node.children, key=mate_length)
+        line += [node.move]
+    return line
+
+
+# Classes
+class MateNode:
+    """A position in the proof tree. An attacker node (the attacker to move)
+    is proven when any child is, a defender node when all of them are. The
+    board is dropped once the children are made."""
+    def __init__(self, board, move, parent, attacker, ply):
+        self.board = board
+        self.move = move # The move that led here
+        self.parent = parent
+        self.attacker = attacker
+        self.ply = ply
+        self.children = None
+        self.proof = 1
+        self.disproof = 1
+
+    def set_numbers(self):
+        """Proof and disproof numbers from the children's."""
+        if self.attacker:
+            self.proof = min(child.proof for child in self.children)
+            self.disproof = sum(child.disproof for child in self.children)
+        else:
+            self.proof = sum(child.proof for child in self.children)
+            self.disproof = min(child.disproof for child in self.children)
+
+    def set_proven(self, proven):
+        self.proof, self.disproof = (0, inf) if proven else (inf, 0)
+
+
+class MateSearch:
+    """Proof-number search for a mate by the side to move. nodes counts the
+    tree nodes made by the last solve, which stops at max_nodes."""
+    def __init__(self, max_nodes=default_max_nodes):
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.outcome = None
+
+    def solve(self, board, max_moves):
+        """Looks for a mate in at most max_moves moves. Returns the first
+        move, the number of moves and the line of the shortest mate found,
+        or None. outcome then says 'mate', 'no mate' if there is none in
+        max_moves, or 'unknown' if the node cap was reached first."""
+        self.nodes = 0
+        for moves in range(1, max_moves + 1):
+            root = self.prove(board, moves)
+            if root.proof == 0:
+                self.outcome = 'mate'
+                line = mate_line(root)
+                return line[0], moves, line
+            if root.disproof != 0:
+                self.outcome = 'unknown'
+                return None
+        self.outcome = 'no mate'
+        return None
+
+    def prove(self, board, moves):
+        """Grows a proof tree for mate in moves until the root is proven or
+        disproven, or the node cap is reached. Returns the root."""
+        root = MateNode(c.deepcopy(board), None, None, True, 0)
+        self.nodes += 1
+        while root.proof and root.disproof and self.nodes < self.max_nodes:
+            node = self.most_proving(root)
+            self.expand(node, moves)
+            self.update(node.parent)
+        return root
+
+    def most_proving(self, node):
+        """The leaf reached by following the child with the smallest proof
+        number from attacker nodes, and disproof number from defender
+        nodes."""
+        while node.children:
+            if node.attacker:
+                node = min(node.children, key=lambda child: child.proof)
+            else:
+                node = min(node.children, key=lambda child: child.disproof)
+        return node
+
+    def expand(self, node, moves):
+        """Makes the children of a leaf, or finds it is proven or
+        disproven."""
+        board, node.board = node.board, None
+        node.children = []
+        if node.ply > 0 and is_draw(board):
+            node.set_proven(False)
+            return
+        if not node.attacker and (node.ply + 1) // 2 >= moves:
+            # No moves left to mate with: only a mate now counts
+            node.set_proven(not any(make_move(board, move) is not None
+                                    for move in staged_moves(board)))
+            return
+        for move in staged_moves(board):
+            if node.attacker and move >> 12 in plain_flags and \
+                    not gives_check(board, move):
+                continue
+            child = make_move(board, move)
+            if child is None or (node.attacker and not in_check(child)):
+                continue
+            node.children += [MateNode(child, move, node, not node.attacker,
+                                       node.ply + 1)]
+        self.nodes += len(node.children)
+        if not node.children:
+            # The attacker has no checks left, or the defender is mated,
+            # since every defender node is in check
+            node.set_proven(not node.attacker)
+            return
+        node.set_numbers()
+
+    def update(self, node):
+        """Passes a changed leaf's numbers up to its ancestors, stopping
+        where they no longer change."""
+        while node:
+            before = node.proof, node.disproof
+            node.set_numbers()
+            if (node.proof, node.disproof) == before:
+                break
+            node = node.parent
+
+
+if __name__ == "__main__":
+    from classes import Chessboard
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('fen')
+    parser.add_argument('--moves', type=int, default=3)
+    parser.add_argument('--nodes', type=int, default=default_max_nodes)
+    args = parser.parse_args()
+
+    board = Chessboard()
+    board.full_set_up('fen', fen=args.fen)
+    solver = MateSearch(args.nodes)
+    start = perf_counter()
+    found = solver.solve(board, args.moves)
+    seconds = perf_counter() - start
+    if found:
+        move, moves, line = found
+        print("Mate in {}: {}".format(moves,
+                                      " ".join(move_to_text(m) for m in line)))
+    else:
+        print("No mate found ({}).".format(solver.outcome))
+    print("{} nodes in {:.1f}s".format(solver.nodes, seconds))
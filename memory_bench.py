@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measures what boards cost in memory (with tracemalloc) and copy time, for a
+single board and for the boards held by a copy-make search tree.
+
+    python memory_bench.py --depth 3 --width 4
+"""
+
+# Imports
+import argparse
+import copy as c
+import tracemalloc
+from time import perf_counter
+from classes import Chessboard
+from search import make_move
+from simulate import get_all_moves
+
+
+# Functions
+def board_memory():
+    """Bytes allocated to build and set up one board."""
+    tracemalloc.start()
+    board = Chessboard()
+    board.full_set_up()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size
+
+
+def expand(board, depth, width):
+    """Returns all boards in a tree made by playing the first width legal
+    moves of every node, depth plies deep."""
+    if depth == 0:
+        return [board]
+    boards = [board]
+    children = (make_move(board, move) for move in get_all_moves(board))
+    for child in [i for i in children if i][:width]:
+        boards += expand(child, depth - 1, width)
+    return boards
+
+
+def tree_memory(depth, width):
+    """Number of boards in a tree built by expand, and the bytes they hold."""
+    board = Chessboard()
+    board.full_set_up()
+    tracemalloc.start()
+    boards = expand(board, depth, width)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(boards), size
+
+
+def copy_time(n=200):
+    """Milliseconds per deepcopy of a set-up board."""
+    board = Chessboard()
+    board.full_set_up()
+    start = perf_counter()
+    for i in range(n):
+        c.deepcopy(board)
+    return (perf_counter() - start) / n * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--width', type=int, default=4)
+    args = parser.parse_args()
+
+    print("One board: {:.1f} KB".format(board_memory() / 1024))
+    print("Copy: {:.3f} ms".format(copy_time()))
+    n, size = tree_memory(args.depth, args.width)
+    print("Tree of {} boards: {:.1f} KB ({:.1f} KB per board)".format(
+        n, size / 1024, size / n / 1024))
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks of the engine's hot paths over a fixed corpus of opening,
+middlegame and endgame positions. Each benchmark reports operations per
+second (best of a few runs) and the peak memory of one run, measured with
+tracemalloc. Results can be saved as a JSON baseline, and later runs are
+compared with it: a benchmark that gets slower or uses more memory than the
+threshold allows fails the run. Baselines only mean something on the machine
+that made them.
+
+    python -m micro_bench --save
+    python -m micro_bench --quick --threshold .3
+    python -m micro_bench --only score_position move_piece search
+"""
+
+# Imports
+import argparse
+import copy as c
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import tracemalloc
+from time import perf_counter
+from classes import Chessboard, CustArray, RecordStore, move_orig, move_dest
+from search import Searcher, TurnAnalysis
+from simulate import Simulator, score_position
+
+# Constants
+corpus = {
+    'opening': 'r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - '
+               '2 3',
+    'middlegame': 'r2q1rk1/pp2bppp/2n1bn2/3p4/3P4/2NBBN2/PP3PPP/R2Q1RK1 w - '
+                  '- 6 11',
+    'endgame': '8/5pk1/6p1/3R4/8/6P1/5PKP/2r5 w - - 0 40',
+    }
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'micro_bench.json')
+default_threshold = .25 # Allowed slowdown or memory growth, as a fraction
+default_repeat = 5
+min_seconds = .2 # Timed work per repeat, made of as many runs as it takes
+slow_phase = 'middlegame' # The one position of the slow benchmarks
+search_depth = 20 # Depth limit for searches with a node budget
+search_nodes = 100 # Node budget of the search benchmarks
+
+
+# Functions
+def set_up(fen):
+    board = Chessboard()
+    board.full_set_up('fen', fen=fen)
+    return board
+
+
+def bench_custarray_add(board, n=200):
+    """CustArray.add, filling a move array n times."""
+    array = CustArray('v_moves', RecordStore(1))
+
+    def run():
+        for i in range(n):
+            array.reset()
+            for move in range(27):
+                array.add(move)
+    return run, n * 27
+
+
+def bench_full_set_up(board, n=10):
+    """A new Chessboard set up from the position's FEN."""
+    fen = board.get_fen()
+
+    def run():
+        for i in range(n):
+            set_up(fen)
+    return run, n
+
+
+def bench_move_piece(board):
+    """Chessboard.move_piece, once for each legal move, on copies made
+    beforehand."""
+    moves = TurnAnalysis(board).moves
+    copies = [c.deepcopy(board) for move in moves]
+
+    def run():
+        for copy, move in zip(copies, moves):
+            copy.move_piece(copy[move_orig(move)].occ, move_dest(move), True,
+                            False, False)
+    return run, len(moves)
+
+
+def bench_score_position(board):
+    """score_position of the board after each legal move."""
+    children = [child for move, child in TurnAnalysis(board).children]
+
+    def run():
+        for child in children:
+            score_position(child, printer=False)
+    return run, len(children)
+
+
+def bench_simulate(board):
+    """Simulator.simulate, scoring every move into a DataFrame."""
+    sim = Simulator(board)
+    return sim.simulate, 1
+
+
+def bench_pretty_board(board, n=20):
+    """pretty_board, written to a string instead of the terminal."""
+    from pretty_board import pretty_board
+
+    def run():
+        for i in range(n):
+            pretty_board(board, False, io.StringIO())
+    return run, n
+
+
+def bench_search(board):
+    """Searcher.search with a node budget, counting nodes as operations.
+    Like the difficulty levels with a budget, it searches the same tree on
+    any machine."""
+    return (lambda: Searcher().search(board, search_depth,
+                                      nodes=search_nodes)), search_nodes
+
+
+def bench_level(level):
+    """A benchmark of the AI's move at a difficulty_map entry: the
+    simulator's multi_level_simulate, or a search with a node budget."""
+    def bench(board):
+        if isinstance(level, int):
+            return (lambda: Searcher().search(board, search_depth,
+                                              nodes=level)), 1
+        return Simulator(board, *level).multi_level_simulate, 1
+    bench.__doc__ = "The AI's move at difficulty {}.".format(level)
+    return bench
+
+
+def benchmarks(quick=False):
+    """List of (name, benchmark, position name). Benchmarks take a board
+    and return a function that runs the timed work and how many operations
+    it does. Unless quick, includes the AI at every difficulty, which takes
+    seconds per move."""
+    found = []
+    for name, bench in [('custarray_add', bench_custarray_add)]:
+        found += [(name, bench, slow_phase)]
+    for name, bench in [('full_set_up', bench_full_set_up),
+                        ('move_piece', bench_move_piece),
+                        ('score_position', bench_score_position),
+                        ('simulate', bench_simulate),
+                        ('pretty_board', bench_pretty_board),
+                        ('search/nodes={}'.format(search_nodes),
+                         bench_search)]:
+        found += [(name + '/' + phase, bench, phase) for phase in corpus]
+    if not quick:
+        from main import difficulty_map
+        for difficulty, level in sorted(difficulty_map.items()):
+            kind = 'search' if isinstance(level, int) else \
+                'multi_level_simulate'
+            found += [('{}/level={}'.format(kind, difficulty),
+                       bench_level(level), slow_phase)]
+    return found
+
+
+def measure(bench, board, repeat):
+    """Best operations per second over repeat rounds of at least
+    min_seconds each, and the peak kilobytes allocated during one more run.
+    Set-up is left out of both, and garbage collection is off while timing,
+    as in timeit."""
+    best = 0.0
+    for i in range(repeat):
+        total_ops, seconds = 0, 0.0
+        while seconds < min_seconds:
+            run, ops = bench(board)
+            gc.disable()
+            start = perf_counter()
+            run()
+            seconds += perf_counter() - start
+            gc.enable()
+            total_ops += ops
+        best = max(best, total_ops / seconds)
+    run, ops = bench(board)
+    gc.collect()
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak / 1024
+
+
+def compare(result, base, threshold):
+    """'ok', 'new' or what regressed, for a result against its baseline."""
+    if not base:
+        return 'new'
+    problems = []
+    if result['ops_per_sec'] < base['ops_per_sec'] * (1 - threshold):
+        problems += ['SLOWER']
+    if result['peak_kb'] > base['peak_kb'] * (1 + threshold) + 1:
+        problems += ['MORE MEMORY']
+    return ' '.join(problems) or 'ok'
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {'results': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--only', nargs='*', default=[],
+                        help="Benchmarks whose names start with these.")
+    parser.add_argument('--quick', action='store_true',
+                        help="Skip the AI at each difficulty.")
+    parser.add_argument('--repeat', type=int, default=default_repeat)
+    parser.add_argument('--threshold', type=float, default=default_threshold)
+    parser.add_argument('--baseline', default=baseline_file)
+    parser.add_argument('--save', action='store_true',
+                        help="Write the results to the baseline, keeping "
+                             "its other entries, instead of comparing.")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    boards = {phase: set_up(fen) for phase, fen in corpus.items()}
+    results, failed = {}, False
+    for name, bench, phase in benchmarks(args.quick):
+        if args.only and not any(name.startswith(i) for i in args.only):
+            continue
+        # The AI benchmarks take seconds, one run will do
+        repeat = 1 if '/level=' in name else args.repeat
+        ops, peak = measure(bench, boards[phase], repeat)
+        results[name] = {'ops_per_sec': round(ops, 3),
+                         'peak_kb': round(peak, 1)}
+        status = 'saved' if args.save else compare(
+            results[name], baseline['results'].get(name), args.threshold)
+        failed = failed or status not in ['ok', 'new', 'saved']
+        base = baseline['results'].get(name)
+        print("{:<28}{:>14,.1f} ops/s{:>10,.0f} KB  {}{}".format(
+            name, ops, peak, status,
+            "  (was {:,.1f} ops/s, {:,.0f} KB)".format(
+                base['ops_per_sec'], base['peak_kb']) if base else ''))
+    if args.save:
+        baseline['results'].update(results)
+        baseline['machine'] = platform.platform()
+        baseline['python'] = platform.python_version()
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True)
+        print("Wrote " + args.baseline)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+An NNUE-style evaluator: a small network over piece-square features that
+can stand in for score_position in the search. Each of the 768 features is
+one piece type of one color on one square. The first layer's output, the
+accumulator, is kept on the board and updated as pieces are added, moved and
+removed, so an evaluation only runs the two small layers after it.
+
+The accumulator is kept in integers (first layer weights times quant) so
+that however many moves update it, it equals a fresh sum. The network is
+trained with tune.py from self-play data, and saved to network_file.
+
+    python nnue.py --positions 20
+"""
+
+# Imports
+import argparse
+import copy as c
+import os
+from time import perf_counter
+import numpy as np
+from classes import color_list, piece_types
+
+# Constants
+feature_count = len(color_list) * len(piece_types) * 64
+hidden_sizes = (32, 8)
+quant = 512 # First layer weights are rounded to multiples of 1 / quant
+network_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'nnue.npz')
+
+
+# Functions
+def feature_index(color_id, type_id, sq):
+    """Feature of a piece of color code color_id and type code type_id on
+    square sq (y * 8 + x)."""
+    return (color_id * len(piece_types) + type_id) * 64 + sq
+
+
+def board_features(board):
+    """Features of the pieces on board."""
+    return [feature_index(piece.color_id, piece.type_id, piece.sq)
+            for piece in board.alive]
+
+
+def load_network(path=network_file):
+    """The network saved at path, or None if there is none."""
+    return Network.load(path) if os.path.exists(path) else None
+
+
+# Classes
+class Network:
+    """Feature weights w1 (768 by hidden_sizes[0]) and biases b1 make the
+    accumulator. Two dense layers, w2 and w3, follow it with clipped ReLU
+    between them. The output is a score for white in score_position units.
+
+    A Network is called like search.evaluate, returning the score for the
+    side to move, so it can be handed to Searcher(evaluator=...)."""
+    def __init__(self, hidden=hidden_sizes, seed=0):
+        rng = np.random.default_rng(seed)
+        h1, h2 = hidden
+        self.w1 = rng.normal(0, .1, (feature_count, h1))
+        self.b1 = np.full(h1, .5)
+        self.w2 = rng.normal(0, 1 / np.sqrt(h1), (h1, h2))
+        self.b2 = np.zeros(h2)
+        self.w3 = rng.normal(0, 1 / np.sqrt(h2), h2)
+        self.b3 = 0.0
+        self.quantize()
+
+    def __repr__(self):
+        return "Network({} -> {} -> {} -> 1)".format(
+            feature_count, *self.w2.shape)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        network = cls.__new__(cls)
+        for name in ['w1', 'b1', 'w2', 'b2', 'w3']:
+            setattr(network, name, data[name])
+        network.b3 = float(data['b3'])
+        network.quantize()
+        return network
+
+    def save(self, path=network_file):
+        np.savez(path, w1=self.w1, b1=self.b1, w2=self.w2, b2=self.b2,
+                 w3=self.w3, b3=self.b3)
+
+    def quantize(self):
+        """Makes the integer first layer from w1 and b1. Call it after
+        changing them; boards attached before then need attaching again."""
+        self.w1_q = np.round(self.w1 * quant).astype(np.int32)
+        self.b1_q = np.round(self.b1 * quant).astype(np.int32)
+
+    def attach(self, board):
+        """Makes board keep an accumulator for this network, from now on and
+        in every board copied from it."""
+        board.network = self
+        board.accumulator = self.b1_q + \
+            self.w1_q[board_features(board)].sum(axis=0)
+
+    def output(self, accumulators):
+        """Scores for white from a matrix of accumulators, one per row."""
+        hidden = np.clip(accumulators / quant, 0, 1)
+        hidden = np.clip(hidden @ self.w2 + self.b2, 0, 1)
+        return hidden @ self.w3 + self.b3
+
+    def evaluate(self, board):
+        """Score for white of board."""
+        if board.network is not self:
+            self.attach(board)
+        return float(self.output(board.accumulator[None])[0])
+
+    def evaluate_batch(self, boards):
+        """Scores for white of many boards with one pass through the
+        layers. Much faster than evaluating them one at a time."""
+        for board in boards:
+            if board.network is not self:
+                self.attach(board)
+        return self.output(np.array([board.accumulator for board in boards]))
+
+    def score_children(self, board, moves):
+        """Scores for the side to move after each of moves, all evaluated
+        at once, like Simulator.simulate scores them one by one."""
+        children = []
+        for move in moves:
+            child = c.deepcopy(board)
+            child.play_move(move)
+            children += [child]
+        scores = self.evaluate_batch(children) if children else np.zeros(0)
+        return scores if board.turn == 'white' else -scores
+
+    def __call__(self, board):
+        """Score for the side to move, as search.evaluate gives it."""
+        score = self.evaluate(board)
+        return score if board.turn == 'white' else -score
+
+
+if __name__ == "__main__":
+    from selfplay import random_opening
+    from simulate import score_position, get_all_moves
+
+    parser = argparse.ArgumentParser(description="Evaluations per second of "
+                                     "score_position and the network.")
+    parser.add_argument('--positions', type=int, default=20)
+    parser.add_argument('--network', default=network_file)
+    args = parser.parse_args()
+
+    network = load_network(args.network) or Network()
+    boards = [random_opening(10 + i % 20, i) for i in range(args.positions)]
+    children = []
+    for board in boards:
+        network.attach(board)
+        for move in get_all_moves(board):
+            child = c.deepcopy(board)
+            child.play_move(move)
+            children += [child]
+    start = perf_counter()
+    for child in children:
+        score_position(child, printer=False)
+    hand = len(children) / (perf_counter() - start)
+    start = perf_counter()
+    for child in children:
+        network.evaluate(child)
+    single = len(children) / (perf_counter() - start)
+    start = perf_counter()
+    network.evaluate_batch(children)
+    batch = len(children) / (perf_counter() - start)
+    print("{} positions".format(len(children)))
+    for name, rate in [('score_position', hand), ('network', single),
+                       ('network, batched', batch)]:
+        print("{:<18}{:>12,.0f} evals/s".format(name, rate))
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Reading and writing games in PGN (portable game notation), and converting
+between SAN moves, like 'Nbd7' or 'exd8=Q+', and packed moves. Run on a PGN
+file, it replays every game and reports the moves applied per second.
+
+    python pgn.py games.pgn
+    python pgn.py games.pgn --export > copy.pgn
+"""
+
+# Imports
+import argparse
+import re
+import sys
+from time import perf_counter
+from classes import (Chessboard, piece_types, fen_letters, square_names,
+                     square_pos, set_promotion, move_flag, move_orig,
+                     move_dest, encode_move,
+                     king_castle, queen_castle, capture_move, promotion_move,
+                     start_fen)
+from search import make_move
+from simulate import get_all_moves
+
+# Constants
+results = ['1-0', '0-1', '1/2-1/2', '*']
+san_letters = {letter.upper(): ptype for letter, ptype in
+               zip(fen_letters, piece_types) if ptype != 'pawn'}
+castles = {'O-O': king_castle, 'O-O-O': queen_castle}
+roster = ['Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result']
+roster_defaults = {'Date': '????.??.??'} # Others default to '?'
+line_length = 79
+
+
+# Functions
+def san_to_move(board, san):
+    """Returns the legal move of the side to move written in SAN, or None if
+    there isn't exactly one."""
+    san = san.rstrip('+#!?').replace('0', 'O')
+    if san in castles:
+        king = board.get_king(board.turn)
+        candidates = [move for move, x, y in king.v_moves
+                      if move_flag(move) == castles[san]] if king else []
+    else:
+        promotion = None
+        if '=' in san:
+            san, promotion = san.split('=')
+        elif san[-1:] in 'NBRQ' and san[:1].islower():
+            san, promotion = san[:-1], san[-1]
+        ptype = san_letters.get(san[:1], 'pawn')
+        rest = san[1:] if ptype != 'pawn' else san
+        rest = rest.replace('x', '').replace('-', '')
+        if rest[-2:] not in square_names:
+            return None
+        dest = square_pos[square_names.index(rest[-2:])]
+        hint = rest[:-2] # File, rank or square of the moving piece
+        candidates = []
+        for piece in board.get_pieces([ptype], [board.turn]):
+            if not all(i in square_names[piece.sq] for i in hint):
+                continue
+            for move, x, y in piece.v_moves:
+                if (x, y) != dest or move_flag(move) in castles.values():
+                    continue
+                if move >> 12 & promotion_move:
+                    if promotion not in san_letters:
+                        continue
+                    move = set_promotion(move, san_letters[promotion])
+                candidates += [move]
+    # Only look at legality if it decides between several moves
+    if len(candidates) > 1:
+        candidates = [move for move in candidates if make_move(board, move)]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def has_legal_move(board):
+    """True if the side to move has a move that doesn't leave it in check."""
+    return any(make_move(board, move) for move in get_all_moves(board))
+
+
+def san_body(board, move):
+    """SAN for a move of the side to move, without the check suffix."""
+    flag = move_flag(move)
+    for san, castle_flag in castles.items():
+        if flag == castle_flag:
+            return san
+    piece = board[move_orig(move)].occ
+    dest = square_names[move >> 6 & 63]
+    capture = 'x' if flag & capture_move else ''
+    if piece.type == 'pawn':
+        san = (square_names[piece.sq][0] + capture if capture else '') + dest
+        if flag & promotion_move:
+            san += '=' + 'NBRQ'[flag & 3]
+        return san
+    # Name the origin file, rank or square if another piece could go there
+    rivals = [other for other in board.get_pieces([piece.type], [board.turn])
+              if other is not piece and
+              any(m >> 6 & 63 == move >> 6 & 63 for m, x, y in other.v_moves)
+              and make_move(board, encode_move(other.pos, move_dest(move),
+                                               flag))]
+    hint = ''
+    if rivals:
+        name = square_names[piece.sq]
+        if all(square_names[i.sq][0] != name[0] for i in rivals):
+            hint = name[0]
+        elif all(square_names[i.sq][1] != name[1] for i in rivals):
+            hint = name[1]
+        else:
+            hint = name
+    return fen_letters[piece.type_id].upper() + hint + capture + dest
+
+
+def check_suffix(board):
+    """'+' or '#' if the side to move is in check or mated, for SAN."""
+    if not board.is_in_check(board.turn):
+        return ''
+    return '+' if has_legal_move(board) else '#'
+
+
+def move_to_san(board, move):
+    """SAN for a packed move of the side to move, like 'Nbd7' or 'O-O+'."""
+    return san_body(board, move) + check_suffix(make_move(board, move))
+
+
+def game_result(board):
+    """PGN result of the position: a win for one side if the side to move
+    is mated, a draw on stalemate or by rule, otherwise '*'."""
+    if not has_legal_move(board):
+        if not board.is_in_check(board.turn):
+            return '1/2-1/2'
+        return '0-1' if board.turn == 'white' else '1-0'
+    return '1/2-1/2' if board.draw_check() else '*'
+
+
+def write_game(board, headers={}, comments=None):
+    """Returns the game played on board as PGN text. headers add to or
+    override the seven tag roster, and comments is an optional list holding
+    a comment (or None) for each move."""
+    tags = {tag: roster_defaults.get(tag, '?') for tag in roster}
+    tags['Result'] = game_result(board)
+    if board.start_fen != start_fen:
+        tags['SetUp'], tags['FEN'] = '1', board.start_fen
+    tags.update(headers)
+    lines = ['[{} "{}"]'.format(tag, value) for tag, value in tags.items()]
+    # Replay the game from the start to write each move's SAN
+    replayed = Chessboard()
+    replayed.full_set_up('fen', fen=board.start_fen)
+    tokens = []
+    for ply, move in enumerate(board.game_moves):
+        number = (replayed.turn_num - 1) // 2 + 1
+        if replayed.turn == 'white':
+            tokens += [str(number) + '.']
+        elif ply == 0:
+            tokens += [str(number) + '...']
+        san = san_body(replayed, move)
+        replayed.play_move(move)
+        tokens += [san + check_suffix(replayed)]
+        if comments and ply < len(comments) and comments[ply]:
+            tokens += ['{' + comments[ply] + '}']
+    tokens += [tags['Result']]
+    movetext = ['']
+    for token in tokens:
+        if movetext[-1] and len(movetext[-1]) + len(token) >= line_length:
+            movetext += ['']
+        movetext[-1] += (' ' if movetext[-1] else '') + token
+    return "\n".join(lines + [''] + movetext) + "\n"
+
+
+def movetext_tokens(text):
+    """SAN moves in PGN movetext, with comments, variations, NAGs, move
+    numbers and the result taken out."""
+    text = re.sub(r'\{[^}]*\}', ' ', text)
+    while '(' in text:
+        stripped = re.sub(r'\([^()]*\)', ' ', text)
+        if stripped == text:
+            break
+        text = stripped
+    text = re.sub(r'\$\d+', ' ', text)
+    tokens = []
+    for token in text.split():
+        token = re.sub(r'^\d+\.+', '', token)
+        if token and token not in results:
+            tokens += [token]
+    return tokens
+
+
+def read_games(lines):
+    """Generator over the games in an iterable of PGN lines, like an open
+    file, holding one game in memory at a time. Yields a dict of the tag
+    pairs and a list of SAN moves."""
+    headers, movetext = {}, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('['):
+            # A tag after movetext starts the next game
+            if movetext:
+                yield headers, movetext_tokens(" ".join(movetext))
+                headers, movetext = {}, []
+            match = re.match(r'\[(\w+)\s+"(.*)"\]', line)
+            if match:
+                headers[match.group(1)] = match.group(2)
+        elif line and not line.startswith('%'):
+            movetext += [line.split(';')[0]]
+    if headers or movetext:
+        yield headers, movetext_tokens(" ".join(movetext))
+
+
+def start_board(headers):
+    """The board a game starts from: its FEN tag, else the usual start."""
+    board = Chessboard()
+    if 'FEN' in headers:
+        board.full_set_up('fen', fen=headers['FEN'])
+    else:
+        board.full_set_up()
+    return board
+
+
+def replay(headers, sans, board=None):
+    """Generator playing a game's SAN moves on one board, in place: board if
+    given, else the start_board of headers. Yields the board before each
+    move together with the SAN and packed move, and raises ValueError at a
+    move it can't read or that is ambiguous. Moves are trusted to be legal,
+    so only ambiguous ones are checked."""
+    if board is None:
+        board = start_board(headers)
+    for ply, san in enumerate(sans):
+        move = san_to_move(board, san)
+        if move is None:
+            raise ValueError("Illegal or ambiguous move {} at ply {}".format(
+                san, ply + 1))
+        yield board, san, move
+        board.play_move(move)
+
+
+def load_game(headers, sans):
+    """Returns the board at the end of a game read by read_games."""
+    board = start_board(headers)
+    for before, san, move in replay(headers, sans, board):
+        pass # replay plays each move on board once the next one is asked for
+    return board
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('input', help="A .pgn file.")
+    parser.add_argument('--export', action='store_true',
+                        help="Write each replayed game back out as PGN.")
+    args = parser.parse_args()
+
+    games, plies, seconds = 0, 0, 0
+    with open(args.input) as f:
+        for headers, sans in read_games(f):
+            start = perf_counter()
+            try:
+                board = load_game(headers, sans)
+            except ValueError as error:
+                print("Game {}: {}".format(games + 1, error), file=sys.stderr)
+                continue
+            seconds += perf_counter() - start
+            games += 1
+            plies += len(sans)
+            if args.export:
+                print(write_game(board, headers))
+    print("Replayed {} games, {} moves in {:.2f}s ({:.0f} moves/s)".format(
+        games, plies, seconds, plies / seconds if seconds else 0),
+        file=sys.stderr)
@@ -2,12 +2,13 @@
 # -*- coding: utf-8 -*-
 
 """
-Constants and function for creating a beautiful chess board.
+Constants and functions for drawing a beautiful chess board.
 """
 
-# Imports and setup
-import colorama
-colorama.init()
+import shutil
+
+# colorama is only imported once a board is printed, see enable_colors
+colors_enabled = False
 
 #### Define constants
 # Piece Strings
@@ -90,39 +91,6 @@ border_row = "".join([raw_corner + raw_row_border * col_width \
 spacer_row = border_row.replace(raw_row_border, raw_space).replace(
                 raw_corner, raw_col_border)
 
-# Generate shaded (stippled) rows
-spacer_row_odd_a = ''
-spacer_row_odd_b = ''
-spacer_row_even_a = ''
-spacer_row_even_b = ''
-counter = 0
-x_pos = -1
-for i in spacer_row:
-    if i == raw_col_border:
-        counter = 0
-        x_pos += 1
-        spacer_row_odd_a += i
-        spacer_row_odd_b += i
-        spacer_row_even_a += i
-        spacer_row_even_b += i
-    elif i == ' ' and x_pos % 2 == 0:
-        spacer_row_odd_a += raw_fill if counter % 2 == 1 else ' '
-        spacer_row_odd_b += raw_fill if counter % 2 == 0 else ' '
-        spacer_row_even_a += i
-        spacer_row_even_b += i
-        counter += 1
-    elif i == ' ' and x_pos % 2 == 1:
-        spacer_row_even_a += raw_fill if counter % 2 == 1 else ' '
-        spacer_row_even_b += raw_fill if counter % 2 == 0 else ' '
-        spacer_row_odd_a += i
-        spacer_row_odd_b += i
-        counter += 1
-    else:
-        spacer_row_even_a += i
-        spacer_row_even_b += i
-        spacer_row_odd_a += i
-        spacer_row_odd_b += i
-
 # Generate alphabet at top row border
 border_row_top = list(border_row)
 alpha_str = 'ABCDEFGH'
@@ -130,111 +98,139 @@ for i in range(8):
     border_row_top[1 + int(col_width / 2) + (col_width + 1) * i] = alpha_str[i]
 border_row_top = "".join(border_row_top)
 
-# Create list of unformatted row strings
-grid = border_row
-for row in range(8):
-    for line_num in range(row_height):
-        if row % 2 == 0:
-            if line_num % 2 == 0:
-                grid = grid + spacer_row_even_a
-            else:
-                grid = grid + spacer_row_even_b
-        else:
-            if line_num % 2 == 0:
-                grid = grid + spacer_row_odd_a
-            else:
-                grid = grid + spacer_row_odd_b
-    grid = grid + border_row
-row_list = grid.split(endline)[:-1]
+# Formatted border rows
+top_border = "".join([white + i + reset for i in border_row_top[:-1]])
+mid_border = border_row[:-1].replace(raw_corner, corner).replace(
+                raw_row_border, row_border)
+
+def format_raw(string):
+    """Colors the fill and spaces of an unformatted grid string."""
+    return string.replace(raw_fill, fill).replace(raw_space, space)
+
+# Every cell string, indexed [shade][piece code][line of the row]. Shade 1
+# squares are stippled. Piece code 0 is an empty square, then 1 + color
+# index * 6 + type index, in the order of classes.piece_types.
+piece_order = ['pawn', 'knight', 'bishop', 'rook', 'queen', 'king']
+cells = []
+for shade in range(2):
+    raw_lines = ["".join([raw_fill if shade and (i + line_num) % 2 == 1
+                          else raw_space for i in range(col_width)])
+                 for line_num in range(row_height)]
+    shade_cells = [[format_raw(raw) for raw in raw_lines]]
+    for color, color_code in [('white', white), ('black', gray)]:
+        for ptype in piece_order:
+            piece_cells = []
+            for line_num, raw in enumerate(raw_lines):
+                piece_line = line_num - vert_spacer
+                # Pieces shorter than the square leave their top lines empty
+                if (piece_line < 0 or piece_line >= piece_height or
+                        piece_dict[ptype][piece_line].strip() == ''):
+                    piece_cells += [format_raw(raw)]
+                    continue
+                cpiece_string = piece_dict[ptype][piece_line]
+                if color == 'white' and piece_line == 3:
+                    cpiece_string = cpiece_string.replace('B', 'W')
+                piece_cells += [format_raw(raw[:lat_spacer]) + color_code +
+                                cpiece_string + reset +
+                                format_raw(raw[-lat_spacer:])]
+            shade_cells += [piece_cells]
+    cells += [shade_cells]
+
+# Left border of each line of each rank, holding the rank number mid-square
+rank_borders = [[white + str(y + 1) + reset if line_num == int(row_height / 2)
+                 else col_border for line_num in range(row_height)]
+                for y in range(8)]
+
+# Ranks from the top of the screen down, by black_first
+row_orders = {False: list(range(8)), True: list(range(7, -1, -1))}
+
+# Escapes for redrawing in place. Lines and columns count from 1.
+board_lines = 1 + 8 * (row_height + 1)
+board_columns = 1 + 8 * (col_width + 1)
+lines_below = 4 # The move, a comment and the prompt, under a redrawn board
+clear_screen = '\x1b[2J\x1b[H'
+cursor_to = '\x1b[{};{}H'
+clear_below = '\x1b[J'
 
 
 #### Functions
-# Format grid and insert ascii pieces
-def pretty_board(cboard, black_first = False):
+def enable_colors():
+    """Sets up colorama so the ANSI codes work on Windows terminals too.
+    Done on first print rather than at import, since render_board doesn't
+    need it."""
+    global colors_enabled
+    if not colors_enabled:
+        import colorama
+        colorama.init()
+        colors_enabled = True
+
+
+def fits_terminal():
+    """Whether the terminal has room for the board and lines_below more.
+    Redrawing in place needs it: on a smaller screen the board scrolls or
+    wraps and the cursor positions no longer land on its squares."""
+    size = shutil.get_terminal_size()
+    return size.lines >= board_lines + lines_below and \
+        size.columns >= board_columns
+
+
+def piece_code(piece):
+    """Index of a piece (or None) in the second level of cells."""
+    return 1 + piece.color_id * 6 + piece.type_id if piece else 0
+
+
+def render_board(cboard, black_first = False):
+    """Returns the color-coded board as a string, without printing it."""
+    lines = [top_border]
+    for y in row_orders[black_first]:
+        row = [(cells[(x + y) % 2], piece_code(cboard.squares[y * 8 + x].occ))
+               for x in range(8)]
+        for line_num in range(row_height):
+            lines += [rank_borders[y][line_num] +
+                      col_border.join([shade[code][line_num]
+                                       for shade, code in row]) + col_border]
+        lines += [mid_border]
+    return "\n".join(lines)
+
+
+def pretty_board(cboard, black_first = False, file = None):
     """Takes a Chessboard object and prints a beautiful, color-coded string
-    using constants defined in pretty_board.py. Returns nothing."""
-    new_row_list = []
-    y = -1 # Tracks what "row" you're in, 0 to 7 (-1 since it starts on border)
-    line_num = 0 # Tracks what line of the square you're in, 0 to row_height
-    for row in row_list:
-        # Handle border rows
-        if row[0] == raw_corner:
-            if y == -1:
-                new_row = "".join([white + i + reset for i in
-                                   border_row_top[:-1]])
-            else:
-                new_row = row.replace(raw_corner, corner)
-                new_row = new_row.replace(raw_row_border, row_border)
-            y += 1
-            line_num = 0
-            new_row_list += [new_row]
-        # Handle other rows
+    using constants defined in pretty_board.py, to file if given. Ranks run
+    from 8 down when black_first. Returns nothing."""
+    enable_colors()
+    print(render_board(cboard, black_first), file=file)
+
+
+#### Classes
+class BoardRenderer:
+    """Draws a board once, then redraws only the squares whose piece changed
+    since the last draw, by moving the cursor, and clears whatever was written
+    below it since. Assumes the screen hasn't scrolled since the last draw,
+    see fits_terminal.
+    Call enable_colors before writing its output."""
+    def __init__(self):
+        self.codes = None
+        self.black_first = None
+
+    def draw(self, cboard, black_first = False):
+        """Returns the string that brings the screen up to date with cboard,
+        leaving the cursor below the board."""
+        codes = [piece_code(square.occ) for square in cboard.squares]
+        if self.codes is None or black_first != self.black_first:
+            out = clear_screen + render_board(cboard, black_first) + "\n"
         else:
-            string_list = row.split(raw_col_border)[:-1]
-            x = -1 # Tracks what "column" we're in, from 0 to 7 (-1 and 8 are borders)
-            new_row = ''
-            for string in string_list:
-                if string == '': # Borders start with empty string
-                    # Determine if we need to add the rank (number) to border
-                    if line_num == int(row_height/2):
-                        new_row += white + str(y + 1) + reset
-                    else:
-                        new_row += col_border
-                # Handle insertion of "piece strings" for pawns, etc.
-                elif line_num >= vert_spacer and line_num < (row_height-vert_spacer):
-                    occ = cboard[x,y].occ
-                    if occ:
-                        # Perform no replacements if piece line would be empty.
-                        # E.G. pawn has height=3, so we ignore higher lines.
-                        if (occ.type in ['rook', 'knight', 'bishop'] and
-                                line_num <= vert_spacer):
-                            new_row_piece = string.replace(raw_fill, fill)
-                            new_row_piece = new_row_piece.replace(raw_space, space)
-                        elif occ.type == 'pawn' and line_num < (vert_spacer + 2):
-                            new_row_piece = string.replace(raw_fill, fill)
-                            new_row_piece = new_row_piece.replace(raw_space, space)
-                        else:
-                            cpiece_string = piece_dict[occ.type][line_num-vert_spacer]
-                            if occ.color == 'black':
-                                # Already has a B
-                                cpiece_string = gray + cpiece_string + reset
-                            elif occ.color == 'white':
-                                if line_num-vert_spacer == 3:
-                                    cpiece_string=cpiece_string.replace('B','W')
-                                cpiece_string = white + cpiece_string + reset
-                            left = string[:lat_spacer]
-                            left = left.replace(raw_fill, fill)
-                            left = left.replace(raw_space, space)
-                            right = string[-lat_spacer:]
-                            right = right.replace(raw_fill, fill)
-                            right = right.replace(raw_space, space)
-                            new_row_piece = left + cpiece_string + right
-                    # If no piece on that square
-                    else:
-                        new_row_piece = string.replace(raw_fill, fill)
-                        new_row_piece = new_row_piece.replace(raw_space, space)
-                    new_row += new_row_piece + col_border
-                else:
-                    # not valid line for piece replacement, not a border string
-                    new_row_piece = string.replace(raw_fill, fill)
-                    new_row_piece = new_row_piece.replace(raw_space, space)
-                    new_row += new_row_piece + col_border
-                x += 1
-            new_row_list += [new_row]
-            line_num += 1
-    if not black_first:
-        print("\n".join(new_row_list))
-    # Flip board orientation if player is black. It's just nicer!
-    elif black_first:
-        first = new_row_list.pop(0)
-        cells0 = new_row_list[0:row_height+1]
-        cells1 = new_row_list[row_height+1:(row_height+1)*2]
-        cells2 = new_row_list[(row_height+1)*2:(row_height+1)*3]
-        cells3 = new_row_list[(row_height+1)*3:(row_height+1)*4]
-        cells4 = new_row_list[(row_height+1)*4:(row_height+1)*5]
-        cells5 = new_row_list[(row_height+1)*5:(row_height+1)*6]
-        cells6 = new_row_list[(row_height+1)*6:(row_height+1)*7]
-        cells7 = new_row_list[(row_height+1)*7:(row_height+1)*8]
-        new_row_list = [first] + cells7 + cells6 + cells5 + cells4 + cells3 + \
-                       cells2 + cells1 + cells0
-        print("\n".join(new_row_list))
+            order = row_orders[black_first]
+            parts = []
+            for sq, (old, new) in enumerate(zip(self.codes, codes)):
+                if old == new:
+                    continue
+                x, y = sq & 7, sq >> 3
+                top = 2 + order.index(y) * (row_height + 1)
+                left = 2 + x * (col_width + 1)
+                for line_num in range(row_height):
+                    parts += [cursor_to.format(top + line_num, left) +
+                              cells[(x + y) % 2][new][line_num]]
+            out = "".join(parts) + cursor_to.format(board_lines + 1, 1) + \
+                clear_below
+        self.codes, self.black_first = codes, black_first
+        return out
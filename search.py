@@ -0,0 +1,470 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Alpha-beta search core. Unlike multi_level_simulate, moves come from a
+staged generator ordered with cheap heuristics (hash move, captures, killers,
+history) instead of scoring every child with score_position first, and the
+tree is pruned selectively with null moves, late move reductions and futility
+pruning.
+"""
+
+# Imports
+import copy as c
+import numpy as np
+from classes import (color_list, piece_types, move_orig, move_dest,
+                     capture_move)
+from evaluation import pawn_table
+from simulate import (score_position, staged_moves, is_pseudo_legal,
+                      get_all_moves)
+
+# Constants
+mate_value = 10000 # Larger than any score_position score
+inf = float('inf')
+exact, lower, upper = 0, 1, 2 # Transposition table bound flags
+window = 0.1 # Smallest score difference, since score_position rounds to .1
+null_reduction = 2 # Extra plies taken off a null move search
+lmr_moves = 3 # Moves searched at full depth before reducing quiet ones
+futility_margin = 6 # Two pawns, in score_position units
+timer_interval = 16 # Nodes between looks at the clock
+color_index = {color: i for i, color in enumerate(color_list)}
+type_index = {ptype: i for i, ptype in enumerate(piece_types)}
+
+
+# Top level functions
+def make_move(board, move):
+    """Returns a copy of board with a packed move made, or None if the move
+    leaves the mover's king in check."""
+    child = c.deepcopy(board)
+    child.play_move(move)
+    if not child.get_king(child.nonturn) or child.is_in_check(child.nonturn):
+        return None
+    return child
+
+
+def make_null_move(board):
+    """Returns a copy of board where the side to move passes."""
+    child = c.deepcopy(board)
+    child.turn, child.nonturn = child.nonturn, child.turn
+    child.turn_num += 1
+    # A pass ends any chance of en passant, which also takes it out of the key
+    child.last_move = None
+    # Repetitions across a pass aren't real, so start a new window
+    child.halfmove_clock = 0
+    child.key_history += [child.get_key()]
+    return child
+
+
+def is_quiet(move):
+    """True if move is neither a capture nor a pawn promotion."""
+    return move >> 12 < capture_move
+
+
+def has_pieces(board, color):
+    """True if color has anything besides pawns and its king. Null moves are
+    unsafe without, since pawn endings are full of zugzwang."""
+    return bool(board.get_pieces(['knight', 'bishop', 'rook', 'queen'],
+                                 [color]))
+
+
+def in_check(board):
+    """True if the side to move has its king attacked."""
+    return board.is_in_check(board.turn)
+
+
+def is_draw(board):
+    """True if board is drawn by rule. Inside the search a single repetition
+    counts, since whoever could avoid it would have done so already."""
+    return (board.halfmove_clock >= 100 or board.repetitions() > 0 or
+            board.insufficient_material())
+
+
+def evaluate(board):
+    """score_position from the perspective of the side to move."""
+    return -score_position(board, printer=False)[-1]
+
+
+# Classes
+class TurnAnalysis:
+    """What the game loop needs to know about the position on the board
+    for one turn: the legal moves, whether the game ended, and the best
+    lines. Each part is worked out when first asked for and then kept, so
+    a turn costs one legal move generation however many times the player
+    asks for help or mistypes a move. Works on a copy of the board, so it
+    stays valid after the move is made."""
+    def __init__(self, board):
+        self.board = c.deepcopy(board)
+        self.key = board.get_key()
+        self.turn_num = board.turn_num
+        self._children = None
+        self._lines = {}
+
+    def is_current(self, board):
+        """True if this analysis is of board's position and turn."""
+        return (board.turn_num == self.turn_num and
+                board.get_key() == self.key)
+
+    @property
+    def children(self):
+        """List of (move, board after it) for the legal moves, in the order
+        of staged_moves."""
+        if self._children is None:
+            self._children = []
+            for move in staged_moves(self.board):
+                child = make_move(self.board, move)
+                if child is not None:
+                    self._children += [(move, child)]
+        return self._children
+
+    @property
+    def moves(self):
+        return [move for move, child in self.children]
+
+    def status(self):
+        """'checkmate' or 'stalemate' if the side to move has no legal
+        move, else None."""
+        if self.children:
+            return None
+        return 'checkmate' if in_check(self.board) else 'stalemate'
+
+    def find_move(self, orig, dest):
+        """The legal move from orig to dest, both (x, y), or None."""
+        for move in self.moves:
+            if move_orig(move) == orig and move_dest(move) == dest:
+                return move
+        return None
+
+    def leaves_in_check(self, orig, dest):
+        """True if orig to dest is a move of the side to move that's only
+        illegal because it leaves its king in check."""
+        return self.find_move(orig, dest) is None and any(
+            move_orig(move) == orig and move_dest(move) == dest
+            for move in get_all_moves(self.board))
+
+    def lines(self, k, depth):
+        """The k best moves as search_multipv returns them."""
+        if (k, depth) not in self._lines:
+            self._lines[k, depth] = Searcher().search_multipv(self.board,
+                                                              depth, k)
+        return self._lines[k, depth]
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when its TimeManager runs out of time, or
+    its node budget is spent."""
+
+
+class SearchStats:
+    """Counters collected during a search. The share of cutoffs produced by
+    the first move searched is the usual measure of move ordering quality."""
+    def __init__(self):
+        self.nodes = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.tt_hits = 0
+        self.null_cutoffs = 0
+        self.reductions = 0
+        self.researches = 0
+        self.futility_prunes = 0
+        self.draws = 0
+        self.pawn_probes = 0
+        self.pawn_hits = 0
+        # The pawn table counts for itself, the search takes differences
+        self.pawn_start = (pawn_table.probes, pawn_table.hits)
+
+    def __repr__(self):
+        return ("Nodes: {}, cutoffs: {}, first move cutoffs: {} ({:.1%}), "
+                "TT hits: {}, null move cutoffs: {}, reductions: {} "
+                "({} re-searched), futility prunes: {}, draws: {}, "
+                "pawn cache hits: {:.1%}").format(
+                    self.nodes, self.cutoffs, self.first_move_cutoffs,
+                    self.cutoff_rate(), self.tt_hits, self.null_cutoffs,
+                    self.reductions, self.researches, self.futility_prunes,
+                    self.draws, self.pawn_hit_rate())
+
+    def cutoff_rate(self):
+        """Fraction of beta cutoffs caused by the first move searched."""
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def count_pawn_probes(self):
+        """Takes the pawn table's probes and hits since the stats began."""
+        self.pawn_probes = pawn_table.probes - self.pawn_start[0]
+        self.pawn_hits = pawn_table.hits - self.pawn_start[1]
+
+    def pawn_hit_rate(self):
+        """Fraction of pawn structure lookups answered by the pawn table."""
+        return self.pawn_hits / self.pawn_probes if self.pawn_probes else 0.0
+
+
+class Searcher:
+    """Iterative deepening negamax with alpha-beta pruning. Each ordering
+    heuristic and pruning technique can be switched off to measure its effect
+    on the stats, or on playing strength with selfplay.py.
+
+    tt is the transposition table, a dict unless another table with get and
+    item assignment is given, like a shared_tt.SharedTable that several
+    processes search with. evaluator scores leaves for the side to move,
+    evaluate unless another is given, like an nnue.Network."""
+    def __init__(self, killers=True, history=True, hash_move=True,
+                 null_move=True, lmr=True, futility=True, tt=None,
+                 evaluator=None):
+        self.use_killers = killers
+        self.use_history = history
+        self.use_hash_move = hash_move
+        self.use_null_move = null_move
+        self.use_lmr = lmr
+        self.use_futility = futility
+        # Position key: (depth, score, flag, best move)
+        self.tt = tt if tt is not None else {}
+        self.evaluator = evaluator or evaluate
+        self.history = np.zeros((len(color_list) * len(piece_types), 64),
+                                dtype=np.int64)
+        self.killers = []
+        self.stats = SearchStats()
+        self.timer = None
+        self.max_nodes = None
+        self.depth_done = 0
+        self.root_move = None # Best move of the last root negamax
+
+    def search(self, board, depth, timer=None, report=None, nodes=None):
+        """Searches board to depth plies, one iteration per depth so that each
+        iteration can start from the previous one's hash move. Returns the
+        best move and its score for the side to move.
+
+        With a TimeManager, iterations stop when it says so and the last
+        complete one is used, so depth is only a maximum. nodes is a budget
+        that works the same way, except that a search stops at exactly that
+        many nodes, so the result is the same on any machine. The first
+        iteration is always completed. report, if given, is called with the
+        depth, move and score after each iteration."""
+        self.stats = SearchStats()
+        self.killers = [[None, None] for i in range(depth + 1)]
+        self.timer, self.max_nodes, self.depth_done = timer, nodes, 0
+        self.root_move = None
+        self.prepare(board)
+        if timer:
+            timer.start(in_check(board))
+        best_move, best_score = None, -inf
+        for d in range(1, depth + 1):
+            if timer and d > 1 and not timer.can_start_iteration():
+                break
+            try:
+                score = self.negamax(board, d, -inf, inf, 0)
+            except SearchTimeout:
+                break
+            # Not read from the table, which may have lost the entry
+            move = self.root_move
+            # A new best move means the position is unclear, think longer
+            if timer and d > 1 and move != best_move:
+                timer.extend()
+            best_move, best_score, self.depth_done = move, score, d
+            if report:
+                report(d, best_move, best_score)
+        self.stats.count_pawn_probes()
+        return best_move, best_score
+
+    def search_multipv(self, board, depth, k, timer=None, report=None,
+                       nodes=None):
+        """Like search, but finds the k best moves in one tree. Returns a
+        list of up to k (move, score, principal variation), best first.
+        report, if given, is called with the depth and that list after each
+        iteration."""
+        self.stats = SearchStats()
+        self.killers = [[None, None] for i in range(depth + 1)]
+        self.timer, self.max_nodes, self.depth_done = timer, nodes, 0
+        self.prepare(board)
+        if timer:
+            timer.start(in_check(board))
+        order, lines = [], []
+        for d in range(1, depth + 1):
+            if timer and d > 1 and not timer.can_start_iteration():
+                break
+            try:
+                scored = self.root_multipv(board, d, k, order)
+            except SearchTimeout:
+                break
+            order = [move for move, score in scored]
+            lines = []
+            for move, score in scored[:k]:
+                child = make_move(board, move)
+                lines += [(move, score,
+                           [move] + self.principal_variation(child, d - 1))]
+            self.depth_done = d
+            if report:
+                report(d, lines)
+        self.stats.count_pawn_probes()
+        return lines
+
+    def root_multipv(self, board, depth, k, order):
+        """One multi-PV iteration. Each root move is searched with alpha set
+        to the k-th best score so far, so moves that can't make the top k
+        fail low cheaply instead of getting an exact score. Moves in order,
+        the previous iteration's ranking, go first. Returns all legal moves
+        with their scores, best first. Scores past the k-th are bounds."""
+        self.count_node()
+        scored = []
+        moves = order + [move for move in staged_moves(board)
+                         if move not in order]
+        for move in moves:
+            child = make_move(board, move)
+            if child is None:
+                continue
+            best = sorted([score for m, score in scored], reverse=True)
+            alpha = best[k - 1] if len(best) >= k else -inf
+            score = -self.negamax(child, depth - 1, -inf, -alpha, 1)
+            scored += [(move, score)]
+        scored.sort(key=lambda i: i[1], reverse=True)
+        if scored:
+            self.tt[board.get_key()] = (depth, scored[0][1], exact,
+                                        scored[0][0])
+        return scored
+
+    def prepare(self, board):
+        """Lets an evaluator that keeps state on the board, like a network's
+        accumulator, set it up on the root so every node inherits it."""
+        attach = getattr(self.evaluator, 'attach', None)
+        if attach and getattr(board, 'network', None) is not self.evaluator:
+            attach(board)
+
+    def count_node(self):
+        """Counts a node, or raises SearchTimeout if the node budget is
+        spent. Every timer_interval nodes it also asks the timer. Neither
+        stops the first iteration."""
+        if (self.max_nodes is not None and self.depth_done and
+                self.stats.nodes >= self.max_nodes):
+            raise SearchTimeout()
+        self.stats.nodes += 1
+        if (self.timer and self.depth_done and
+                self.stats.nodes % timer_interval == 0 and
+                self.timer.out_of_time()):
+            raise SearchTimeout()
+
+    def principal_variation(self, board, depth):
+        """The line of best moves from board, read from the transposition
+        table, at most depth moves long."""
+        line = []
+        for i in range(depth):
+            entry = self.tt.get(board.get_key())
+            if not entry or entry[3] is None or \
+                    not is_pseudo_legal(board, entry[3]):
+                break
+            board = make_move(board, entry[3])
+            if board is None:
+                break
+            line += [entry[3]]
+        return line
+
+    def history_index(self, board, move):
+        """Row and column of a move in the history table: piece and
+        destination."""
+        piece = board[move_orig(move)].occ
+        row = (color_index[piece.color] * len(piece_types) +
+               type_index[piece.type])
+        return row, move >> 6 & 63
+
+    def update_quiet(self, board, move, depth, ply):
+        """Records a quiet move that caused a cutoff as a killer and in the
+        history table."""
+        if self.use_killers and self.killers[ply][0] != move:
+            self.killers[ply] = [move, self.killers[ply][0]]
+        if self.use_history:
+            self.history[self.history_index(board, move)] += depth * depth
+
+    def negamax(self, board, depth, alpha, beta, ply, null_ok=True):
+        """Returns the score of board for the side to move. null_ok is False
+        right after a null move so that two passes are never made in a row."""
+        self.count_node()
+        # Repeated positions are draws, which ends perpetual check loops
+        if ply > 0 and is_draw(board):
+            self.stats.draws += 1
+            return 0
+        key = board.get_key()
+        entry = self.tt.get(key)
+        hash_move = None
+        if entry:
+            self.stats.tt_hits += 1
+            e_depth, e_score, e_flag, e_move = entry
+            hash_move = e_move if self.use_hash_move else None
+            # Never cut at the root, we need a move from it
+            if ply > 0 and e_depth >= depth:
+                if (e_flag == exact or (e_flag == lower and e_score >= beta)
+                        or (e_flag == upper and e_score <= alpha)):
+                    return e_score
+        if depth <= 0:
+            return self.evaluator(board)
+        checked = in_check(board)
+
+        # Null move: if passing still fails high, a real move surely would
+        if (self.use_null_move and null_ok and ply > 0 and not checked and
+                depth > null_reduction and beta < inf and
+                has_pieces(board, board.turn)):
+            score = -self.negamax(make_null_move(board),
+                                  depth - 1 - null_reduction, -beta,
+                                  -beta + window, ply + 1, False)
+            if score >= beta:
+                self.stats.null_cutoffs += 1
+                return score
+
+        # Futility: next to the leaves, quiet moves can't lift a hopeless eval
+        futile = (self.use_futility and depth == 1 and not checked and
+                  abs(alpha) < mate_value / 2 and
+                  self.evaluator(board) + futility_margin <= alpha)
+
+        alpha_orig = alpha
+        best_score, best_move = -inf, None
+        legal = 0
+        killers = self.killers[ply] if self.use_killers else []
+        history = None
+        if self.use_history:
+            history = lambda move: self.history[self.history_index(board,
+                                                                   move)]
+        for move in staged_moves(board, hash_move, killers, history):
+            quiet = (is_quiet(move) and move != hash_move and
+                     move not in killers)
+            if futile and quiet and legal > 0:
+                self.stats.futility_prunes += 1
+                continue
+            child = make_move(board, move)
+            if child is None:
+                continue
+            legal += 1
+            # Late move reductions: quiet moves ordered late are searched
+            # shallower with a null window, and again in full if they surprise
+            if (self.use_lmr and quiet and depth >= 3 and legal > lmr_moves
+                    and alpha > -inf and not checked and not in_check(child)):
+                self.stats.reductions += 1
+                score = -self.negamax(child, depth - 2, -alpha - window,
+                                      -alpha, ply + 1)
+                if score > alpha:
+                    self.stats.researches += 1
+                    score = -self.negamax(child, depth - 1, -beta, -alpha,
+                                          ply + 1)
+            else:
+                score = -self.negamax(child, depth - 1, -beta, -alpha,
+                                      ply + 1)
+            if score > best_score:
+                best_score, best_move = score, move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                self.stats.cutoffs += 1
+                if legal == 1:
+                    self.stats.first_move_cutoffs += 1
+                if is_quiet(move):
+                    self.update_quiet(board, move, depth, ply)
+                break
+
+        # Checkmate or stalemate. Nearer mates score higher.
+        if legal == 0:
+            return -mate_value + ply if in_check(board) else 0
+
+        if best_score <= alpha_orig:
+            flag = upper
+        elif best_score >= beta:
+            flag = lower
+        else:
+            flag = exact
+        if ply == 0:
+            self.root_move = best_move
+        self.tt[key] = (depth, best_score, flag, best_move)
+        return best_score
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for the search's pruning switches: node counts over a set of
+positions, and self-play matches between two configurations. Matches can
+give each move a node budget instead of a depth, which makes them
+reproducible on any machine.
+
+    python selfplay.py nodes --depth 3 --positions 4
+    python selfplay.py match --depth 2 --games 4 --without lmr futility
+    python selfplay.py match --games 2 --pgn games.pgn
+    python selfplay.py match --games 4 --nnue nnue.npz
+    python selfplay.py match --games 4 --nodes 500
+    python selfplay.py multipv --depth 3 --positions 2
+"""
+
+# Imports
+import argparse
+from random import Random
+from time import perf_counter
+from classes import Chessboard
+from search import Searcher, make_move, in_check
+from simulate import get_all_moves
+from pgn import write_game
+
+# Constants
+switches = ['null_move', 'lmr', 'futility']
+max_plies = 200 # Adjudicate as a draw after this many plies
+budget_depth = 20 # Depth limit of searches with a node budget
+
+
+# Functions
+def random_opening(plies, seed):
+    """Returns a board after plies random legal moves from the start."""
+    board = Chessboard()
+    board.full_set_up()
+    rng = Random(seed)
+    for i in range(plies):
+        children = [make_move(board, move) for move in get_all_moves(board)]
+        children = [child for child in children if child]
+        if not children:
+            break
+        board = rng.choice(children)
+    return board
+
+
+def play_game(board, white, black, depth, comments=None, budget=None):
+    """Plays board out between two Searchers, searching to depth or, with
+    a budget, that many nodes per move. Returns white's result (1, .5
+    or 0), a dict of nodes searched by each color and the final board. If
+    comments is a list, the score and time of each move are added to it."""
+    players = {'white': white, 'black': black}
+    nodes = {'white': 0, 'black': 0}
+    result = .5
+    for ply in range(max_plies):
+        if board.draw_check():
+            break
+        searcher = players[board.turn]
+        start = perf_counter()
+        if budget:
+            move, score = searcher.search(board, budget_depth, nodes=budget)
+        else:
+            move, score = searcher.search(board, depth)
+        nodes[board.turn] += searcher.stats.nodes
+        if move is None:
+            if in_check(board):
+                result = 0 if board.turn == 'white' else 1
+            break
+        if comments is not None:
+            comments += ["{:+.1f}/{} {:.2f}s".format(
+                score, searcher.depth_done, perf_counter() - start)]
+        board = make_move(board, move)
+    return result, nodes, board
+
+
+def match(config_a, config_b, games, depth, opening_plies=4, seed=0,
+          pgn=None, nodes=None):
+    """Plays games between Searcher(**config_a) and Searcher(**config_b),
+    swapping colors on each random opening, with play_game's depth or node
+    budget. Returns A's score and the total nodes searched by each side.
+    Games are written to the file pgn, if given, with each move's score and
+    time as comments."""
+    score_a, nodes_a, nodes_b = 0, 0, 0
+    for game in range(games):
+        board = random_opening(opening_plies, seed + game // 2)
+        a, b = Searcher(**config_a), Searcher(**config_b)
+        comments = [None] * len(board.game_moves)
+        if game % 2 == 0:
+            result, searched, board = play_game(board, a, b, depth,
+                                                comments, nodes)
+            color_a, color_b = 'white', 'black'
+        else:
+            result, searched, board = play_game(board, b, a, depth,
+                                                comments, nodes)
+            result = 1 - result
+            color_a, color_b = 'black', 'white'
+        if pgn:
+            headers = {'Event': 'selfplay', 'Round': str(game + 1),
+                       color_a.title(): 'A', color_b.title(): 'B'}
+            pgn.write(write_game(board, headers, comments) + "\n")
+        score_a += result
+        nodes_a += searched[color_a]
+        nodes_b += searched[color_b]
+        print("Game {}: A scored {}".format(game + 1, result))
+    return score_a, nodes_a, nodes_b
+
+
+def compare_nodes(boards, depth):
+    """Searches each board with all switches on, each one off, and all off.
+    Returns a list of (label, nodes, seconds)."""
+    configs = [('all on', {})]
+    configs += [('no ' + name, {name: False}) for name in switches]
+    configs += [('all off', {name: False for name in switches})]
+    results = []
+    for label, config in configs:
+        nodes = 0
+        start = perf_counter()
+        for board in boards:
+            searcher = Searcher(**config)
+            searcher.search(board, depth)
+            nodes += searcher.stats.nodes
+        results += [(label, nodes, perf_counter() - start)]
+    return results
+
+
+def compare_multipv(boards, depth, ks=(1, 2, 4, 8)):
+    """Multi-PV searches of each board for each k. Returns a list of (k,
+    nodes, seconds), to compare against k separate searches."""
+    results = []
+    for k in ks:
+        nodes = 0
+        start = perf_counter()
+        for board in boards:
+            searcher = Searcher()
+            searcher.search_multipv(board, depth, k)
+            nodes += searcher.stats.nodes
+        results += [(k, nodes, perf_counter() - start)]
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('mode', choices=['nodes', 'match', 'multipv'])
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--positions', type=int, default=4)
+    parser.add_argument('--games', type=int, default=2)
+    parser.add_argument('--without', nargs='*', choices=switches, default=[],
+                        help="Switches turned off for side B of a match.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pgn', help="File to write match games to.")
+    parser.add_argument('--nodes', type=int, help="Node budget per move of "
+                        "a match, instead of --depth.")
+    parser.add_argument('--nnue', help="Network file side A of a match "
+                        "evaluates with, instead of score_position.")
+    args = parser.parse_args()
+
+    if args.mode == 'nodes':
+        boards = [random_opening(6, args.seed + i)
+                  for i in range(args.positions)]
+        for label, nodes, seconds in compare_nodes(boards, args.depth):
+            print("{:<14}{:>10} nodes{:>10.1f}s".format(label, nodes, seconds))
+    elif args.mode == 'multipv':
+        boards = [random_opening(6, args.seed + i)
+                  for i in range(args.positions)]
+        results = compare_multipv(boards, args.depth)
+        base = results[0][1]
+        for k, nodes, seconds in results:
+            print("k={:<4}{:>10} nodes ({:.1f}x k=1){:>10.1f}s".format(
+                k, nodes, nodes / base, seconds))
+    else:
+        from nnue import Network
+        config_a = {'evaluator': Network.load(args.nnue)} if args.nnue else {}
+        config_b = {name: False for name in args.without}
+        pgn = open(args.pgn, 'w') if args.pgn else None
+        score, nodes_a, nodes_b = match(config_a, config_b, args.games,
+                                        args.depth, seed=args.seed, pgn=pgn,
+                                        nodes=args.nodes)
+        if pgn:
+            pgn.close()
+        print("A ({}) scored {}/{}. Nodes: A {}, B {}".format(
+            'network' if args.nnue else 'all on', score, args.games, nodes_a,
+            nodes_b))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A transposition table in shared memory, so that search processes working
+on the same position share what they find instead of each filling a private
+dict. Entries live in a NumPy structured array on a
+multiprocessing.shared_memory block and are written without locks: each
+entry's key is stored XORed with its data, so an entry torn by two
+processes writing at once fails verification and reads as a miss.
+
+Run as a script, it benchmarks a parallel search, where helper processes
+search the same root as the main one, with private and with shared tables.
+
+    python shared_tt.py --depth 3 --jobs 4 --positions 2
+"""
+
+# Imports
+import argparse
+import struct
+import numpy as np
+from multiprocessing import Event, Process, Queue
+from multiprocessing.shared_memory import SharedMemory
+from time import perf_counter
+from classes import Chessboard
+from search import Searcher
+
+# Constants
+entry_type = np.dtype([('key', np.uint64), ('score', np.float64),
+                       ('depth', np.int16), ('bound', np.int8),
+                       ('move', np.uint16)], align=True)
+default_entries = 2 ** 18 # 6 MB
+no_move = 0 # Never a real move: origin and destination are the same
+
+
+# Functions
+def data_word(depth, score, bound, move):
+    """The entry's data packed into 64 bits, to XOR with its key."""
+    score_bits = struct.unpack('<Q', struct.pack('<d', score))[0]
+    return score_bits ^ (move | bound << 16 | (depth & 0xffff) << 24)
+
+
+def search_worker(fen, depth, index, table, stop, results):
+    """Searches the position in fen with table, or a private dict if None,
+    and puts (index, move, score, nodes) on results. Worker 0 is the main
+    one. Helpers stop once stop is set, and every other one searches a ply
+    deeper so that the helpers don't all walk the same tree in step."""
+    board = Chessboard()
+    board.full_set_up('fen', fen=fen)
+    searcher = Searcher(tt=table)
+    if index == 0:
+        move, score = searcher.search(board, depth)
+    else:
+        move, score = searcher.search(board, depth + index % 2,
+                                      StopSignal(stop))
+    results.put((index, move, score, searcher.stats.nodes))
+
+
+def parallel_search(board, depth, jobs, shared=True, entries=default_entries):
+    """Searches board with jobs processes. Returns the main process's move
+    and score, the seconds until it was done, its nodes and the nodes of
+    all processes together."""
+    table = SharedTable(entries) if shared else None
+    stop, results = Event(), Queue()
+    fen = board.get_fen()
+    workers = [Process(target=search_worker,
+                       args=(fen, depth, i, table, stop, results))
+               for i in range(jobs)]
+    start = perf_counter()
+    for worker in workers:
+        worker.start()
+    nodes = {}
+    while 0 not in nodes:
+        index, move, score, count = results.get()
+        nodes[index] = count
+        if index == 0:
+            best_move, best_score = move, score
+    seconds = perf_counter() - start
+    stop.set()
+    while len(nodes) < jobs:
+        index, move, score, count = results.get()
+        nodes[index] = count
+    for worker in workers:
+        worker.join()
+    if table:
+        table.close()
+        table.unlink()
+    return best_move, best_score, seconds, nodes[0], sum(nodes.values())
+
+
+# Classes
+class SharedTable:
+    """A fixed size transposition table in shared memory, used like the
+    Searcher's dict: get(key) returns (depth, score, flag, move) or None,
+    and table[key] = (depth, score, flag, move) stores an entry. Each key
+    has one slot, and a store always replaces what is there.
+
+    The process that makes the table owns the memory block and should
+    unlink it when done. Pickling a table, as when handing it to a Process,
+    attaches to the same block by name."""
+    def __init__(self, entries=default_entries, name=None):
+        # A power of two, so the slot is the low bits of the key
+        self.size = 1 << max(int(entries) - 1, 1).bit_length()
+        if name is None:
+            self.memory = SharedMemory(create=True,
+                                       size=self.size * entry_type.itemsize)
+        else:
+            self.memory = SharedMemory(name=name)
+        self.entries = np.ndarray((self.size,), dtype=entry_type,
+                                  buffer=self.memory.buf)
+        if name is None:
+            self.entries[:] = 0
+
+    def __repr__(self):
+        return "SharedTable({} entries, {})".format(self.size,
+                                                    self.memory.name)
+
+    def __getstate__(self):
+        return self.size, self.memory.name
+
+    def __setstate__(self, state):
+        size, name = state
+        self.__init__(size, name)
+
+    def __len__(self):
+        return self.size
+
+    def get(self, key, default=None):
+        """The entry stored for key, or default if the slot holds another
+        position or a torn write."""
+        entry = self.entries[key & (self.size - 1)]
+        depth, score = int(entry['depth']), float(entry['score'])
+        bound, move = int(entry['bound']), int(entry['move'])
+        if int(entry['key']) ^ data_word(depth, score, bound, move) != key:
+            return default
+        return depth, score, bound, (move if move != no_move else None)
+
+    def __setitem__(self, key, value):
+        depth, score, bound, move = value
+        move = move if move is not None else no_move
+        self.entries[key & (self.size - 1)] = (
+            key ^ data_word(depth, score, bound, move), score, depth, bound,
+            move)
+
+    def clear(self):
+        self.entries[:] = 0
+
+    def close(self):
+        """Detaches this process from the memory block."""
+        del self.entries
+        self.memory.close()
+
+    def unlink(self):
+        """Frees the memory block once every process has closed it."""
+        self.memory.unlink()
+
+
+class StopSignal:
+    """Stands in for a TimeManager in helper searches: they run until the
+    event is set, which the main search does when it finishes."""
+    def __init__(self, event):
+        self.event = event
+        self.started = None
+
+    def start(self, in_check=False):
+        self.started = perf_counter()
+
+    def elapsed(self):
+        return perf_counter() - self.started if self.started else 0.0
+
+    def extend(self, factor=None):
+        pass
+
+    def can_start_iteration(self):
+        return not self.event.is_set()
+
+    def out_of_time(self):
+        return self.event.is_set()
+
+
+if __name__ == "__main__":
+    from selfplay import random_opening
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--positions', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--entries', type=int, default=default_entries)
+    args = parser.parse_args()
+
+    boards = [random_opening(6, args.seed + i)
+              for i in range(args.positions)]
+    runs = [('1 process', 1, False),
+            ('private tables', args.jobs, False),
+            ('shared table', args.jobs, True)]
+    for name, jobs, shared in runs:
+        seconds, main_nodes, all_nodes = 0, 0, 0
+        for board in boards:
+            result = parallel_search(board, args.depth, jobs, shared,
+                                     args.entries)
+            seconds += result[2]
+            main_nodes += result[3]
+            all_nodes += result[4]
+        print("{:<16}{:>8.1f}s{:>10} main nodes{:>10} total nodes".format(
+            name, seconds, main_nodes, all_nodes))
@@ -7,51 +7,49 @@ Logic for simulating and scoring moves.
 
 # Imports
 import copy as c
-import pandas as pd
 import sys, os
-
-# Constants:
-pvals = {'pawn':1,
-        'bishop':3,
-        'knight':3,
-        'rook':5,
-        'queen':9,
-        'king':9}
+from itertools import islice
+from classes import (move_orig, move_dest, encode_move, capture_move,
+                     en_passant, promotion_move, promotion_capture)
+from evaluation import (pvals, positional_score, pawn_score, weights,
+                        feature_names, material_names)
 
 # Top level functions;
-def score_position(board, printer=True):
-    """Given a board, scores the position of the player who just moved."""
-    score = 0
-    targeting_diff = 0
-    targeted_diff = 0
-    backup_diff = 0
-    center_diff = 0
-    capture_diff = 0
-    mate_score = 0
+def position_terms(board):
+    """The unweighted terms of score_position for the player who just moved,
+    keyed by evaluation.feature_names, and whether that player is in check
+    (which stops the count) or has the other side checkmated."""
+    terms = {name: 0 for name in feature_names}
     check = False
+    mate = False
     dead_enemy_king = True # For simulations where the king is killed
 
+    # Material counts, piece placement and pawn structure come from the
+    # board's running totals and the pawn cache
+    side = 1 if board.nonturn == 'white' else -1
+    for ptype in material_names:
+        terms[ptype] = (len(board.get_pieces([ptype], [board.nonturn])) -
+                        len(board.get_pieces([ptype], [board.turn])))
+    terms['placement'] = side * positional_score(board)
+    terms['pawn_structure'] = side * pawn_score(board)
+
     # First loop on opposition's pieces: skip the person who just moved
-    for piece in board.alive:
-        if piece.color != board.turn:
-            continue
-        capture_diff -= pvals[piece.type] * 3
+    for piece in board.get_pieces(color=[board.turn]):
         # Part 1 of identifying if you won via checkmate.
         if piece.type == 'king':
             dead_enemy_king = False
             enemy_king = piece
-            enemy_king_moves = [(x, y) for move, x, y in piece.v_moves]
+            # Escapes are the king's moves to squares the mover doesn't attack
+            enemy_king_moves = [(x, y) for move, x, y in piece.v_moves
+                                if not board.is_attacked(move >> 6 & 63,
+                                                         board.nonturn)]
 
     # Now loop on person who just moved's pieces
-    for piece in board.alive:
-        if piece.color == board.turn:
-            continue
-        capture_diff += pvals[piece.type] * 3
+    for piece in board.get_pieces(color=[board.nonturn]):
         # Determine if in check. If so, sets score to -10000.
         if piece.type == 'king':
-            if piece.threats.len > 0:
+            if board.is_attacked(piece.sq, board.turn):
                 check = True
-                if printer: print("In check! Score is -1000")
                 break
         # Points for targeting their pieces (diff for backed up else 1)
         for ttype, x, y in piece.targets:
@@ -62,48 +60,56 @@ def score_position(board, printer=True):
                 diff = max((tval - pval), 0)
             else:
                 diff = tval
-            targeting_diff += (diff/2)
+            terms['targeting'] += diff
         # Points for being targeted. Checked.
         for ttype, x, y in piece.threats:
             tval = pvals[ttype]
             pval = pvals[piece.type]
             if piece.backups.len > 0:
-                diff = min((-pval + tval),0) * 2
+                diff = min((-pval + tval),0)
             else:
-                diff = -pval * 2
-            targeted_diff += diff
+                diff = -pval
+            terms['targeted'] += diff
         # Points for pieces being backed up. Checked.
         for backup, x, y in piece.backups:
             if piece.type != 'king':
-                pval = pvals[piece.type]
-                diff = pval * (1/20)
-                backup_diff += diff
+                terms['backups'] += pvals[piece.type]
         # Points for controlling the center/number of moves
         for move, x, y in piece.v_moves:
             if (x, y) in [(3, 3), (3, 4), (4, 3), (4, 4)]:
-                center_diff += .2
+                terms['center'] += 1
             else:
-                center_diff += .1
-            # Second part of checkmate logic
-            if not dead_enemy_king and (x, y) in enemy_king_moves:
-                enemy_king_moves.remove((x,y))
+                terms['mobility'] += 1
 
     # Final part of checkmate logic
     if (dead_enemy_king or
-            (len(enemy_king_moves) == 0 and enemy_king.threats.len > 0)):
-        mate_score = 500
-        if printer: "Checkmate detected!"
+            (len(enemy_king_moves) == 0 and
+             board.is_attacked(enemy_king.sq, board.nonturn))):
+        mate = True
+    return terms, check, mate
 
-    # Round everything to one decimal
-    targeting_diff = round(targeting_diff, 1)
-    targeted_diff = round(targeted_diff, 1)
-    backup_diff = round(backup_diff, 1)
-    center_diff = round(center_diff, 1)
-    capture_diff = round(capture_diff, 1)
+def score_position(board, printer=True):
+    """Given a board, scores the position of the player who just moved."""
+    terms, check, mate = position_terms(board)
+    w = weights
+    mate_score = 500 if mate else 0
+    if check and printer: print("In check! Score is -1000")
+
+    # Weigh, and round everything to one decimal
+    targeting_diff = round(terms['targeting'] * w['targeting'], 1)
+    targeted_diff = round(terms['targeted'] * w['targeted'], 1)
+    backup_diff = round(terms['backups'] * w['backups'], 1)
+    center_diff = round(terms['center'] * w['center'] +
+                        terms['mobility'] * w['mobility'], 1)
+    side = 1 if board.nonturn == 'white' else -1
+    capture_diff = round(side * board.material, 1) # Weighed by the board
+    positional_diff = round(terms['placement'] * w['placement'], 1)
+    pawn_diff = round(terms['pawn_structure'] * w['pawn_structure'], 1)
 
     # Print
     score = (targeting_diff + targeted_diff + backup_diff + center_diff \
-             + capture_diff + mate_score) if not check else -1000
+             + capture_diff + positional_diff + pawn_diff + mate_score) \
+             if not check else -1000
     if printer:
         print_part = "Points from {}: {}"
         print(print_part.format("targeting",str(targeting_diff)))
@@ -111,9 +117,79 @@ def score_position(board, printer=True):
         print(print_part.format("backups",str(backup_diff)))
         print(print_part.format("board control",str(center_diff)))
         print(print_part.format("captures",str(capture_diff)))
+        print(print_part.format("piece placement",str(positional_diff)))
+        print(print_part.format("pawn structure",str(pawn_diff)))
         print("Total score is: " + str(score))
     return (capture_diff, center_diff, backup_diff,
-            targeted_diff, targeting_diff, mate_score, score)
+            targeted_diff, targeting_diff, positional_diff, pawn_diff,
+            mate_score, score)
+
+def get_all_moves(board):
+    """Get all moves for current player's turn, as packed moves."""
+    mlist = []
+    for i in board.get_pieces(color=[board.turn]):
+        mlist += [move for move, x, y in i.v_moves]
+    return mlist
+
+def is_pseudo_legal(board, move):
+    """True if move is among the valid moves of a piece of the side to move.
+    Used to check moves remembered from other positions (hash, killers)."""
+    piece = board[move_orig(move)].occ
+    if not piece or piece.color != board.turn:
+        return False
+    return any(m == move for m, x, y in piece.v_moves)
+
+def staged_moves(board, hash_move=None, killers=(), history=None):
+    """Generator over the same moves as get_all_moves, in stages so that a
+    caller stopping early skips the later work: the hash move, winning
+    captures and promotions, killers, quiet moves (sorted by history, a
+    function of the move, if given) and finally losing captures."""
+    if hash_move is not None and is_pseudo_legal(board, hash_move):
+        yield hash_move
+    # Captures come straight from the targets lists filled in by the board
+    mine = board.get_pieces(color=[board.turn])
+    winning, losing, tactical = [], [], set()
+    for piece in mine:
+        pawn = piece.type == 'pawn'
+        for ttype, x, y in piece.targets:
+            victim = board[x, y].occ
+            if pawn and y in [0, 7]:
+                flag = promotion_capture + 3
+            else:
+                flag = capture_move if victim else en_passant
+            move = encode_move(piece.pos, (x, y), flag)
+            tactical.add(move)
+            rank = pvals[ttype] * 10 - pvals[piece.type]
+            if (pvals[ttype] >= pvals[piece.type] or not victim or
+                    victim.backups.len == 0):
+                winning += [(rank, move)]
+            else:
+                losing += [(rank, move)]
+        # Promotions without capture rank with the winning captures
+        if pawn:
+            for move, x, y in piece.v_moves:
+                if move >> 12 & promotion_move and move not in tactical:
+                    tactical.add(move)
+                    winning += [(pvals['queen'] * 10, move)]
+    for rank, move in sorted(winning, key=lambda i: i[0], reverse=True):
+        if move != hash_move:
+            yield move
+    # Killers: quiet moves that caused cutoffs in sibling positions
+    skip = tactical | {hash_move}
+    for move in killers:
+        if move is not None and move not in skip and \
+                is_pseudo_legal(board, move):
+            skip.add(move)
+            yield move
+    quiet = [move for piece in mine for move, x, y in piece.v_moves
+             if move >> 12 < capture_move and move not in skip]
+    if history:
+        quiet.sort(key=history, reverse=True)
+    for move in quiet:
+        yield move
+    for rank, move in sorted(losing, key=lambda i: i[0], reverse=True):
+        if move != hash_move:
+            yield move
 
 class Simulator:
     def __init__(self, cboard, gen1 = 3, gen2 = 2):
@@ -123,21 +199,20 @@ class Simulator:
         self.board = c.deepcopy(cboard)
 
     def get_all_moves(self):
-        """Get all moves for current player's turn. Returns list of tuple
-        tuples in the form of [((origin1),(dest1)),((o2),(dest2))]"""
-        board = self.board
-        mlist = []
-        for i in board.alive:
-            if i.color != board.turn:
-                continue
-            mlist += [((i.pos),(i.v_moves[j][1],i.v_moves[j][2])) \
-                      for j in range(i.v_moves.len)]
-        return mlist
-
-    def simulate(self):
-        """Given the current board, score all possible moves and rank them."""
+        """Get all moves for current player's turn."""
+        return get_all_moves(self.board)
+
+    def simulate(self, n=None, children=None):
+        """Given the current board, score all possible moves and rank them.
+        If n is given, only the first n moves from staged_moves are scored.
+        children, a list of (move, board after it) like the one a
+        TurnAnalysis keeps, saves making the moves again."""
+        import pandas as pd # Slow to import, and the search doesn't need it
         board = self.board
-        moves = self.get_all_moves()
+        if children is None:
+            children = [(move, None) for move in
+                        islice(staged_moves(board), n)]
+        moves = [move for move, child in children]
         df = pd.DataFrame({'orig':[(0,0)] * len(moves),
                            'dest':[(0,0)] * len(moves),
                            'score':[0] * len(moves),
@@ -146,42 +221,48 @@ class Simulator:
                            'targeting_score':[0] * len(moves),
                            'targeted_score':[0] * len(moves),
                            'backup_score':[0] * len(moves),
+                           'positional_score':[0] * len(moves),
+                           'pawn_score':[0] * len(moves),
+                           'move':[0] * len(moves),
                            })
-        for i, (origin, destination) in enumerate(moves):
-            temp_board = c.deepcopy(board)
-            temp_board.move_piece(temp_board[origin].occ, destination, True,
-                                  False, False)
-            cap, cent, back, targeted, targeting, mate_score, score = score_position(
-                    temp_board, printer=False)
-            df.loc[i,:] = [origin, destination, score, cap, cent, targeting,
-                  targeted, back]
+        for i, (move, temp_board) in enumerate(children):
+            if temp_board is None:
+                temp_board = c.deepcopy(board)
+                temp_board.play_move(move)
+            (cap, cent, back, targeted, targeting, positional, pawns,
+             mate_score, score) = score_position(temp_board, printer=False)
+            df.loc[i,:] = [move_orig(move), move_dest(move), score, cap, cent,
+                  targeting, targeted, back, positional, pawns, move]
         return df.sort_values('score', ascending=False).reset_index(drop=True)
 
-    def multi_level_simulate(self):
+    def multi_level_simulate(self, root=None, csv=None):
         """Runs simulate in nested loops! First simulates all moves for AI
         player. Then makes top 6 of those moves (at difficulty 9). Looks at all
         responses to those 6. Then makes top 3 responses to those (at diff 9).
         Finally looks at all moves available in response to those 3. Selects
-        the FIRST move with the highest MOVE 3 score."""
+        the FIRST move with the highest MOVE 3 score. root, a TurnAnalysis
+        of the board, supplies the first moves ready made. With fewer moves
+        than gen1 or gen2, all of them are made. Returns None if there are
+        no moves at all. Given csv, a path, writes every line looked at
+        there."""
+        import pandas as pd
         cols = ['m1_orig', 'm1_dest', 'm1_score',
                 'm2_orig', 'm2_dest', 'm2_score',
                 'orig', 'dest', 'score']
         results = pd.DataFrame({i:[] for i in cols})
-        df1 = self.simulate()
-        for i in range(self.gen1):
+        df1 = self.simulate(children=root.children if root else None)
+        if df1.empty:
+            return None
+        for i in range(min(self.gen1, len(df1))):
             copy1 = c.deepcopy(self.board)
-            copy1.move_piece(copy1[df1.loc[i,'orig']].occ,
-                              df1.loc[i,'dest'],
-                              True, False, False)
+            copy1.play_move(int(df1.loc[i, 'move']))
             sim1 = Simulator(copy1)
-            df2 = sim1.simulate() # Scores all responses to first move
-            for j in range(self.gen2):
+            df2 = sim1.simulate(self.n) # Scores responses to first move
+            for j in range(min(self.gen2, len(df2))):
                 copy2 = c.deepcopy(copy1)
-                copy2.move_piece(copy2[df2.loc[j,'orig']].occ,
-                                 df2.loc[j,'dest'],
-                                 True, False, False)
+                copy2.play_move(int(df2.loc[j, 'move']))
                 sim2 = Simulator(copy2)
-                df3 = sim2.simulate()
+                df3 = sim2.simulate(self.n)
                 for k in range(df3.shape[0]):
                     row = [df1.loc[i, 'orig'], df1.loc[i, 'dest'],
                            df1.loc[i, 'score'], df2.loc[j, 'orig'],
@@ -189,6 +270,10 @@ class Simulator:
                            df3.loc[k, 'orig'], df3.loc[k, 'dest'],
                            df3.loc[k, 'score']]
                     results.loc[len(results)] = row
+        if results.empty:
+            # No replies to look at, the first moves' scores decide
+            return df1.loc[0, 'orig'], df1.loc[0, 'dest']
         results = results.sort_values('score', ascending=False)
-        results.to_csv('ai_move_analysis.csv', index=False)
+        if csv:
+            results.to_csv(csv, index=False)
         return results.loc[0, 'm1_orig'], results.loc[0, 'm1_dest']
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Regression tests for mate.py.
+
+    python -m pytest test_mate.py
+"""
+
+# Imports
+from classes import Chessboard, move_to_text
+from mate import MateSearch
+
+
+# Functions
+def set_up(fen):
+    board = Chessboard()
+    board.full_set_up('fen', fen=fen)
+    return board
+
+
+def test_pawn_move_discovering_mate():
+    """d4-d5 opens the a1 bishop's diagonal onto the king, which the pawn
+    itself doesn't attack."""
+    solver = MateSearch()
+    found = solver.solve(set_up('6bk/7p/8/8/3P4/8/8/B1K5 w - - 0 1'), 2)
+    assert found is not None and solver.outcome == 'mate'
+    move, moves, line = found
+    assert (move_to_text(move), moves) == ('d4d5', 1)
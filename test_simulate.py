@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Regression tests for simulate.py.
+
+    python -m pytest test_simulate.py
+"""
+
+# Imports
+from classes import Chessboard
+from search import TurnAnalysis
+from simulate import Simulator
+
+
+# Functions
+def set_up(fen):
+    board = Chessboard()
+    board.full_set_up('fen', fen=fen)
+    return board
+
+
+def test_multi_level_simulate_with_fewer_moves_than_gen1():
+    """Black, in check, has one legal move, fewer than gen1."""
+    board = set_up('rnbqkbnr/ppppp1pp/5p2/7Q/4P3/8/PPPP1PPP/RNB1KBNR b KQkq '
+                   '- 1 2')
+    sim = Simulator(board, 2, 1)
+    assert sim.multi_level_simulate(TurnAnalysis(board)) == ((6, 6), (6, 5))
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Time management for searching under a clock. A TimeManager turns the time
+left, the increment and the moves to go into a soft limit, checked between
+iterations of the search, and a hard limit at which the search is stopped
+mid-iteration.
+"""
+
+# Imports
+from time import perf_counter
+
+# Constants
+default_moves_to_go = 30 # Assumed when the clock doesn't say
+increment_share = .75 # Part of the increment spent on every move
+hard_factor = 4 # Hard limit as a multiple of the soft one
+max_share = .4 # Most of the remaining time one move may take
+overhead = .05 # Seconds kept back for making the move and output
+min_time = .01
+check_extension = 1.3 # Soft limit multiplier when starting in check
+instability_extension = 1.4 # Multiplier when the best move changes
+next_iteration_share = .5 # An iteration usually costs more than all before
+
+
+# Classes
+class TimeManager:
+    """Think time for one move. Give remaining (seconds on the clock) with
+    increment and moves_to_go, or a fixed move_time, or neither to search
+    until stop() is called."""
+    def __init__(self, remaining=None, increment=0, moves_to_go=None,
+                 move_time=None):
+        if move_time is not None:
+            self.soft = self.hard = max(move_time - overhead, min_time)
+        elif remaining is not None:
+            moves = max(moves_to_go or default_moves_to_go, 1)
+            self.soft = remaining / moves + increment * increment_share
+            self.hard = min(self.soft * hard_factor, remaining * max_share)
+            self.hard = max(self.hard - overhead, min_time)
+            self.soft = min(self.soft, self.hard)
+        else:
+            self.soft = self.hard = float('inf')
+        self.started = None
+        self.stopped = False
+
+    def __repr__(self):
+        return "TimeManager(soft={:.2f}s, hard={:.2f}s)".format(self.soft,
+                                                              self.hard)
+
+    def start(self, in_check=False):
+        """Starts the clock. Positions in check get more time."""
+        self.started = perf_counter()
+        if in_check:
+            self.extend(check_extension)
+
+    def elapsed(self):
+        return perf_counter() - self.started if self.started else 0.0
+
+    def extend(self, factor=instability_extension):
+        """Raises the soft limit, never past the hard one. Called when the
+        best move changes between iterations."""
+        self.soft = min(self.soft * factor, self.hard)
+
+    def stop(self):
+        """Makes the search stop as soon as it next checks the time."""
+        self.stopped = True
+
+    def can_start_iteration(self):
+        """False once another iteration would likely run past the soft
+        limit."""
+        return (not self.stopped and
+                self.elapsed() < self.soft * next_iteration_share)
+
+    def out_of_time(self):
+        """True once the hard limit is reached or stop() was called."""
+        return self.stopped or self.elapsed() >= self.hard
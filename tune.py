@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Texel-style tuning of the weights in evaluation.weights. First the terms of
+score_position are extracted for every position of PGN or EPD files (EPD
+positions need a c9 opcode with the game result) by a pool of worker
+processes, and appended as float32 rows to a matrix file that is read back
+as a NumPy memmap, so the data set never has to fit in memory. Then the
+weights are fitted by gradient descent, in chunks of rows at a time, so that
+a sigmoid of the evaluation predicts the game results. The weights are
+written as JSON to evaluation.weights_file, which is loaded on import.
+
+The nnue modes do the same for nnue.Network: positions are stored as their
+piece features with score_position's score, and the network learns a blend
+of the results and of score_position, which it starts out imitating.
+
+    python tune.py extract games.pgn --matrix positions.f32 --jobs 4
+    python tune.py fit --matrix positions.f32 --epochs 20
+    python tune.py nnue-extract games.pgn --matrix network.dat
+    python tune.py nnue-train --matrix network.dat --epochs 20
+"""
+
+# Imports
+import argparse
+import json
+import os
+import sys
+from itertools import islice
+from multiprocessing import Pool
+from time import perf_counter
+import numpy as np
+from analyze import read_positions, batch_size
+from classes import Chessboard
+from evaluation import feature_names, default_weights, weights_file
+from nnue import Network, board_features, feature_count, network_file
+from simulate import position_terms, score_position
+
+# Constants
+columns = len(feature_names) + 1 # The game result for white comes last
+result_values = {'1-0': 1.0, '0-1': 0.0, '1/2-1/2': 0.5}
+skip_plies = 8 # Opening positions say little about the result
+chunk_rows = 2 ** 16 # Rows handled at a time when fitting
+default_rate = .01
+network_batch = 1024 # Rows per training step of the network
+network_rate = .003
+default_blend = .5 # Share of the game result in the network's target
+default_scale = .03 # Sigmoid scale for the network, if not fitted
+# A network position: its features, padded with feature_count, which the
+# training gives a zero row, then score_position's score for white and the
+# result
+network_row_type = np.dtype([('features', np.int16, 32),
+                             ('score', np.float32), ('result', np.float32)])
+
+
+# Functions
+def result_value(text):
+    """1, .5 or 0 for a game result like '1-0' or '0.5', None if unknown."""
+    if text in result_values:
+        return result_values[text]
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def task_board(task):
+    """The board and result of a (position id, FEN, extra fields) task, or
+    None for positions without a result or in the opening."""
+    position_id, fen, extra = task
+    result = result_value(extra.get('result'))
+    if result is None:
+        return None
+    board = Chessboard()
+    try:
+        board.full_set_up('fen', fen=fen)
+    except (ValueError, KeyError, IndexError):
+        return None
+    if board.turn_num <= skip_plies:
+        return None
+    return board, result
+
+
+def feature_row(task):
+    """The row of a task: the terms of score_position from white's side,
+    then the result. None for the positions task_board skips, and those
+    with a king in check or mated, where score_position doesn't use the
+    terms."""
+    found = task_board(task)
+    if not found:
+        return None
+    board, result = found
+    terms, check, mate = position_terms(board)
+    if check or mate:
+        return None
+    side = 1 if board.nonturn == 'white' else -1
+    return [side * terms[name] for name in feature_names] + [result]
+
+
+def network_row(task):
+    """The network_row_type row of a task, as a tuple. Skips positions like
+    feature_row."""
+    found = task_board(task)
+    if not found:
+        return None
+    board, result = found
+    terms, check, mate = position_terms(board)
+    if check or mate:
+        return None
+    features = board_features(board)
+    features += [feature_count] * (32 - len(features))
+    side = 1 if board.nonturn == 'white' else -1
+    return features, side * score_position(board, printer=False)[-1], result
+
+
+def extract(tasks, path, jobs=None, make_row=feature_row, dtype=np.float32):
+    """Appends the rows make_row makes of tasks to the file at path, reading
+    only a few batches of tasks ahead. Returns the number of rows added."""
+    rows = 0
+    jobs = jobs or os.cpu_count() or 1
+    with Pool(jobs) as pool, open(path, 'ab') as f:
+        while True:
+            batch = list(islice(tasks, batch_size * jobs * 4))
+            if not batch:
+                break
+            found = [row for row in pool.imap(make_row, batch, batch_size)
+                     if row is not None]
+            if found:
+                np.array(found, dtype=dtype).tofile(f)
+                rows += len(found)
+    return rows
+
+
+def load_matrix(path):
+    """The matrix file as a read-only memmap, one row per position."""
+    return np.memmap(path, dtype=np.float32, mode='r').reshape(-1, columns)
+
+
+def split(rows):
+    """Features and results of some rows of the matrix, read into memory."""
+    rows = np.asarray(rows, dtype=np.float64)
+    return rows[:, :-1], rows[:, -1]
+
+
+def chunks(matrix):
+    """Generator over (features, results) of consecutive row chunks."""
+    for start in range(0, len(matrix), chunk_rows):
+        yield split(matrix[start:start + chunk_rows])
+
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+
+def predict(features, w, k):
+    """Predicted score for white: a sigmoid of the evaluation."""
+    return sigmoid(k * (features @ w))
+
+
+def loss(matrix, w, k):
+    """Mean squared error between predictions and results."""
+    total = 0.0
+    for features, results in chunks(matrix):
+        total += np.sum((results - predict(features, w, k)) ** 2)
+    return total / len(matrix)
+
+
+def fit_scale(matrix, w):
+    """The sigmoid scale that best fits the weights w, by a coarse search
+    then a finer one around the best value."""
+    candidates = np.logspace(-3, 0, 13)
+    for i in range(2):
+        errors = [loss(matrix, w, k) for k in candidates]
+        best = candidates[int(np.argmin(errors))]
+        candidates = best * np.logspace(-.25, .25, 11)
+    return best
+
+
+def fit(matrix, w, k, epochs, rate=default_rate, seed=0):
+    """Gradient descent with Adam steps on the loss, one step per chunk of
+    rows, with the chunks in a new random order each epoch. Returns the
+    fitted weights."""
+    rng = np.random.default_rng(seed)
+    w = np.array(w, dtype=np.float64)
+    m, v = np.zeros_like(w), np.zeros_like(w)
+    beta1, beta2, eps = .9, .999, 1e-8
+    starts = np.arange(0, len(matrix), chunk_rows)
+    step = 0
+    for epoch in range(epochs):
+        for start in rng.permutation(starts):
+            features, results = split(matrix[start:start + chunk_rows])
+            p = predict(features, w, k)
+            gradient = features.T @ ((p - results) * p * (1 - p)) * \
+                2 * k / len(results)
+            step += 1
+            m = beta1 * m + (1 - beta1) * gradient
+            v = beta2 * v + (1 - beta2) * gradient ** 2
+            w -= rate * (m / (1 - beta1 ** step)) / \
+                (np.sqrt(v / (1 - beta2 ** step)) + eps)
+        print("Epoch {}: loss {:.6f}".format(epoch + 1, loss(matrix, w, k)),
+              file=sys.stderr)
+    return w
+
+
+def train_network(network, data, epochs, rate=network_rate, k=default_scale,
+                  blend=default_blend, seed=0):
+    """Trains network on the network_row_type rows in data with Adam, one
+    step per batch of rows, towards a blend of the result and
+    score_position's score, both as sigmoids. Returns the mean loss of each
+    epoch."""
+    rng = np.random.default_rng(seed)
+    params = ['w1', 'b1', 'w2', 'b2', 'w3', 'b3']
+    values = {name: np.array(getattr(network, name), dtype=np.float64)
+              for name in params}
+    # The padding feature gets a zero row that's never trained
+    values['w1'] = np.vstack([values['w1'], np.zeros(values['w1'].shape[1])])
+    moments = {name: (np.zeros_like(values[name]),
+                      np.zeros_like(values[name])) for name in params}
+    beta1, beta2, eps = .9, .999, 1e-8
+    step = 0
+    losses = []
+    for epoch in range(epochs):
+        total = 0.0
+        for start in rng.permutation(np.arange(0, len(data), network_batch)):
+            rows = np.asarray(data[start:start + network_batch])
+            features = rows['features'].astype(np.intp)
+            target = blend * rows['result'] + \
+                (1 - blend) * sigmoid(k * rows['score'].astype(np.float64))
+            # Forward pass, as Network.output with unrounded weights
+            w1, b1, w2, b2, w3, b3 = [values[name] for name in params]
+            acc = b1 + w1[features].sum(axis=1)
+            hidden1 = np.clip(acc, 0, 1)
+            z2 = hidden1 @ w2 + b2
+            hidden2 = np.clip(z2, 0, 1)
+            p = sigmoid(k * (hidden2 @ w3 + b3))
+            total += np.sum((p - target) ** 2)
+            # Backward pass through the clipped ReLUs
+            d_out = 2 * (p - target) * p * (1 - p) * k / len(rows)
+            d2 = np.outer(d_out, w3) * ((z2 > 0) & (z2 < 1))
+            d1 = d2 @ w2.T * ((acc > 0) & (acc < 1))
+            grad_w1 = np.zeros_like(w1)
+            np.add.at(grad_w1, features, d1[:, None, :])
+            grad_w1[-1] = 0
+            grads = {'w1': grad_w1, 'b1': d1.sum(axis=0),
+                     'w2': hidden1.T @ d2, 'b2': d2.sum(axis=0),
+                     'w3': hidden2.T @ d_out, 'b3': d_out.sum()}
+            step += 1
+            for name in params:
+                m, v = moments[name]
+                m = beta1 * m + (1 - beta1) * grads[name]
+                v = beta2 * v + (1 - beta2) * grads[name] ** 2
+                moments[name] = m, v
+                values[name] = values[name] - rate * \
+                    (m / (1 - beta1 ** step)) / \
+                    (np.sqrt(v / (1 - beta2 ** step)) + eps)
+        losses += [total / len(data)]
+        print("Epoch {}: loss {:.6f}".format(epoch + 1, losses[-1]),
+              file=sys.stderr)
+    values['w1'] = values['w1'][:-1]
+    for name in params:
+        setattr(network, name, values[name])
+    network.b3 = float(network.b3)
+    network.quantize()
+    return losses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('mode', choices=['extract', 'fit', 'nnue-extract',
+                                         'nnue-train'])
+    parser.add_argument('inputs', nargs='*', help="PGN or EPD files, for "
+                        "extract.")
+    parser.add_argument('--matrix', default='positions.f32')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=None)
+    parser.add_argument('--output', help="Weights or network file. "
+                        "Defaults to the one the evaluator loads.")
+    parser.add_argument('--blend', type=float, default=default_blend)
+    args = parser.parse_args()
+
+    start = perf_counter()
+    if args.mode in ['extract', 'nnue-extract']:
+        rows = 0
+        for path in args.inputs:
+            if args.mode == 'extract':
+                rows += extract(read_positions(path), args.matrix, args.jobs)
+            else:
+                rows += extract(read_positions(path), args.matrix, args.jobs,
+                                network_row, network_row_type)
+        print("Extracted {} positions in {:.1f}s to {}.".format(
+            rows, perf_counter() - start, args.matrix), file=sys.stderr)
+    elif args.mode == 'nnue-train':
+        data = np.memmap(args.matrix, dtype=network_row_type, mode='r')
+        output = args.output or network_file
+        network = Network.load(output) if os.path.exists(output) else \
+            Network()
+        train_network(network, data, args.epochs,
+                      args.rate or network_rate, blend=args.blend)
+        network.save(output)
+        print("Wrote {} in {:.1f}s.".format(output, perf_counter() - start),
+              file=sys.stderr)
+    else:
+        matrix = load_matrix(args.matrix)
+        w = np.array([default_weights[name] for name in feature_names])
+        k = fit_scale(matrix, w)
+        print("{} positions, scale {:.4f}, loss {:.6f}".format(
+            len(matrix), k, loss(matrix, w, k)), file=sys.stderr)
+        w = fit(matrix, w, k, args.epochs, args.rate or default_rate)
+        output = args.output or weights_file
+        with open(output, 'w') as f:
+            json.dump(dict(zip(feature_names, w.round(4).tolist())), f,
+                      indent=4)
+        print("Wrote {} in {:.1f}s.".format(output, perf_counter() - start),
+              file=sys.stderr)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+A UCI (universal chess interface) front-end, so the search can be run from
+chess GUIs and tournament managers. Searches run in a thread so that 'stop'
+is handled while thinking, and clock times given with 'go' are handed to a
+TimeManager. 'go nodes' gives the search a node budget instead.
+
+    python uci.py
+"""
+
+# Imports
+import sys
+import threading
+from classes import Chessboard, move_to_text, text_to_move, start_fen
+from evaluation import pawn_units
+from search import Searcher, mate_value
+from timeman import TimeManager
+
+# Constants
+engine_name = 'chessjerk'
+max_depth = 64 # Depth limit of 'go' without one, time permitting
+max_multipv = 32
+
+
+# Functions
+def send(line):
+    print(line, flush=True)
+
+
+def uci_score(score):
+    """UCI score string for a search score: centipawns, or moves to mate."""
+    if abs(score) > mate_value / 2:
+        plies = int(mate_value - abs(score))
+        moves = (plies + 1) // 2
+        return "mate {}".format(moves if score > 0 else -moves)
+    return "cp {}".format(round(score * 100 / pawn_units))
+
+
+def parse_position(tokens):
+    """Board for the arguments of a 'position' command, or None if they hold
+    an unknown move."""
+    board = Chessboard()
+    if tokens[:1] == ['fen']:
+        end = tokens.index('moves') if 'moves' in tokens else len(tokens)
+        board.full_set_up('fen', fen=" ".join(tokens[1:end]))
+    else:
+        board.full_set_up('fen', fen=start_fen)
+    if 'moves' in tokens:
+        for text in tokens[tokens.index('moves') + 1:]:
+            move = text_to_move(board, text)
+            if move is None:
+                return None
+            board.play_move(move)
+    return board
+
+
+def parse_go(tokens, turn):
+    """Returns the depth, TimeManager and node budget (or None) for the
+    arguments of a 'go' command, for the side turn."""
+    values = {}
+    for i, token in enumerate(tokens[:-1]):
+        if tokens[i + 1].lstrip('-').isdigit():
+            values[token] = int(tokens[i + 1])
+    side = 'w' if turn == 'white' else 'b'
+    depth = values.get('depth', max_depth)
+    if 'infinite' in tokens:
+        timer = TimeManager()
+    elif 'movetime' in values:
+        timer = TimeManager(move_time=values['movetime'] / 1000)
+    elif side + 'time' in values:
+        timer = TimeManager(values[side + 'time'] / 1000,
+                            values.get(side + 'inc', 0) / 1000,
+                            values.get('movestogo'))
+    else:
+        timer = TimeManager() # Until 'stop', or until depth is reached
+    return depth, timer, values.get('nodes')
+
+
+# Classes
+class UCIEngine:
+    """Reads UCI commands and answers them. One search runs at a time."""
+    def __init__(self):
+        self.board = parse_position([])
+        self.searcher = Searcher()
+        self.timer = None
+        self.thread = None
+        self.multipv = 1
+
+    def think(self, depth, timer, nodes=None):
+        """Runs a search, reporting each iteration, then sends bestmove."""
+        searcher, board = self.searcher, self.board
+
+        def info(d, rank, score, pv):
+            ms = int(timer.elapsed() * 1000)
+            send("info depth {} multipv {} score {} nodes {} time {} pv {}"
+                 .format(d, rank, uci_score(score), searcher.stats.nodes, ms,
+                         " ".join(move_to_text(m) for m in pv)))
+
+        def report(d, move, score):
+            info(d, 1, score, searcher.principal_variation(board, d))
+
+        def report_lines(d, lines):
+            for rank, (move, score, pv) in enumerate(lines):
+                info(d, rank + 1, score, pv)
+
+        if self.multipv > 1:
+            lines = searcher.search_multipv(board, depth, self.multipv,
+                                            timer, report_lines, nodes)
+            move = lines[0][0] if lines else None
+        else:
+            move, score = searcher.search(board, depth, timer, report, nodes)
+        send("bestmove " + (move_to_text(move) if move is not None else
+                            "0000"))
+
+    def stop(self):
+        """Stops a running search, which then sends its bestmove."""
+        if self.thread:
+            self.timer.stop()
+            self.thread.join()
+            self.thread = None
+
+    def handle(self, line):
+        """Handles one command. Returns False on 'quit'."""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            send("id name " + engine_name)
+            send("id author the chessjerk authors")
+            send("option name MultiPV type spin default 1 min 1 max {}"
+                 .format(max_multipv))
+            send("uciok")
+        elif command == 'isready':
+            send("readyok")
+        elif command == 'setoption':
+            # setoption name MultiPV value 3
+            if len(args) == 4 and args[1].lower() == 'multipv' and \
+                    args[3].isdigit():
+                self.multipv = min(max(int(args[3]), 1), max_multipv)
+        elif command == 'ucinewgame':
+            self.stop()
+            self.searcher = Searcher()
+        elif command == 'position':
+            self.stop()
+            board = parse_position(args)
+            if board is None:
+                send("info string illegal move in position command")
+            else:
+                self.board = board
+        elif command == 'go':
+            self.stop()
+            depth, self.timer, nodes = parse_go(args, self.board.turn)
+            self.thread = threading.Thread(target=self.think,
+                                           args=(depth, self.timer, nodes))
+            self.thread.start()
+        elif command == 'stop':
+            self.stop()
+        elif command == 'quit':
+            self.stop()
+            return False
+        return True
+
+
+if __name__ == "__main__":
+    engine = UCIEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()